@@ -0,0 +1,326 @@
+"""
+Background writer for the JSONL access log.
+"""
+
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:     # optional, only needed for --log-compress zstd
+    zstandard = None
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 256            # entries written with one write() call
+DEFAULT_FLUSH_INTERVAL = 0.5        # seconds an entry may wait in the queue before it's written
+DEFAULT_SAMPLE_RATE = 10            # "sample" policy: keep 1 in this many entries while backed up
+WHEN_FULL_POLICIES = ("block", "drop", "sample")
+ROTATE_WHEN = ("hour", "day")
+COMPRESSIONS = ("gzip", "zstd", "none")
+DEFAULT_KEEP = 48                   # rotated segments kept before the oldest are deleted
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+PERIOD_FORMATS = {"hour": "%Y%m%d%H", "day": "%Y%m%d"}
+COMPRESS_DELAY = 2.0                # seconds other workers get to notice a rotation before the segment is compressed
+
+_STOP = object()
+
+class LogRotator:
+    """Rotates the access log by size and/or UTC hour or day.
+
+    A rotated segment is renamed to <name>.<UTC timestamp> and compressed
+    on a separate thread, so neither the handlers nor the log writer wait
+    for it. Only the newest `keep` segments are kept.
+
+    Several prefork workers append to the same file, so whoever notices
+    that a rotation is due renames it; the others see the inode change
+    (should_rotate() compares the path's inode with their open file's
+    before every batch) and just reopen the path. The segment is only
+    compressed COMPRESS_DELAY seconds later, so a batch another worker
+    was already writing when it was renamed still makes it in.
+    """
+    def __init__(self, path, max_bytes=0, when=None, compression="gzip", keep=DEFAULT_KEEP):
+        if when is not None and when not in ROTATE_WHEN:
+            raise ValueError(f"when must be one of {ROTATE_WHEN}, not {when!r}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"compression must be one of {COMPRESSIONS}, not {compression!r}")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.when = when
+        self.compression = compression
+        self.keep = keep
+        self.period = None
+        self.jobs = None
+        self.compressor = None
+
+    def current_period(self, timestamp=None):
+        if self.when is None:
+            return None
+        moment = datetime.fromtimestamp(timestamp if timestamp is not None else time.time(), timezone.utc)
+        return moment.strftime(PERIOD_FORMATS[self.when])
+
+    def open(self):
+        f = open(self.path, "ab", buffering=0)
+        stat_result = os.fstat(f.fileno())
+        # a file left over from before a restart belongs to the period it was last written in
+        self.period = self.current_period(stat_result.st_mtime if stat_result.st_size else None)
+        if self.jobs is None:
+            self.jobs = queue.Queue()
+            self.compressor = threading.Thread(target=self.compress_loop, name="access-log-compressor", daemon=True)
+            self.compressor.start()
+            for segment in self.segments():     # finish compression interrupted by a shutdown
+                if not self.is_compressed(segment):
+                    self.jobs.put((segment, time.monotonic() + COMPRESS_DELAY))
+        return f
+
+    def should_rotate(self, f, incoming):
+        # True if f has to be replaced before writing: a rotation is due, or another worker did one
+        if self.replaced(f):
+            return True
+        if self.max_bytes and os.fstat(f.fileno()).st_size + incoming > self.max_bytes:
+            return os.fstat(f.fileno()).st_size > 0     # a single huge batch still has to go somewhere
+        return self.when is not None and self.current_period() != self.period
+
+    def replaced(self, f):
+        # has the path been renamed (or deleted) from under f?
+        try:
+            return os.stat(self.path).st_ino != os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def rotate(self, f):
+        if not self.replaced(f):    # it's up to us to rename it
+            stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+            segment = self.path.with_name(f"{self.path.name}.{stamp}-{os.getpid()}")
+            try:
+                os.rename(self.path, segment)
+                self.jobs.put((segment, time.monotonic() + COMPRESS_DELAY))
+            except FileNotFoundError:   # another worker rotated it first
+                pass
+        f.close()
+        return self.open()
+
+    def segments(self):
+        # rotated segments, oldest first (the timestamps sort as text)
+        return sorted(p for p in self.path.parent.glob(self.path.name + ".*")
+                      if not p.name.endswith(".tmp"))
+
+    def is_compressed(self, segment):
+        return any(suffix and segment.name.endswith(suffix) for suffix in COMPRESSED_SUFFIXES.values())
+
+    def compress_loop(self):
+        while True:
+            job = self.jobs.get()
+            if job is _STOP:
+                return
+            segment, due = job
+            if self.compression != "none":
+                time.sleep(max(0, due - time.monotonic()))
+            try:
+                self.compress(segment)
+                self.enforce_retention()
+            except OSError as e:
+                print(f"access log rotation: {e}")
+
+    def compress(self, segment):
+        if self.compression == "none":
+            return
+        target = segment.with_name(segment.name + COMPRESSED_SUFFIXES[self.compression])
+        tmp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+        try:
+            with open(segment, "rb") as src, open(tmp, "wb") as raw:
+                if self.compression == "gzip":
+                    with gzip.GzipFile(fileobj=raw, mode="wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                else:
+                    with zstandard.ZstdCompressor().stream_writer(raw, closefd=False) as dst:
+                        shutil.copyfileobj(src, dst)
+        except FileNotFoundError:   # already compressed by another worker
+            return
+        os.replace(tmp, target)
+        segment.unlink(missing_ok=True)
+
+    def enforce_retention(self):
+        if self.keep <= 0:
+            return
+        segments = self.segments()
+        for old in segments[:-self.keep]:
+            old.unlink(missing_ok=True)
+
+    def close(self):
+        if self.jobs is not None:
+            self.jobs.put(_STOP)
+            self.compressor.join()
+            self.jobs = None
+
+class AccessLogWriter:
+    """Writes access log entries from a single background thread.
+
+    Handlers call write() with a dict, which only puts it on a bounded queue.
+    The writer thread serializes entries and appends them to the file in
+    batches, flushing when a batch fills up or flush_interval passes.
+
+    What happens when the queue is full depends on when_full:
+      block:  the handler waits for room (nothing is lost)
+      drop:   the entry is thrown away and counted in `dropped`
+      sample: once the queue is 3/4 full only 1 in sample_rate entries is
+              queued (the rest are counted in `sampled_out`); entries that
+              still don't fit are dropped
+
+    A sink (say a logcolumns.ColumnarSink) also gets every batch, on the
+    writer thread, after it has been written to the file.
+
+    If the file can't be opened or written (out of file descriptors, disk
+    full), the batch is counted in `dropped` and `write_errors`, and the
+    file is opened again for the next one; the thread keeps draining the
+    queue either way, so handlers never wait on a writer that has died.
+    """
+    def __init__(self, path, queue_size=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, when_full="block", sample_rate=DEFAULT_SAMPLE_RATE,
+                 rotator=None, sink=None):
+        if when_full not in WHEN_FULL_POLICIES:
+            raise ValueError(f"when_full must be one of {WHEN_FULL_POLICIES}, not {when_full!r}")
+        self.path = path
+        self.rotator = rotator      # a LogRotator, or None to let the file grow forever
+        self.sink = sink            # something with add(entries, now) and close(), or None
+        self.queue_size = max(1, queue_size)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.when_full = when_full
+        self.sample_rate = max(1, sample_rate)
+        self.high_water = self.queue_size * 3 // 4
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.write_errors = 0
+        self.f = None
+        self.sample_counter = 0
+        self.counter_lock = threading.Lock()   # the counters above are bumped by handlers and the writer thread
+        self.start_lock = threading.Lock()
+        self.queue = None
+        self.thread = None
+        self.pid = None
+
+    def ensure_started(self):
+        # Started lazily so that each prefork worker gets its own thread and queue
+        # (threads don't survive fork()).
+        if self.pid == os.getpid():
+            return
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(maxsize=self.queue_size)
+            self.thread = threading.Thread(target=self.run, name="access-log-writer", daemon=True)
+            self.thread.start()
+            self.pid = os.getpid()
+
+    def write(self, entry):
+        self.ensure_started()
+        if self.when_full == "block":
+            self.queue.put(entry)
+            return
+        if self.when_full == "sample" and self.queue.qsize() >= self.high_water:
+            with self.counter_lock:
+                self.sample_counter += 1
+                keep = self.sample_counter % self.sample_rate == 0
+                if not keep:
+                    self.sampled_out += 1
+            if not keep:
+                return
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            with self.counter_lock:
+                self.dropped += 1
+
+    def open(self):
+        return self.rotator.open() if self.rotator else open(self.path, "ab", buffering=0)
+
+    def run(self):
+        try:
+            batch = []
+            deadline = None
+            while True:
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                try:
+                    entry = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    entry = None
+                if entry is _STOP:
+                    self.write_batch(batch)
+                    return
+                if entry is not None:
+                    batch.append(entry)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                if len(batch) >= self.batch_size or (deadline is not None and time.monotonic() >= deadline):
+                    self.write_batch(batch)
+                    batch = []
+                    deadline = None
+        finally:
+            if self.f is not None:
+                self.f.close()
+                self.f = None
+            if self.rotator:
+                self.rotator.close()
+            if self.sink:
+                try:
+                    self.sink.close()
+                except (OSError, ValueError) as e:
+                    print(f"access log sink: {e}")
+
+    def write_batch(self, batch):
+        if not batch:
+            return
+        data = "".join(json.dumps(entry) + "\n" for entry in batch).encode("utf-8")
+        try:
+            if self.f is None:
+                self.f = self.open()
+            if self.rotator and self.rotator.should_rotate(self.f, len(data)):
+                self.f = self.rotator.rotate(self.f)
+            # one write() on an O_APPEND file, so batches from different processes don't interleave
+            self.f.write(data)
+        except OSError as e:
+            # lose this batch, not the writer thread: try a fresh file next time
+            if not self.write_errors:
+                print(f"access log: {e}")
+            with self.counter_lock:
+                self.write_errors += 1
+                self.dropped += len(batch)
+            if self.f is not None:
+                self.f.close()
+                self.f = None
+            return
+        with self.counter_lock:
+            self.written += len(batch)
+        if self.sink:
+            try:
+                self.sink.add(batch, time.monotonic())
+            except (OSError, ValueError) as e:  # the JSONL log is what matters; keep going
+                print(f"access log sink: {e}")
+
+    def close(self):
+        # Write out everything that's queued and stop the writer thread.
+        if self.pid != os.getpid():
+            return
+        self.queue.put(_STOP)
+        self.thread.join()
+        self.pid = None
+
+    def stats(self):
+        with self.counter_lock:
+            return {
+                "written": self.written,
+                "dropped": self.dropped,
+                "sampled_out": self.sampled_out,
+                "write_errors": self.write_errors,
+                "queued": self.queue.qsize() if self.queue is not None else 0,
+            }
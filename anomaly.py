@@ -0,0 +1,280 @@
+"""
+Real-time detection of scanning, traversal bursts and odd headers, fed by log_request().
+"""
+
+import math
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from logstats import SCANNER_PATHS, TRAVERSAL
+
+DEFAULT_WINDOW = 60.0           # seconds the rates and counts are taken over
+DEFAULT_SLICES = 6              # the rate window slides in steps of window / slices
+DEFAULT_RATE_THRESHOLD = 600    # requests per window from one IP
+DEFAULT_DISTINCT_PATHS = 100    # distinct paths per window from one IP (scanning)
+DEFAULT_NOT_FOUND = 50          # 404s per window from one IP (scanning)
+DEFAULT_TRAVERSAL = 5           # traversal-looking or 403'd requests per window from one IP
+DEFAULT_HEADER_ODDITIES = 20    # requests missing Host/User-Agent or with huge headers, per window
+DEFAULT_MAX_IPS = 4096          # IPs with their own counters; the least recently seen are forgotten
+SKETCH_WIDTH = 2048
+SKETCH_DEPTH = 4
+HLL_PRECISION = 7               # 2**7 one-byte registers: about 9% error, plenty for a threshold
+MAX_HEADER_VALUE = 4096         # a header value longer than this is odd
+HEADER_ATTACKS = re.compile(r"\$\{jndi:|\(\)\s*\{|<script|\.\./|\x00", re.IGNORECASE)
+MASK64 = (1 << 64) - 1
+INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
+ALERT_KINDS = ("rate", "scanning", "traversal", "header_anomaly", "header_injection")
+
+class SlidingCountMin:
+    """Count-min sketch of how often each key was seen in the last `window` seconds.
+
+    Counts go into one of `slices` sub-sketches by time, and `total` holds
+    their sum; when a slice's turn comes round again its counts are taken
+    out of total and it's cleared. So estimate() is one lookup per row and
+    the window slides in steps of window / slices. Like any count-min
+    sketch it can overestimate (when keys collide) but never underestimates.
+    """
+    def __init__(self, window=DEFAULT_WINDOW, slices=DEFAULT_SLICES, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.slice_length = window / slices
+        self.slices = [array("I", bytes(4 * width * depth)) for _ in range(slices)]
+        self.total = array("I", bytes(4 * width * depth))
+        self.current = 0
+        self.current_ends = None
+
+    def indexes(self, key):
+        # depth cells from two hashes (Kirsch-Mitzenmacher double hashing)
+        h1 = hash(key) & MASK64
+        h2 = (h1 >> 32) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def advance(self, now):
+        if self.current_ends is None:
+            self.current_ends = now + self.slice_length
+        expired = 0
+        while now >= self.current_ends and expired < len(self.slices):
+            self.current = (self.current + 1) % len(self.slices)
+            old = self.slices[self.current]
+            total = self.total
+            for i, count in enumerate(old):
+                if count:
+                    total[i] -= count
+            self.slices[self.current] = array("I", bytes(4 * self.width * self.depth))
+            self.current_ends += self.slice_length
+            expired += 1
+        if now >= self.current_ends:    # idle for longer than the whole window
+            self.current_ends = now + self.slice_length
+
+    def add(self, key, now):
+        # count one more key and return its estimated count over the window
+        self.advance(now)
+        current, total = self.slices[self.current], self.total
+        estimate = None
+        for i in self.indexes(key):
+            current[i] += 1
+            total[i] += 1
+            if estimate is None or total[i] < estimate:
+                estimate = total[i]
+        return estimate
+
+class HyperLogLog:
+    """Estimates how many distinct values were added, in 2**precision bytes.
+
+    The sum the estimate is based on is kept up to date as registers
+    change, so estimate() doesn't have to look at all of them.
+    """
+    __slots__ = ("precision", "registers", "inverse_sum", "zeros")
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+        self.clear()
+
+    def add(self, value):
+        # returns True if the estimate changed
+        h = hash(value) & MASK64
+        index = h & ((1 << self.precision) - 1)
+        rank = (64 - self.precision) - (h >> self.precision).bit_length() + 1
+        old = self.registers[index]
+        if rank <= old:
+            return False
+        self.registers[index] = rank
+        self.inverse_sum += INVERSE_POWERS[rank] - INVERSE_POWERS[old]
+        if not old:
+            self.zeros -= 1
+        return True
+
+    def clear(self):
+        m = len(self.registers)
+        self.registers = bytearray(m)
+        self.inverse_sum = float(m)     # sum of 2 ** -register
+        self.zeros = m
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.709 if m == 64 else 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / self.inverse_sum
+        if raw <= 2.5 * m and self.zeros:
+            return m * math.log(m / self.zeros)     # small-range correction (linear counting)
+        return raw
+
+class ClientWindow:
+    """One IP's counters for the current window."""
+    __slots__ = ("started", "paths", "distinct", "not_found", "traversal", "header_oddities", "alerted")
+
+    def __init__(self, now):
+        self.paths = HyperLogLog()
+        self.alerted = {}   # alert kind -> when it was last raised
+        self.reset(now)
+
+    def reset(self, now):
+        self.started = now
+        self.paths.clear()
+        self.distinct = 0
+        self.not_found = 0
+        self.traversal = 0
+        self.header_oddities = 0
+
+class AnomalyDetector:
+    """Watches every logged request for clients that look like they're attacking.
+
+    It raises an alert (one JSON object, written by `sink`) when, within
+    `window` seconds, one IP:
+      rate:         makes more than rate_threshold requests (a sliding
+                    count-min sketch over all IPs)
+      scanning:     asks for more than distinct_paths different paths (a
+                    HyperLogLog per IP) or gets more than not_found 404s
+      traversal:    sends more than `traversal` requests with "..", encoded
+                    slashes or NULs in the path, or that got a 403
+      header_anomaly: sends more than header_oddities requests missing Host
+                    or User-Agent, or with a huge header value
+    and at once for a request whose headers carry an exploit payload
+    (log4j lookups, shellshock, script tags, traversal) - "header_injection".
+    Each kind is raised at most once per window per IP.
+
+    The per-IP counters are kept for at most max_ips addresses (the least
+    recently seen are dropped), and the sketch is a fixed size, so memory
+    doesn't depend on how many clients show up. Each request costs a few
+    hash lookups under one lock.
+    """
+    def __init__(self, sink, window=DEFAULT_WINDOW, rate_threshold=DEFAULT_RATE_THRESHOLD,
+                 distinct_paths=DEFAULT_DISTINCT_PATHS, not_found=DEFAULT_NOT_FOUND, traversal=DEFAULT_TRAVERSAL,
+                 header_oddities=DEFAULT_HEADER_ODDITIES, max_ips=DEFAULT_MAX_IPS):
+        self.sink = sink            # something with write(dict), like an AccessLogWriter
+        self.window = window
+        self.rate_threshold = rate_threshold
+        self.distinct_paths = distinct_paths
+        self.not_found = not_found
+        self.traversal = traversal
+        self.header_oddities = header_oddities
+        self.max_ips = max(1, max_ips)
+        self.rates = SlidingCountMin(window)
+        self.clients = OrderedDict()
+        self.lock = threading.Lock()
+        self.observed = 0
+        self.evictions = 0
+        self.alerts = dict.fromkeys(ALERT_KINDS, 0)
+
+    def observe(self, entry):
+        ip = entry.get("ip") or "-"
+        path = entry.get("path") or "-"
+        status = entry.get("status") or 0
+        headers = entry.get("headers")
+        # the checks that only look at this request, done before taking the lock
+        traversal = status == 403 or (path != "-" and TRAVERSAL.search(path) is not None)
+        injection = bool(headers) and HEADER_ATTACKS.search("\n".join(headers.values())) is not None
+        odd = 0 < status < 400 and self.odd_headers(headers)    # error responses are logged without headers
+        now = time.monotonic()
+        raised = []
+        with self.lock:
+            self.observed += 1
+            client = self.client(ip, now)
+            rate = self.rates.add(ip, now)
+            if rate > self.rate_threshold:
+                raised.append(("rate", rate, self.rate_threshold))
+            if path != "-" and client.paths.add(path.split("?", 1)[0]):
+                client.distinct = client.paths.estimate()
+            if client.distinct > self.distinct_paths:
+                raised.append(("scanning", round(client.distinct), self.distinct_paths))
+            if status == 404:
+                client.not_found += 1
+                if client.not_found > self.not_found:
+                    raised.append(("scanning", client.not_found, self.not_found))
+            if traversal:
+                client.traversal += 1
+                if client.traversal > self.traversal:
+                    raised.append(("traversal", client.traversal, self.traversal))
+            if injection:
+                raised.append(("header_injection", 1, 1))
+            if odd:
+                client.header_oddities += 1
+                if client.header_oddities > self.header_oddities:
+                    raised.append(("header_anomaly", client.header_oddities, self.header_oddities))
+            raised = [alert for alert in raised if self.first_in_window(client, alert[0], now)]
+        for kind, value, threshold in raised:
+            self.raise_alert(kind, entry, value, threshold)
+
+    def client(self, ip, now):
+        # caller holds self.lock
+        client = self.clients.get(ip)
+        if client is None:
+            if len(self.clients) >= self.max_ips:
+                self.clients.popitem(last=False)
+                self.evictions += 1
+            client = self.clients[ip] = ClientWindow(now)
+        else:
+            self.clients.move_to_end(ip)
+            if now - client.started >= self.window:
+                client.reset(now)
+        return client
+
+    def odd_headers(self, headers):
+        if not headers:
+            return True
+        if "Host" not in headers or "User-Agent" not in headers:   # the usual spelling, or any other
+            names = {name.lower() for name in headers}
+            if "host" not in names or "user-agent" not in names:
+                return True
+        return max(map(len, headers.values())) > MAX_HEADER_VALUE
+
+    def first_in_window(self, client, kind, now):
+        # caller holds self.lock
+        last = client.alerted.get(kind)
+        if last is not None and now - last < self.window:
+            return False
+        client.alerted[kind] = now
+        return True
+
+    def raise_alert(self, kind, entry, value, threshold):
+        with self.lock:
+            self.alerts[kind] += 1
+        path = entry.get("path")
+        self.sink.write({
+            "ts": entry.get("ts"),
+            "alert": kind,
+            "ip": entry.get("ip"),
+            "value": value,
+            "threshold": threshold,
+            "window_s": self.window,
+            "path": path,
+            "status": entry.get("status"),
+            "scanner_path": bool(path and SCANNER_PATHS.search(path)),
+            "headers": entry.get("headers") or {},
+        })
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                "observed": self.observed,
+                "clients": len(self.clients),
+                "evictions": self.evictions,
+                "alerts": sum(self.alerts.values()),
+            }
+            for kind, count in self.alerts.items():
+                stats[f"alerts_{kind}"] = count
+            return stats
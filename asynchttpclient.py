@@ -0,0 +1,290 @@
+"""
+asyncio counterpart to httpclient.HTTPClient, for sending many requests at once.
+
+    python asynchttpclient.py requests.jsonl --concurrency 50
+
+reads one {"method": ..., "url": ..., "args": {...}} object per line (or
+from stdin when the file is "-") and prints one JSON result per line as
+each request finishes.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import zlib
+
+from httpclient import HTTPClient, HTTPResponse, decode_text, make_decoder
+
+DEFAULT_CONCURRENCY = 20        # requests in flight at once across all hosts
+DEFAULT_PER_HOST = 6            # connections open at once to one (host, port)
+DEFAULT_TIMEOUT = 10.0          # seconds for one request, including any wait for a free connection
+DEFAULT_MAX_IDLE_PER_HOST = 6   # idle keep-alive connections kept per (host, port)
+
+class FetchResult:
+    """The outcome of one request from fetch_many(): a response or the error that stopped it."""
+    __slots__ = ("index", "method", "url", "response", "error", "elapsed")
+
+    def __init__(self, index, method, url, response=None, error=None, elapsed=0.0):
+        self.index = index          # position in the request set
+        self.method = method
+        self.url = url
+        self.response = response    # HTTPResponse, or None if the request failed
+        self.error = error
+        self.elapsed = elapsed      # seconds, including time spent waiting for a connection
+
+    def as_dict(self):
+        result = {"index": self.index, "method": self.method, "url": self.url,
+                  "elapsed_ms": round(self.elapsed * 1000, 3)}
+        if self.response is not None:
+            result["code"] = self.response.code
+            result["length"] = len(self.response.body)
+        else:
+            result["error"] = type(self.error).__name__
+            if str(self.error):
+                result["error"] += f": {self.error}"
+        return result
+
+def header(headers, name, default=None):
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return default
+
+def normalize_request(request):
+    # (method, url[, args]) or {"method": ..., "url": ..., "args": ...}
+    if isinstance(request, dict):
+        return request.get("method", "GET").upper(), request["url"], request.get("args") or {}
+    method, url, *rest = request
+    return method.upper(), url, (rest[0] if rest else None) or {}
+
+def decompress_body(body, content_encoding):
+    decoder = make_decoder(content_encoding)
+    if decoder is None:
+        return body
+    try:
+        return decoder.decompress(body) + decoder.flush()
+    except zlib.error:
+        if content_encoding.strip().lower() != "deflate":
+            raise
+        # some servers send raw deflate without the zlib wrapper
+        decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+        return decoder.decompress(body) + decoder.flush()
+
+async def read_header_block(reader):
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):  # headers end with a blank line
+            return headers
+        key, _, value = line.decode("iso-8859-1").partition(":")
+        headers[key.strip()] = value.strip()
+
+async def read_chunked(reader):
+    body = bytearray()
+    while True:
+        size_line = await reader.readline()
+        if not size_line:
+            raise ConnectionResetError("connection closed in the middle of a chunked body")
+        size = int(size_line.split(b";", 1)[0].strip(), 16)   # ignore chunk extensions
+        if size == 0:
+            await read_header_block(reader)     # trailers, if any
+            return bytes(body)
+        try:
+            body += await reader.readexactly(size)
+        except asyncio.IncompleteReadError:
+            raise ConnectionResetError("connection closed in the middle of a chunked body")
+        await reader.readline()     # the CRLF after each chunk
+
+async def read_response(reader, method, status_line):
+    # Read the rest of a response whose status line was already read, framed the same
+    # way StreamingResponse frames it. Returns (code, headers, body bytes, reusable).
+    while True:
+        version, code, *rest = status_line.decode("iso-8859-1").rstrip("\r\n").split(" ", 2)
+        code = int(code)
+        headers = await read_header_block(reader)
+        if 100 <= code < 200 and code != 101:   # interim response, the real one follows
+            status_line = await reader.readline()
+            continue
+        break
+    connection = header(headers, "Connection", "").lower()
+    reusable = "close" not in connection and (version == "HTTP/1.1" or "keep-alive" in connection)
+    if method == "HEAD" or code in (204, 304):
+        body = b""
+    elif "chunked" in header(headers, "Transfer-Encoding", "").lower():
+        body = await read_chunked(reader)
+    elif header(headers, "Content-Length") is not None:
+        try:
+            body = await reader.readexactly(int(header(headers, "Content-Length")))
+        except asyncio.IncompleteReadError as e:
+            body = e.partial
+            reusable = False    # cut short, the connection is done
+    else:
+        body = await reader.read()
+        reusable = False
+    return code, headers, body, reusable
+
+class AsyncHTTPClient:
+    """Sends requests over asyncio streams, with the same requests HTTPClient builds.
+
+    URLs, query strings and form bodies go through HTTPClient.build_GET and
+    build_POST, so both clients put exactly the same bytes on the wire.
+    At most per_host connections are open to any one (host, port); with
+    keep_alive, finished connections are kept for the next request to that
+    host, and one the server has dropped in the meantime is retried on a
+    fresh connection. timeout bounds each request as a whole.
+    """
+    def __init__(self, keep_alive=True, accept_encoding=True, per_host=DEFAULT_PER_HOST,
+                 timeout=DEFAULT_TIMEOUT, max_idle_per_host=DEFAULT_MAX_IDLE_PER_HOST):
+        self.builder = HTTPClient(keep_alive=keep_alive, accept_encoding=accept_encoding)
+        self.accept_encoding = accept_encoding
+        self.per_host = max(1, per_host)
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.host_slots = {}    # (host, port) -> Semaphore(per_host)
+        self.idle = {}          # (host, port) -> [(reader, writer)], most recently used last
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def command(self, command, url, args=None, keep_alive=None):
+        if command == "POST":
+            host, port, data, keep_alive = self.builder.build_POST(url, args, keep_alive)
+        elif command == "GET":
+            host, port, data, keep_alive = self.builder.build_GET(url, args, keep_alive)
+        else:
+            raise ValueError("not get or post")
+        return await asyncio.wait_for(self.send(command, host, port, data, keep_alive), self.timeout)
+
+    async def GET(self, url, args=None, keep_alive=None):
+        return await self.command("GET", url, args, keep_alive)
+
+    async def POST(self, url, args=None, keep_alive=None):
+        return await self.command("POST", url, args, keep_alive)
+
+    async def send(self, method, host, port, data, keep_alive):
+        key = (host, port)
+        slots = self.host_slots.get(key)
+        if slots is None:
+            slots = self.host_slots[key] = asyncio.Semaphore(self.per_host)
+        async with slots:
+            while True:
+                reader, writer, reused = await self.get_connection(key, keep_alive)
+                try:
+                    writer.write(data)
+                    await writer.drain()
+                    status_line = await reader.readline()
+                    if not status_line:
+                        raise ConnectionResetError("server closed the connection without responding")
+                    code, headers, body, reusable = await read_response(reader, method, status_line)
+                except ConnectionError:
+                    writer.close()
+                    if reused:
+                        continue    # stale idle connection, nothing was processed: try again
+                    raise
+                except BaseException:   # includes being cancelled by the timeout
+                    writer.close()
+                    raise
+                break
+            if keep_alive and reusable and len(self.idle.get(key, ())) < self.max_idle_per_host:
+                self.idle.setdefault(key, []).append((reader, writer))
+            else:
+                writer.close()
+        if self.accept_encoding:
+            body = decompress_body(body, header(headers, "Content-Encoding", ""))
+        return HTTPResponse(code, decode_text(body, header(headers, "Content-Type", "")), headers)
+
+    async def get_connection(self, key, keep_alive):
+        # returns (reader, writer, reused)
+        idle = self.idle.get(key) if keep_alive else None
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()  # the server closed it while it sat idle
+        reader, writer = await asyncio.open_connection(*key)
+        return reader, writer, False
+
+    async def fetch_many(self, requests, concurrency=DEFAULT_CONCURRENCY):
+        # Async generator over FetchResults, in the order the requests finish:
+        #     async for result in client.fetch_many(requests, concurrency=50):
+        #         ...
+        # requests can be any iterable (a generator reading a file, say); it's only
+        # consumed as fast as slots free up, so at most `concurrency` are in flight.
+        requests = iter(enumerate(requests))
+        pending = set()
+        try:
+            while True:
+                while len(pending) < concurrency:
+                    try:
+                        index, request = next(requests)
+                    except StopIteration:
+                        break
+                    pending.add(asyncio.ensure_future(self.fetch_one(index, request)))
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def fetch_one(self, index, request):
+        method, url, args = normalize_request(request)
+        start = time.perf_counter()
+        try:
+            response = await self.command(method, url, args)
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError, zlib.error) as e:
+            return FetchResult(index, method, url, error=e, elapsed=time.perf_counter() - start)
+        return FetchResult(index, method, url, response, elapsed=time.perf_counter() - start)
+
+    async def close(self):
+        idle, self.idle = self.idle, {}
+        writers = [writer for connections in idle.values() for reader, writer in connections]
+        for writer in writers:
+            writer.close()
+        for writer in writers:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+def read_requests(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+async def replay(f, concurrency, per_host, timeout, keep_alive):
+    async with AsyncHTTPClient(keep_alive=keep_alive, per_host=per_host, timeout=timeout) as client:
+        async for result in client.fetch_many(read_requests(f), concurrency=concurrency):
+            print(json.dumps(result.as_dict()), flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send a JSONL set of requests concurrently.")
+    parser.add_argument("requests", help='JSONL file of {"method", "url", "args"} objects, or - for stdin')
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="requests in flight at once (default %(default)s)")
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST,
+                        help="connections open at once to one host (default %(default)s)")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="seconds allowed for each request (default %(default)s)")
+    parser.add_argument("--no-keep-alive", action="store_true", help="use a new connection for every request")
+    args = parser.parse_args(argv)
+    f = sys.stdin if args.requests == "-" else open(args.requests)
+    try:
+        asyncio.run(replay(f, max(1, args.concurrency), args.per_host, args.timeout, not args.no_keep_alive))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+if __name__ == "__main__":
+    main()
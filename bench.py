@@ -0,0 +1,274 @@
+"""
+Load generator and latency benchmark for server.py.
+
+    python bench.py --mode threaded --concurrency 64 --duration 10 --sizes 1K:8,64K:2,1M:1
+
+starts server.py in the given mode in a scratch directory holding files of
+the requested sizes, keeps `concurrency` connections busy for `duration`
+seconds (after a warmup whose results are thrown away), and prints one JSON
+object with requests/sec and latency percentiles, overall and per path.
+With --url it benchmarks a server that's already running instead.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from asynchttpclient import read_response
+from histogram import Histogram
+from httpclient import HTTPClient
+
+DEFAULT_CONCURRENCY = 32
+DEFAULT_DURATION = 10.0
+DEFAULT_WARMUP = 1.0
+DEFAULT_SIZES = "1K:8,64K:2,1M:1"   # size:weight, the mix of files requested
+DEFAULT_TIMEOUT = 10.0              # seconds before a single request counts as an error
+STARTUP_TIMEOUT = 10.0              # seconds to wait for the server to accept connections
+SERVER = Path(__file__).resolve().with_name("server.py")
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+def parse_size(text):
+    text = text.strip().upper().rstrip("B")
+    unit = text[-1:] if text[-1:] in SIZE_UNITS else ""
+    return int(float(text[:len(text) - len(unit)]) * SIZE_UNITS[unit])
+
+def parse_mix(text):
+    # "1K:8,64K:2" -> [("1K", 8), ("64K", 2)]; a missing weight is 1
+    mix = []
+    for part in text.split(","):
+        name, _, weight = part.strip().partition(":")
+        mix.append((name, int(weight or 1)))
+    return mix
+
+def make_site(directory, sizes):
+    # www/<size>.bin for each size, filled with random bytes so compression doesn't shrink them
+    www = Path(directory) / "www"
+    www.mkdir()
+    paths = []
+    for name, weight in sizes:
+        filename = f"{name.lower()}.bin"
+        with open(www / filename, "wb") as f:
+            remaining = parse_size(name)
+            while remaining:
+                block = os.urandom(min(remaining, 1024 * 1024))
+                f.write(block)
+                remaining -= len(block)
+        paths.append((f"/{filename}", weight))
+    return paths
+
+def free_port(host):
+    with socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+def start_server(args, directory, port):
+    command = [sys.executable, str(SERVER), "--mode", args.mode,
+               "--host", args.host, "--port", str(port), *args.server_args]
+    if args.threads:
+        command += ["--threads", str(args.threads)]
+    if args.workers:
+        command += ["--workers", str(args.workers)]
+    # stderr goes to an (already unlinked) temp file rather than a pipe nobody reads, which
+    # would fill up and stall the server mid-run if it printed enough tracebacks
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, cwd=directory, stdout=subprocess.DEVNULL, stderr=stderr)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                stderr.seek(0)
+                raise RuntimeError(f"server.py exited during startup: {stderr.read().decode(errors='replace')}")
+            try:
+                socket.create_connection((args.host, port), timeout=1).close()
+                return process
+            except OSError:
+                time.sleep(0.05)
+        process.terminate()
+        raise RuntimeError("server.py didn't start accepting connections in time")
+
+def stop_server(process):
+    process.terminate()     # server.py treats SIGTERM like Ctrl-C and shuts down cleanly
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+class Recorder:
+    """What one load-generating process measured."""
+    def __init__(self, paths):
+        self.latency = Histogram()                          # microseconds, all requests
+        self.by_path = {path: Histogram() for path, weight in paths}
+        self.statuses = {}
+        self.errors = {}
+        self.bytes = 0
+        self.connections = 0
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        for path, histogram in other.by_path.items():
+            self.by_path[path].merge(histogram)
+        for table, other_table in ((self.statuses, other.statuses), (self.errors, other.errors)):
+            for key, count in other_table.items():
+                table[key] = table.get(key, 0) + count
+        self.bytes += other.bytes
+        self.connections += other.connections
+
+async def run_connection(base_url, paths, weights, keep_alive, timeout, start, stop, recorder):
+    # One closed-loop client: send a request, wait for the whole response, repeat.
+    builder = HTTPClient(keep_alive=keep_alive, accept_encoding=False)
+    requests = {path: builder.build_GET(base_url + path, keep_alive=keep_alive) for path in paths}
+    reader = writer = None
+    while time.monotonic() < stop:
+        path = random.choices(paths, weights)[0]
+        host, port, data, keep_alive = requests[path]
+        began = time.monotonic()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+                recorder.connections += 1
+            writer.write(data)
+            status_line = await asyncio.wait_for(reader.readline(), timeout)
+            if not status_line:
+                raise ConnectionResetError("server closed the connection without responding")
+            code, headers, body, reusable = await asyncio.wait_for(
+                read_response(reader, "GET", status_line), timeout)
+        except (OSError, asyncio.TimeoutError, ValueError) as e:
+            if writer is not None:
+                writer.close()
+                reader = writer = None
+            if began >= start:
+                name = type(e).__name__
+                recorder.errors[name] = recorder.errors.get(name, 0) + 1
+            continue
+        finished = time.monotonic()
+        if not (keep_alive and reusable):
+            writer.close()
+            reader = writer = None
+        if began < start:
+            continue    # still warming up
+        micros = int((finished - began) * 1_000_000)
+        recorder.latency.record(micros)
+        recorder.by_path[path].record(micros)
+        recorder.statuses[code] = recorder.statuses.get(code, 0) + 1
+        recorder.bytes += len(body)
+    if writer is not None:
+        writer.close()
+
+async def generate_load(base_url, paths, connections, keep_alive, timeout, start, stop):
+    recorder = Recorder(paths)
+    names = [path for path, weight in paths]
+    weights = [weight for path, weight in paths]
+    await asyncio.gather(*(run_connection(base_url, names, weights, keep_alive, timeout, start, stop, recorder)
+                           for _ in range(connections)))
+    return recorder
+
+def load_process(base_url, paths, connections, keep_alive, timeout, start, stop):
+    # entry point for each load-generating process; start and stop are time.monotonic() values
+    return asyncio.run(generate_load(base_url, paths, connections, keep_alive, timeout, start, stop))
+
+def run_load(args, base_url, paths):
+    processes = max(1, min(args.processes, args.concurrency))
+    start = time.monotonic() + args.warmup
+    stop = start + args.duration
+    # spread the connections as evenly as the counts allow
+    shares = [args.concurrency // processes + (i < args.concurrency % processes) for i in range(processes)]
+    jobs = [(base_url, paths, share, not args.no_keep_alive, args.timeout, start, stop) for share in shares]
+    if processes == 1:
+        recorders = [load_process(*jobs[0])]
+    else:
+        with multiprocessing.get_context("fork").Pool(processes) as pool:
+            recorders = pool.starmap(load_process, jobs)
+    total = Recorder(paths)
+    for recorder in recorders:
+        total.merge(recorder)
+    return total
+
+def report(args, recorder, paths):
+    requests = recorder.latency.total
+    return {
+        "mode": args.mode if not args.url else None,
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "processes": max(1, min(args.processes, args.concurrency)),
+        "keep_alive": not args.no_keep_alive,
+        "duration": args.duration,
+        "requests": requests,
+        "requests_per_sec": round(requests / args.duration, 1),
+        "bytes_per_sec": round(recorder.bytes / args.duration, 1),
+        "connections_opened": recorder.connections,
+        "status": {str(code): count for code, count in sorted(recorder.statuses.items())},
+        "errors": recorder.errors,
+        "latency_ms": recorder.latency.summary(scale=1000),
+        "paths": {path: {"weight": weight, **recorder.by_path[path].summary(scale=1000)}
+                  for path, weight in paths},
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark server.py and print the results as JSON.")
+    parser.add_argument("--mode", default="threaded", help="server.py --mode to benchmark (default %(default)s)")
+    parser.add_argument("--threads", type=int, help="server.py --threads")
+    parser.add_argument("--workers", type=int, help="server.py --workers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="port for the server (default: any free port)")
+    parser.add_argument("--url", help="benchmark an already running server at this base URL instead")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="size:weight list of files to create and request (default %(default)s)")
+    parser.add_argument("--paths", help="path:weight list to request instead of generated files (needed with --url)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="connections kept busy at once (default %(default)s)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="load-generating processes the connections are spread over (default %(default)s)")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=DEFAULT_WARMUP, help="seconds of load before measuring")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds allowed per request")
+    parser.add_argument("--no-keep-alive", action="store_true", help="open a new connection for every request")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("server_args", nargs=argparse.REMAINDER,
+                        help="anything after -- is passed on to server.py")
+    args = parser.parse_args(argv)
+    if args.server_args[:1] == ["--"]:
+        args.server_args = args.server_args[1:]
+    if args.url and not args.paths:
+        parser.error("--url needs --paths")
+    if args.concurrency < 1 or args.duration <= 0:
+        parser.error("--concurrency and --duration must be positive")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    process = None
+    with tempfile.TemporaryDirectory(prefix="bench-") as directory:
+        if args.url:
+            base_url = args.url.rstrip("/")
+            paths = parse_mix(args.paths)
+        else:
+            paths = parse_mix(args.paths) if args.paths else make_site(directory, parse_mix(args.sizes))
+            if args.paths:
+                directory = os.getcwd()     # serve the real www/
+            port = args.port or free_port(args.host)
+            host = f"[{args.host}]" if ":" in args.host else args.host
+            base_url = f"http://{host}:{port}"
+            process = start_server(args, directory, port)
+        try:
+            recorder = run_load(args, base_url, paths)
+        finally:
+            if process is not None:
+                stop_server(process)
+    result = report(args, recorder, paths)
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
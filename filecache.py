@@ -0,0 +1,269 @@
+"""
+In-memory cache of the static files served from www/.
+"""
+
+import gzip
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+
+from mimetable import header_line
+
+try:
+    import brotli
+except ImportError:     # optional, only needed to brotli-compress on the fly
+    brotli = None
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024        # total size of cached file contents
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_FILE_BYTES = 1024 * 1024        # bigger files are never cached
+DEFAULT_REVALIDATE_INTERVAL = 1.0           # seconds between stat() checks of a cached file
+DEFAULT_COMPRESSED_MAX_BYTES = 16 * 1024 * 1024     # total size of cached compressed variants
+DEFAULT_COMPRESS_MIN_BYTES = 1024           # smaller files aren't worth compressing
+DEFAULT_COMPRESS_LEVEL = 6
+COMPRESSIBLE_TYPES = {
+    "application/javascript", "application/json", "application/xml", "application/manifest+json",
+    "application/ld+json", "application/xhtml+xml", "application/rss+xml", "application/atom+xml",
+    "application/wasm", "image/svg+xml", "image/x-icon", "image/bmp", "font/ttf", "font/otf",
+    "application/vnd.ms-fontobject",
+}
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}    # precompressed siblings: index.html.gz etc.
+
+def stat_key(stat_result):
+    # anything that changes when the file is replaced or edited
+    return (stat_result.st_dev, stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size)
+
+def make_etag(stat_result, encoding=None):
+    # Strong validator for one version of a file. Built from the modification time
+    # and size rather than a hash of the contents, so it costs nothing to compute
+    # for big streamed files and is the same in every prefork worker. Each content
+    # coding is a different representation, so it gets its own tag.
+    suffix = f"-{encoding}" if encoding else ""
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}{suffix}"'
+
+def http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+def is_compressible(content_type):
+    content_type = content_type.split(";", 1)[0]    # without "; charset=..."
+    return content_type.startswith("text/") or content_type in COMPRESSIBLE_TYPES
+
+class CachedFile:
+    """One representation of a file, with its response headers prebuilt.
+
+    stat_result is the stat() of the original file, even for a compressed
+    variant read from somewhere else, since that's what the validators
+    describe. content is None for files streamed from disk.
+    """
+    __slots__ = ("path", "content", "size", "stat_result", "key", "checked_at", "content_type",
+                 "content_type_line", "encoding", "etag", "last_modified", "representation_headers", "header_block")
+
+    def __init__(self, path, content, stat_result, content_type, size=None, encoding=None, vary=False):
+        self.path = path                    # where the bytes come from on disk
+        self.content = content
+        self.size = len(content) if size is None else size
+        self.stat_result = stat_result
+        self.key = stat_key(stat_result)    # to notice when the file changes
+        self.checked_at = 0
+        self.content_type = content_type
+        self.content_type_line = header_line(content_type)
+        self.encoding = encoding            # Content-Encoding, or None for identity
+        self.etag = make_etag(stat_result, encoding)
+        self.last_modified = int(stat_result.st_mtime)  # whole seconds, which is all an HTTP date can hold
+        # headers that belong with every 200, 206 and 304 for this representation
+        headers = f"ETag: {self.etag}\r\nLast-Modified: {http_date(self.last_modified)}\r\n"
+        if encoding:
+            headers += f"Content-Encoding: {encoding}\r\n"
+        if vary:
+            headers += "Vary: Accept-Encoding\r\n"
+        self.representation_headers = headers.encode()
+        # status line + headers that don't depend on the connection
+        self.header_block = (f"HTTP/1.1 200 OK\r\n"
+                             f"Content-Length: {self.size}\r\n").encode() + self.content_type_line + \
+                            b"Accept-Ranges: bytes\r\n" + self.representation_headers
+
+def describe_file(path, stat_result, content_type):
+    # a CachedFile without contents: headers and validators for a file found on disk
+    return CachedFile(path, None, stat_result, content_type, size=stat_result.st_size,
+                      vary=is_compressible(content_type))   # the response depends on Accept-Encoding
+
+class FileCache:
+    """LRU cache from decoded request path to file contents and response headers.
+
+    Bounded by entry count and by total content bytes. A cached entry is
+    re-stat()ed at most once every revalidate_interval seconds, and dropped
+    if its inode, mtime or size changed.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_file_bytes=DEFAULT_MAX_FILE_BYTES, revalidate_interval=DEFAULT_REVALIDATE_INTERVAL):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_file_bytes = min(max_file_bytes, max_bytes)
+        self.revalidate_interval = revalidate_interval
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, request_path):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(request_path)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(request_path)
+            if now - entry.checked_at < self.revalidate_interval:
+                self.hits += 1
+                return entry
+        # stat outside the lock so one slow disk doesn't stall every thread
+        try:
+            still_valid = stat_key(os.stat(entry.path)) == entry.key
+        except OSError:
+            still_valid = False
+        with self.lock:
+            if still_valid:
+                entry.checked_at = now
+                self.hits += 1
+                return entry
+            if self.entries.get(request_path) is entry:
+                self.remove(request_path)
+            self.invalidations += 1
+            self.misses += 1
+        return None
+
+    def put(self, request_path, entry):
+        # entry is a CachedFile built with stat_result; returns False if it wasn't cached
+        size = entry.size
+        if entry.content is None or size > self.max_file_bytes or self.max_entries <= 0:
+            return False
+        entry.checked_at = time.monotonic()
+        with self.lock:
+            if request_path in self.entries:
+                self.remove(request_path)
+            self.entries[request_path] = entry
+            self.total_bytes += size
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self.remove(oldest)
+                self.evictions += 1
+        return True
+
+    def remove(self, request_path):
+        # caller holds self.lock
+        entry = self.entries.pop(request_path)
+        self.total_bytes -= len(entry.content)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+class CompressedCache:
+    """LRU cache of compressed variants, keyed by file version and encoding.
+
+    The key includes the original's ETag and the stat of its .br/.gz
+    sibling (None if there's none), so a changed file, or a sibling that's
+    added, replaced or removed, simply stops matching its old variants and
+    they age out. A variant that isn't worth
+    having (no sibling file and compression wouldn't help) is remembered as
+    False so the work isn't repeated.
+    """
+    def __init__(self, max_bytes=DEFAULT_COMPRESSED_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES,
+                 min_size=DEFAULT_COMPRESS_MIN_BYTES, level=DEFAULT_COMPRESS_LEVEL, max_file_bytes=DEFAULT_MAX_FILE_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.min_size = min_size
+        self.level = level
+        self.max_file_bytes = max_file_bytes    # siblings bigger than this are streamed, not held in memory
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.compressed = 0
+
+    def get(self, entry, encoding):
+        # Returns a CachedFile for the encoded variant of entry, or None.
+        try:
+            sibling_stat = os.stat(entry.path + ENCODING_SUFFIXES[encoding])
+        except OSError:
+            sibling_stat = None
+        key = (entry.path, entry.etag, encoding, sibling_stat and stat_key(sibling_stat))
+        with self.lock:
+            variant = self.entries.get(key)
+            if variant is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return variant or None
+            self.misses += 1
+        variant = self.build(entry, encoding, sibling_stat) or False
+        with self.lock:
+            size = len(variant.content) if variant and variant.content is not None else 0
+            if key not in self.entries:
+                self.entries[key] = variant
+                self.total_bytes += size
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                oldest_key, oldest = self.entries.popitem(last=False)
+                if oldest and oldest.content is not None:
+                    self.total_bytes -= len(oldest.content)
+                self.evictions += 1
+        return variant or None
+
+    def build(self, entry, encoding, sibling_stat=None):
+        # a precompressed sibling (written at deploy time) wins if it isn't older than the file
+        if sibling_stat is not None and sibling_stat.st_mtime_ns >= entry.stat_result.st_mtime_ns:
+            sibling = entry.path + ENCODING_SUFFIXES[encoding]
+            try:
+                # opened even when it's too big to keep, so one we can't read isn't chosen
+                with open(sibling, "rb") as f:
+                    content = f.read() if sibling_stat.st_size <= self.max_file_bytes else None
+            except OSError:
+                pass    # unreadable, or gone since the stat(): compress the file ourselves instead
+            else:
+                return CachedFile(sibling, content, entry.stat_result, entry.content_type,
+                                  size=sibling_stat.st_size if content is None else len(content),
+                                  encoding=encoding, vary=True)
+
+        # otherwise compress it ourselves, once, if it's in memory and big enough to be worth it
+        if entry.content is None or entry.size < self.min_size:
+            return None
+        if encoding == "gzip":
+            content = gzip.compress(entry.content, compresslevel=self.level, mtime=0)
+        elif encoding == "br" and brotli is not None:
+            content = brotli.compress(entry.content, quality=min(self.level, 11))
+        else:
+            return None
+        self.compressed += 1
+        if len(content) >= entry.size:
+            return None
+        return CachedFile(entry.path, content, entry.stat_result, entry.content_type,
+                          encoding=encoding, vary=True)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "compressed": self.compressed,
+            }
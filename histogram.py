@@ -0,0 +1,105 @@
+"""
+HDR-style latency histogram.
+"""
+
+import math
+
+DEFAULT_SIGNIFICANT_FIGURES = 3
+DEFAULT_HIGHEST_TRACKABLE = 3600 * 1000 * 1000     # one hour, in microseconds
+PERCENTILES = (50, 90, 99, 99.9)
+
+class Histogram:
+    """Counts of integer values (microseconds, say) in log-linear buckets.
+
+    Like HdrHistogram: every power of two is split into the same number
+    of linear sub-buckets, enough to keep `significant_figures` digits of
+    precision at any magnitude. Recording is an index calculation and an
+    increment, memory doesn't depend on how many values are recorded, and
+    histograms from different threads or processes can be merged exactly.
+    Values above highest_trackable are counted as highest_trackable.
+
+    record() isn't locked; give each thread its own histogram and merge()
+    them, or hold a lock around it.
+    """
+    def __init__(self, significant_figures=DEFAULT_SIGNIFICANT_FIGURES, highest_trackable=DEFAULT_HIGHEST_TRACKABLE):
+        if not 1 <= significant_figures <= 5:
+            raise ValueError("significant_figures must be between 1 and 5")
+        self.significant_figures = significant_figures
+        self.highest_trackable = highest_trackable
+        # sub-buckets per power of two: the smallest power of two holding 2 * 10**figures values
+        self.half_magnitude = math.ceil(math.log2(2 * 10 ** significant_figures)) - 1
+        self.half_count = 1 << self.half_magnitude
+        self.counts = []            # grown as bigger values arrive
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    def index_of(self, value):
+        bucket = max(0, value.bit_length() - self.half_magnitude - 1)
+        sub_bucket = value >> bucket
+        return ((bucket + 1) << self.half_magnitude) + sub_bucket - self.half_count
+
+    def value_at_index(self, index):
+        # the highest value that lands in this slot
+        bucket = (index >> self.half_magnitude) - 1
+        sub_bucket = (index & (self.half_count - 1)) + self.half_count
+        if bucket < 0:
+            sub_bucket -= self.half_count
+            bucket = 0
+        return (sub_bucket << bucket) + (1 << bucket) - 1
+
+    def record(self, value, count=1):
+        value = min(max(0, int(value)), self.highest_trackable)
+        index = self.index_of(value)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += count
+        self.total += count
+        self.sum += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.half_magnitude != self.half_magnitude:
+            raise ValueError("can only merge histograms with the same precision")
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        # smallest recorded value with at least `percent` of all values at or below it
+        if not self.total:
+            return 0
+        wanted = max(1, math.ceil(self.total * percent / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return min(self.value_at_index(index), self.max)
+        return self.max
+
+    def mean(self):
+        return self.sum / self.total if self.total else 0
+
+    def summary(self, percentiles=PERCENTILES, scale=1):
+        # {"count", "min", "mean", "p50", ..., "max"}, with values divided by scale
+        result = {
+            "count": self.total,
+            "min": (self.min or 0) / scale,
+            "mean": round(self.mean() / scale, 3),
+        }
+        for percent in percentiles:
+            result[f"p{percent:g}"] = self.percentile(percent) / scale
+        result["max"] = self.max / scale
+        return result
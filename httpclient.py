@@ -1,16 +1,296 @@
 from sys import argv
+import selectors
 import socket
+import threading
+import time
+import zlib
+
+DEFAULT_IDLE_TIMEOUT = 30       # seconds an unused keep-alive connection stays in the pool
+DEFAULT_MAX_IDLE_PER_HOST = 4   # idle connections kept per (host, port, family)
+READ_CHUNK = 64 * 1024          # default piece size when streaming a response body
 
 def help():
     print("httpclient.py [GET/POST] [URL] [key1] [value1] [key2] [value2] ...\n")
 
 class HTTPResponse:
-    def __init__(self, code=200, body=""):
+    def __init__(self, code=200, body="", headers=None):
         self.code = code
         self.body = body
+        self.headers = headers or {}
+
+class PooledConnection:
+    def __init__(self, sock, key):
+        self.socket = sock
+        self.key = key
+        self.rfile = sock.makefile('rb')    # one buffered reader for the connection's whole life
+        self.last_used = time.monotonic()
+        self.reused = False
+
+    def close(self):
+        self.rfile.close()
+        self.socket.close()
+
+class ConnectionPool:
+    """Idle keep-alive connections, keyed by (host, port, address family)."""
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT, max_idle_per_host=DEFAULT_MAX_IDLE_PER_HOST):
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            connections = self.idle.get(key, [])
+            while connections:
+                conn = connections.pop()    # most recently used first
+                if now - conn.last_used < self.idle_timeout and not self.closed_by_server(conn):
+                    conn.reused = True
+                    return conn
+                conn.close()
+        return None
+
+    def put(self, conn):
+        conn.last_used = time.monotonic()
+        with self.lock:
+            connections = self.idle.setdefault(conn.key, [])
+            connections.append(conn)
+            while len(connections) > self.max_idle_per_host:
+                connections.pop(0).close()
+
+    def closed_by_server(self, conn):
+        # an idle connection should have nothing to read; if it does, it's EOF (or junk)
+        # (a selector, not select.select(), which can't take descriptors >= 1024)
+        with selectors.DefaultSelector() as selector:
+            selector.register(conn.socket, selectors.EVENT_READ)
+            return bool(selector.select(0))
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for conn in connections:
+                    conn.close()
+            self.idle.clear()
+
+def read_header_block(rfile):
+    headers = {}
+    while True:
+        line = rfile.readline()
+        if line in (b"\r\n", b"\n", b""):  # headers end with a blank line
+            return headers
+        key, _, value = line.decode("iso-8859-1").partition(":")
+        headers[key.strip()] = value.strip()
+
+def make_decoder(content_encoding):
+    # a zlib decompressobj for a gzip or deflate Content-Encoding, or None
+    content_encoding = content_encoding.strip().lower()
+    if content_encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif content_encoding == "deflate":
+        return zlib.decompressobj(zlib.MAX_WBITS)
+    return None
+
+def decode_text(body, content_type="", encoding=None):
+    # decode a body using the charset from Content-Type if there is one
+    if encoding is None:
+        for param in content_type.split(";")[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "charset":
+                encoding = value.strip('"')
+    if encoding:
+        try:
+            return body.decode(encoding)
+        except (LookupError, UnicodeDecodeError):
+            pass
+    try:
+        return body.decode("utf-8")
+    except UnicodeDecodeError:
+        return body.decode("iso-8859-1")
+
+class StreamingResponse:
+    """A response whose body is read off the connection only as it's consumed.
+
+    The status line and headers are parsed when it's created. The body can
+    then be read with readinto()/read(), or iterated over in chunks, and is
+    framed by chunked encoding or Content-Length (or runs to EOF if the
+    server gives neither). Nothing is decoded to text unless text() is
+    called. Once the body has been read to the end, a reusable connection
+    goes back to the pool; closing early drops it instead.
+
+    A gzip or deflate Content-Encoding is undone on the fly (unless
+    decode_content is False), with the output of each step capped at the
+    size the caller asked for, so a small download can't inflate into a
+    huge allocation.
+    """
+    def __init__(self, conn, method, status_line, pool=None, decode_content=True):
+        self.conn = conn
+        self.rfile = conn.rfile
+        self.pool = pool            # where to return the connection, or None to close it
+        while True:
+            self.version, code, *rest = status_line.decode("iso-8859-1").rstrip("\r\n").split(" ", 2)
+            self.code = int(code)
+            self.reason = rest[0] if rest else ""
+            self.headers = read_header_block(self.rfile)
+            if 100 <= self.code < 200 and self.code != 101:     # interim response, the real one follows
+                status_line = self.rfile.readline()
+                continue
+            break
+        connection = self.header("Connection", "").lower()
+        self.reusable = "close" not in connection and (self.version == "HTTP/1.1" or "keep-alive" in connection)
+        self.chunked = False
+        self.remaining = None       # body bytes left (or left in the current chunk), None = until EOF
+        self.done = False
+        if method == "HEAD" or self.code in (204, 304):
+            self.remaining = 0
+        elif "chunked" in self.header("Transfer-Encoding", "").lower():
+            self.chunked = True
+            self.remaining = 0      # the first chunk-size line hasn't been read yet
+        elif self.header("Content-Length") is not None:
+            self.remaining = int(self.header("Content-Length"))
+        else:
+            self.reusable = False
+        if self.remaining == 0 and not self.chunked:
+            self.finish()
+        self.decoder = None
+        self.decoder_started = False
+        self.compressed = None      # raw bytes read but not decompressed yet
+        if decode_content:
+            self.decoder = make_decoder(self.header("Content-Encoding", ""))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return self.iter_content()
+
+    def header(self, name, default=None):
+        name = name.lower()
+        for key, value in self.headers.items():
+            if key.lower() == name:
+                return value
+        return default
+
+    def readinto(self, buffer):
+        # Read up to len(buffer) bytes of the (decoded) body into buffer; returns 0 at the end.
+        if self.decoder is None:
+            return self.readinto_raw(buffer)
+        view = memoryview(buffer)
+        while True:
+            if self.compressed is None:
+                raw = bytearray(READ_CHUNK)
+                n = self.readinto_raw(raw)
+                if not n:
+                    if self.decoder.eof:
+                        return 0
+                    data = self.decoder.flush(len(view)) if len(view) else b""
+                    if not data:
+                        return 0
+                    view[:len(data)] = data
+                    return len(data)
+                self.compressed = raw[:n]
+            try:
+                data = self.decoder.decompress(self.compressed, len(view))
+            except zlib.error:
+                if self.decoder_started or self.header("Content-Encoding", "").strip().lower() != "deflate":
+                    raise
+                # some servers send raw deflate without the zlib wrapper
+                self.decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+                data = self.decoder.decompress(self.compressed, len(view))
+            self.decoder_started = True
+            self.compressed = self.decoder.unconsumed_tail or None
+            if data:
+                view[:len(data)] = data
+                return len(data)
+
+    def readinto_raw(self, buffer):
+        # Read up to len(buffer) body bytes as sent (still compressed); returns 0 at the end.
+        if self.done:
+            return 0
+        if self.chunked and self.remaining == 0:
+            if not self.next_chunk():
+                return 0
+        view = memoryview(buffer)
+        if self.remaining is not None:
+            view = view[:self.remaining]
+        n = self.rfile.readinto1(view) if len(view) else 0
+        if not n:
+            if self.remaining is not None and len(view):
+                self.reusable = False   # cut short
+                raise ConnectionResetError("connection closed in the middle of the response body")
+            self.finish()
+            return 0
+        if self.remaining is not None:
+            self.remaining -= n
+            if self.remaining == 0:
+                if self.chunked:
+                    self.rfile.readline()   # the CRLF after each chunk
+                else:
+                    self.finish()
+        return n
+
+    def next_chunk(self):
+        size_line = self.rfile.readline()
+        if not size_line:
+            self.reusable = False
+            raise ConnectionResetError("connection closed in the middle of a chunked body")
+        size = int(size_line.split(b";", 1)[0].strip(), 16)   # ignore chunk extensions
+        if size == 0:
+            read_header_block(self.rfile)   # trailers, if any
+            self.finish()
+            return False
+        self.remaining = size
+        return True
+
+    def read(self, size=-1):
+        if size is not None and size >= 0:
+            buffer = bytearray(size)
+            n = 0
+            while n < size:
+                got = self.readinto(memoryview(buffer)[n:])
+                if not got:
+                    break
+                n += got
+            del buffer[n:]
+            return bytes(buffer)
+        return b"".join(self.iter_content())
+
+    def iter_content(self, chunk_size=READ_CHUNK):
+        # yields the body in pieces of at most chunk_size bytes, reusing one buffer
+        buffer = bytearray(chunk_size)
+        while True:
+            n = self.readinto(buffer)
+            if not n:
+                return
+            yield bytes(buffer[:n])
+
+    def text(self, encoding=None):
+        # read the rest of the body and decode it, using the charset from Content-Type if there is one
+        return decode_text(self.read(), self.header("Content-Type", ""), encoding)
+
+    def finish(self):
+        # the whole body has been read
+        if self.done:
+            return
+        self.done = True
+        if self.pool is not None and self.reusable:
+            self.pool.put(self.conn)
+        else:
+            self.conn.close()
+
+    def close(self):
+        if not self.done:
+            self.done = True
+            self.conn.close()   # unread body left on it, so it can't be reused
 
 class HTTPClient:
-    
+    def __init__(self, keep_alive=False, pool=None, accept_encoding=True):
+        self.keep_alive = keep_alive    # default for command(); GET/POST take it per call too
+        self.accept_encoding = accept_encoding  # ask for gzip/deflate and decompress transparently
+        self.pool = pool if pool is not None else ConnectionPool()
+
     def connect(self, host, port):
         if ':' in host: # IPv6
             self.socket = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
@@ -18,44 +298,65 @@ class HTTPClient:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.connect((host, port)) 
         print(f"connected to server at host {host} and port {port}")
-        return
-
-    def get_code(self, data):
-        status = data.split("\r\n")[0]  # the first line of the response
-        code = status.split(" ")[1]     # code comes after the first space
-        return int(code)
-
-    def get_headers(self,data):
-        headers = {}
-        without_body = data.split("\r\n\r\n", 1)[0]         # body comes after \r\n\r\n
-        header_lines = without_body.split("\r\n", 1)[1:]    # everything after status line is a header
-        for line in header_lines:
-            if ": " in line:
-                key, value = line.split(": ", 1)
-                headers[key] = value
-        return headers
-
-    def get_body(self, data):
-        body = data.split("\r\n\r\n", 1)
-        if len(body) > 1:   # check if body exists
-            return body[1]
-        return ""
-    
+        return self.socket
+
     def sendall(self, data):
         self.socket.sendall(data.encode('utf-8'))
         
     def close(self):
         self.socket.close()
 
-    
-    # Receive the response
-    def read_response(self):
-        response = b""
-        with self.socket.makefile('rb') as sock_file:  
-            response = sock_file.read()
-        return response
-
-    def GET(self, url, args=None):
+    def send(self, method, host, port, data, keep_alive):
+        # Send one request and return a StreamingResponse for it. With keep_alive, the
+        # connection comes from (and goes back to) the pool. If a pooled connection turns
+        # out to have been dropped by the server, the request moves on to the next idle
+        # one, and finally to a fresh connection, whose failure is raised.
+        family = socket.AF_INET6 if ':' in host else socket.AF_INET
+        key = (host, port, family)
+        while True:
+            conn = self.pool.get(key) if keep_alive else None
+            if conn is None:
+                conn = PooledConnection(self.connect(host, port), key)
+            try:
+                conn.socket.sendall(data)
+                status_line = conn.rfile.readline()
+                if not status_line:
+                    raise ConnectionResetError("server closed the connection without responding")
+            except ConnectionError:
+                conn.close()
+                if conn.reused:
+                    continue    # stale pooled connection, nothing was processed: try again
+                raise
+            break
+        try:
+            return StreamingResponse(conn, method, status_line, self.pool if keep_alive else None,
+                                     decode_content=self.accept_encoding)
+        except BaseException:
+            conn.close()
+            raise
+
+    def open(self, command, url, args=None, keep_alive=None):
+        # Like command(), but returns a StreamingResponse so big bodies can be read in pieces:
+        #     with client.open("GET", url) as response:
+        #         for chunk in response.iter_content():
+        #             ...
+        if command == "POST":
+            return self.send("POST", *self.build_POST(url, args, keep_alive))
+        elif command == "GET":
+            return self.send("GET", *self.build_GET(url, args, keep_alive))
+        else:
+            raise ValueError("not get or post")
+
+    def GET(self, url, args=None, keep_alive=None):
+        with self.open("GET", url, args, keep_alive) as response:
+            return HTTPResponse(response.code, response.text(), response.headers)
+
+    def POST(self, url, args=None, keep_alive=None):
+        with self.open("POST", url, args, keep_alive) as response:
+            return HTTPResponse(response.code, response.text(), response.headers)
+
+    def build_GET(self, url, args=None, keep_alive=None):
+        # returns (host, port, request bytes, keep_alive)
         ip, port, path, queries, query_byte_count = self.parse_url(url)
 
         if args and len(args) > 0:
@@ -84,26 +385,19 @@ class HTTPClient:
         else:  # IPv4 address or hostname
             host_header = ip + ":" + str(port)
         request += ("Host: " + host_header + "\r\n")
-        request += ("Connection: close\r\n")    # close the port as per the hints
+        if keep_alive is None:
+            keep_alive = self.keep_alive
+        request += ("Connection: " + ("keep-alive" if keep_alive else "close") + "\r\n")
+        if self.accept_encoding:
+            request += "Accept-Encoding: gzip, deflate\r\n"
         request += "\r\n"   # headers end with a blank line
 
         # no body (because it's GET)
 
-        self.connect(ip, port)
-        self.socket.sendall(request.encode("utf-8"))
-        response_bytes = self.read_response()
-        try:
-            response_str = response_bytes.decode("utf-8")
-        except UnicodeDecodeError:
-            response_str = response_bytes.decode("iso-8859-1")
-        self.close()
-
-        code = self.get_code(response_str)
-        body = self.get_body(response_str)
-        
-        return HTTPResponse(code, body)
+        return ip, port, request.encode("utf-8"), keep_alive
 
-    def POST(self, url, args=None):
+    def build_POST(self, url, args=None, keep_alive=None):
+        # returns (host, port, request bytes, keep_alive)
         ip, port, path, queries, query_byte_count = self.parse_url(url)
 
         # build the request
@@ -118,7 +412,11 @@ class HTTPClient:
         else:  # IPv4 address or hostname
             host_header = ip + ":" + str(port)
         request += ("Host: " + host_header + "\r\n")
-        request += ("Connection: close\r\n")    # close the port as per the hints
+        if keep_alive is None:
+            keep_alive = self.keep_alive
+        request += ("Connection: " + ("keep-alive" if keep_alive else "close") + "\r\n")
+        if self.accept_encoding:
+            request += "Accept-Encoding: gzip, deflate\r\n"
 
         # body
         body = ""
@@ -136,21 +434,7 @@ class HTTPClient:
         
         request += "\r\n"  # headers end with a blank line
 
-        self.connect(ip, port)
-        self.socket.sendall(request.encode("utf-8"))
-        if body:
-            self.socket.sendall(body.encode("utf-8"))
-        response_bytes = self.read_response()
-        try:
-            response_str = response_bytes.decode("utf-8")
-        except UnicodeDecodeError:
-            response_str = response_bytes.decode("iso-8859-1")
-        self.close()
-        
-        code = self.get_code(response_str)
-        body = self.get_body(response_str)
-        
-        return HTTPResponse(code, body)
+        return ip, port, request.encode("utf-8") + body.encode("utf-8"), keep_alive
 
     def parse_url(self, url):
         no_protocol = url.split("//", 1)
@@ -224,13 +508,13 @@ class HTTPClient:
                     byte_count += 1
         return ["".join(result), byte_count]
     
-    def command(self, command, url, args):
+    def command(self, command, url, args, keep_alive=None):
         assert isinstance(url, str)
         assert isinstance(args, dict)
         if command == "POST":
-            return  self.POST(url, args)
+            return  self.POST(url, args, keep_alive)
         elif command == "GET":
-            return  self.GET(url, args)
+            return  self.GET(url, args, keep_alive)
         else:
             raise ValueError("not get or post")
     
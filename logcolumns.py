@@ -0,0 +1,416 @@
+"""
+Columnar copies of the access log, for queries that scan millions of requests.
+
+    python logcolumns.py export -o logs/access.lcol
+    python logcolumns.py count logs/access.lcol --by path --status 404
+
+export reads logs/access.jsonl and its rotated segments (or the files
+given) and writes them column by column: ip, method, path and header names
+and values are dictionary-encoded (each distinct string stored once, rows
+hold small integer codes), the rest are packed numbers. A query then reads
+just the columns it needs and counts codes with numpy (when installed)
+instead of running json.loads() on every line. With pyarrow installed the
+same columns can be written as Parquet for pandas/DuckDB/Spark.
+
+ColumnarSink does the same live, from the access log writer thread.
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+from array import array
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+import logstats
+
+try:
+    import numpy
+except ImportError:     # optional, makes queries vectorized
+    numpy = None
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.parquet
+except ImportError:     # optional, only needed for Parquet
+    pyarrow = None
+
+MAGIC = b"LABCOL1\n"
+FORMATS = ("native", "parquet")
+EXTENSIONS = {"native": ".lcol", "parquet": ".parquet"}
+DEFAULT_BATCH_ROWS = 1000000        # rows per batch (a Parquet row group) when exporting
+DEFAULT_ROWS_PER_FILE = 100000      # rows the live sink collects before writing a file
+DEFAULT_MAX_AGE = 300.0             # seconds the live sink holds rows before writing them anyway
+# column type -> array typecode (sizes as on every platform the server runs on)
+TYPECODES = {"int64": "q", "int32": "i", "uint32": "I", "float64": "d"}
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# (name, type, dictionary-encoded?) in file order; the header_* columns have one row per
+# request header, and row i's headers are header_offsets[i]:header_offsets[i + 1]
+SCHEMA = (
+    ("ts", "int64", False),             # microseconds since the Unix epoch, UTC
+    ("ip", "uint32", True),
+    ("src_port", "int32", False),       # -1 when not logged
+    ("method", "uint32", True),
+    ("path", "uint32", True),
+    ("status", "int32", False),
+    ("length", "int64", False),
+    ("duration_ms", "float64", False),  # NaN when not logged
+    ("header_offsets", "uint32", False),
+    ("header_name", "uint32", True),
+    ("header_value", "uint32", True),
+)
+
+class Dictionary:
+    """Distinct strings in first-seen order, and the code of each."""
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+class ColumnBuilder:
+    """Accumulates access log entries as columns, one batch at a time."""
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.data = {name: array(TYPECODES[kind]) for name, kind, _ in SCHEMA}
+        self.dictionaries = {name: Dictionary() for name, _, encoded in SCHEMA if encoded}
+        self.data["header_offsets"].append(0)
+        self.seconds = {}   # "2025-09-29T05:04:27" -> its epoch seconds, since many entries share one
+        self.rows = 0
+
+    def __len__(self):
+        return self.rows
+
+    def add(self, entry):
+        # runs once per log line, hence the local names
+        data, dictionaries = self.data, self.dictionaries
+        get = entry.get
+        data["ts"].append(self.parse_ts(get("ts")))
+        for name in ("ip", "method", "path"):
+            value = get(name) or ""
+            code = dictionaries[name].codes.get(value)
+            data[name].append(code if code is not None else dictionaries[name].code(value))
+        port = get("src_port")
+        data["src_port"].append(port if port is not None else -1)
+        data["status"].append(get("status") or 0)
+        data["length"].append(get("length") or 0)
+        duration = get("duration_ms")
+        data["duration_ms"].append(duration if duration is not None else math.nan)
+        headers = get("headers")
+        header_names = data["header_name"]
+        if headers:
+            names, values = dictionaries["header_name"], dictionaries["header_value"]
+            header_values = data["header_value"]
+            for name, value in headers.items():
+                code = names.codes.get(name)
+                header_names.append(code if code is not None else names.code(name))
+                if not isinstance(value, str):
+                    value = str(value)
+                code = values.codes.get(value)
+                header_values.append(code if code is not None else values.code(value))
+        data["header_offsets"].append(len(header_names))
+        self.rows += 1
+
+    def parse_ts(self, ts):
+        # the log's own "...T05:04:27.560910Z" (or "...T05:04:27Z") without a full datetime parse
+        if isinstance(ts, str) and len(ts) in (20, 27) and ts[-1] == "Z":
+            seconds = self.seconds.get(ts[:19])
+            if seconds is None:
+                seconds = self.seconds[ts[:19]] = parse_ts(ts[:19] + "Z") // 1000000
+            if len(ts) == 20:
+                return seconds * 1000000
+            if ts[19] == "." and ts[20:26].isdigit():
+                return seconds * 1000000 + int(ts[20:26])
+        return parse_ts(ts)
+
+def parse_ts(ts):
+    # "2025-09-29T05:04:27.560910Z" -> microseconds since the epoch
+    try:
+        moment = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return 0
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    delta = moment - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def write_native(f, builder):
+    # One batch: an 8-byte header length, a JSON header (row count, dictionaries,
+    # buffer sizes), then each column's raw array bytes in SCHEMA order.
+    columns = []
+    for name, kind, encoded in SCHEMA:
+        column = {"name": name, "type": kind, "bytes": len(builder.data[name]) * builder.data[name].itemsize}
+        if encoded:
+            column["dictionary"] = builder.dictionaries[name].values
+        columns.append(column)
+    header = json.dumps({"rows": builder.rows, "byteorder": sys.byteorder, "columns": columns}).encode("utf-8")
+    f.write(len(header).to_bytes(8, "little"))
+    f.write(header)
+    for name, _, _ in SCHEMA:
+        builder.data[name].tofile(f)
+
+def arrow_table(builder):
+    # the batch as a pyarrow Table, dictionary columns as DictionaryArrays
+    def plain(name, arrow_type):
+        values = builder.data[name]
+        return pyarrow.Array.from_buffers(arrow_type, len(values), [None, pyarrow.py_buffer(values)])
+
+    def encoded(name, indices):
+        return pyarrow.DictionaryArray.from_arrays(indices, pyarrow.array(builder.dictionaries[name].values,
+                                                                          pyarrow.string()))
+
+    def codes(name):
+        return plain(name, pyarrow.uint32()).cast(pyarrow.int32())
+
+    src_port = plain("src_port", pyarrow.int32())
+    duration = plain("duration_ms", pyarrow.float64())
+    offsets = plain("header_offsets", pyarrow.uint32()).cast(pyarrow.int32())
+    return pyarrow.table({
+        "ts": plain("ts", pyarrow.int64()).cast(pyarrow.timestamp("us", tz="UTC")),
+        "ip": encoded("ip", codes("ip")),
+        "src_port": pyarrow.compute.if_else(pyarrow.compute.equal(src_port, -1), None, src_port),
+        "method": encoded("method", codes("method")),
+        "path": encoded("path", codes("path")),
+        "status": plain("status", pyarrow.int32()),
+        "length": plain("length", pyarrow.int64()),
+        "duration_ms": pyarrow.compute.if_else(pyarrow.compute.is_nan(duration), None, duration),
+        "header_names": pyarrow.ListArray.from_arrays(offsets, encoded("header_name", codes("header_name"))),
+        "header_values": pyarrow.ListArray.from_arrays(offsets, encoded("header_value", codes("header_value"))),
+    })
+
+class ColumnWriter:
+    """Writes batches from a ColumnBuilder to one file, in either format."""
+    def __init__(self, path, format="native"):
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of {FORMATS}, not {format!r}")
+        if format == "parquet" and pyarrow is None:
+            raise ValueError("the parquet format needs the pyarrow package")
+        self.path = Path(path)
+        self.format = format
+        self.rows = 0
+        self.tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        self.f = open(self.tmp, "wb") if format == "native" else None
+        self.parquet = None
+        if self.f is not None:
+            self.f.write(MAGIC)
+
+    def write(self, builder):
+        if not builder.rows:
+            return
+        if self.format == "native":
+            write_native(self.f, builder)
+        else:
+            table = arrow_table(builder)
+            if self.parquet is None:
+                self.parquet = pyarrow.parquet.ParquetWriter(self.tmp, table.schema)
+            self.parquet.write_table(table)
+        self.rows += builder.rows
+
+    def close(self):
+        # the file only appears under its real name once it's complete
+        if self.f is not None:
+            self.f.close()
+        if self.parquet is not None:
+            self.parquet.close()
+        if self.rows:
+            os.replace(self.tmp, self.path)
+        else:
+            self.tmp.unlink(missing_ok=True)
+
+class Column:
+    """One column of a batch: numbers, or codes into `dictionary`."""
+    def __init__(self, name, data, dictionary=None):
+        self.name = name
+        self.data = data                # numpy array if numpy is installed, otherwise array.array
+        self.dictionary = dictionary    # list of strings for dictionary-encoded columns
+
+    def __len__(self):
+        return len(self.data)
+
+    def values(self):
+        if self.dictionary is None:
+            return list(self.data)
+        return [self.dictionary[code] for code in self.data]
+
+    def value_counts(self, mask=None):
+        # {value: count}, over the rows where mask is true (a numpy bool array, or a sequence of bools)
+        data = self.data
+        if numpy is not None:
+            if mask is not None:
+                data = data[mask]
+            if self.dictionary is not None:
+                counts = numpy.bincount(data, minlength=len(self.dictionary))
+                return {self.dictionary[code]: int(counts[code]) for code in numpy.flatnonzero(counts)}
+            values, counts = numpy.unique(data, return_counts=True)
+            return {value.item(): int(count) for value, count in zip(values, counts)}
+        if mask is not None:
+            data = (value for value, keep in zip(data, mask) if keep)
+        counts = Counter(data)
+        if self.dictionary is not None:
+            return {self.dictionary[code]: count for code, count in counts.items()}
+        return dict(counts)
+
+def read_native(path):
+    # Yields each batch in the file as {name: Column}.
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} isn't a {EXTENSIONS['native']} file")
+        while True:
+            size = f.read(8)
+            if not size:
+                return
+            header = json.loads(f.read(int.from_bytes(size, "little")))
+            batch = {}
+            for column in header["columns"]:
+                raw = f.read(column["bytes"])
+                typecode = TYPECODES[column["type"]]
+                if numpy is not None:
+                    data = numpy.frombuffer(raw, dtype=numpy.dtype(column["type"]).newbyteorder(
+                        "<" if header["byteorder"] == "little" else ">"))
+                else:
+                    data = array(typecode)
+                    data.frombytes(raw)
+                    if header["byteorder"] != sys.byteorder:
+                        data.byteswap()
+                batch[column["name"]] = Column(column["name"], data, column.get("dictionary"))
+            yield batch
+
+def status_mask(batch, statuses):
+    status = batch["status"].data
+    if numpy is not None:
+        return numpy.isin(status, statuses)
+    statuses = set(statuses)
+    return [value in statuses for value in status]
+
+class ColumnarSink:
+    """Turns access log entries into columnar files as they're logged.
+
+    The access log writer thread hands over each batch it writes; rows are
+    collected until there are rows_per_file of them (or a batch arrives
+    after the oldest has waited max_age seconds) and then written to
+    <directory>/access.<UTC time>-<pid><extension>, so each prefork worker
+    writes its own files.
+    """
+    def __init__(self, directory, format="native", rows_per_file=DEFAULT_ROWS_PER_FILE, max_age=DEFAULT_MAX_AGE):
+        if format == "parquet" and pyarrow is None:
+            raise ValueError("the parquet format needs the pyarrow package")
+        self.directory = Path(directory)
+        self.format = format
+        self.rows_per_file = max(1, rows_per_file)
+        self.max_age = max_age
+        self.builder = ColumnBuilder()
+        self.started = None
+        self.files = 0
+        self.rows = 0
+
+    def add(self, entries, now):
+        # called from the access log writer thread only
+        if self.started is None:
+            self.started = now
+        for entry in entries:
+            self.builder.add(entry)
+        if len(self.builder) >= self.rows_per_file or now - self.started >= self.max_age:
+            self.flush()
+
+    def flush(self):
+        if len(self.builder):
+            self.directory.mkdir(parents=True, exist_ok=True)
+            stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+            writer = ColumnWriter(self.directory / f"access.{stamp}-{os.getpid()}{EXTENSIONS[self.format]}",
+                                  self.format)
+            try:
+                writer.write(self.builder)
+            finally:
+                writer.close()
+            self.files += 1
+            self.rows += len(self.builder)
+            self.builder.clear()
+        self.started = None
+
+    def close(self):
+        self.flush()
+
+    def stats(self):
+        return {"files": self.files, "rows": self.rows, "pending": len(self.builder)}
+
+def export(files, output, format="native", batch_rows=DEFAULT_BATCH_ROWS):
+    writer = ColumnWriter(output, format)
+    builder = ColumnBuilder()
+    bad_lines = 0
+    try:
+        for path in files:
+            for line in logstats.read_lines(path, 0, None):
+                try:
+                    entry = logstats.loads(line)
+                except ValueError:
+                    bad_lines += 1
+                    continue
+                if not isinstance(entry, dict):
+                    bad_lines += 1
+                    continue
+                builder.add(entry)
+                if len(builder) >= batch_rows:
+                    writer.write(builder)
+                    builder.clear()
+        writer.write(builder)
+    finally:
+        writer.close()
+    return writer.rows, bad_lines
+
+def count(path, by, statuses=None):
+    totals = Counter()
+    for batch in read_native(path):
+        mask = status_mask(batch, statuses) if statuses else None
+        totals.update(batch[by].value_counts(mask))
+    return totals
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Columnar copies of the access log.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="convert JSONL access logs to a columnar file")
+    export_parser.add_argument("files", nargs="*", type=Path,
+                               help=f"log files to convert (default: {logstats.DEFAULT_LOG} and its rotated segments)")
+    export_parser.add_argument("--log", type=Path, default=logstats.DEFAULT_LOG,
+                               help="live log whose rotated segments are converted too when no files are given")
+    export_parser.add_argument("-o", "--output", type=Path, required=True)
+    export_parser.add_argument("--format", choices=FORMATS, default="native")
+    export_parser.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS,
+                               help="rows per batch (Parquet row group)")
+    count_parser = commands.add_parser("count", help="count requests by a column of a .lcol file")
+    count_parser.add_argument("file", type=Path)
+    count_parser.add_argument("--by", default="path",
+                              choices=[name for name, _, _ in SCHEMA if not name.startswith("header_")] + ["header_name"])
+    count_parser.add_argument("--status", type=int, action="append", help="only these statuses (can be repeated)")
+    count_parser.add_argument("--top", type=int, default=logstats.DEFAULT_TOP)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "export":
+        files = args.files or logstats.log_files(args.log)
+        if not files:
+            sys.exit(f"no log files found at {args.log}")
+        try:
+            rows, bad_lines = export(files, args.output, args.format, max(1, args.batch_rows))
+        except ValueError as e:
+            sys.exit(str(e))
+        print(json.dumps({"output": str(args.output), "rows": rows, "bad_lines": bad_lines}))
+    else:
+        if args.by == "header_name" and args.status:
+            sys.exit("--status can't be combined with --by header_name (one row per header, not per request)")
+        totals = count(args.file, args.by, args.status)
+        print(json.dumps(dict(totals.most_common(args.top)), indent=2))
+
+if __name__ == "__main__":
+    main()
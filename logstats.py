@@ -0,0 +1,437 @@
+"""
+Summarizes the JSONL access log, including rotated and compressed segments.
+
+    python logstats.py --since 2h
+    python logstats.py logs/access.jsonl.20250929T050000000000Z-123.gz --top 50
+
+reads logs/access.jsonl and its rotated segments (or the files given),
+streaming them a line at a time across --jobs processes, and prints one
+JSON object: status and method counts, top paths, the busiest client IPs
+and their request rates, latency percentiles from duration_ms, and counts
+of requests that look like probing (traversal attempts, method probes,
+scanner paths, malformed or timed-out requests, rate-limited clients).
+"""
+
+import argparse
+import functools
+import gzip
+import io
+import json
+import math
+import multiprocessing
+import os
+import re
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from accesslog import zstandard
+from histogram import Histogram
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:     # optional, about three times faster than json
+    loads = json.loads
+
+DEFAULT_LOG = Path("logs/access.jsonl")
+DEFAULT_TOP = 20
+DEFAULT_CAPACITY = 100000       # distinct paths / IPs counted exactly before rare ones are pruned
+CHUNK_BYTES = 64 * 1024 * 1024  # uncompressed files are split into pieces this big, one per job
+TS_PREFIX = b'{"ts": "'         # how log_request() starts every line
+TS_LENGTH = len("2025-09-29T05:04:27.560910Z")
+RELATIVE_TIME = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+TIME_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+
+TRAVERSAL = re.compile(r"\.\.|%2e|%2f|%5c|\\\\|%00", re.IGNORECASE)
+SCANNER_PATHS = re.compile(r"/\.(env|git|svn|hg|aws|ssh|ht)|/wp-|/phpmyadmin|/cgi-bin|\.php\b|/admin|/actuator"
+                           r"|/etc/passwd|/server-status|/boaform|/HNAP1", re.IGNORECASE)
+MAX_PENDING = 65536             # distinct keys counted per line before they're added into the totals
+# suspicious counts that come straight from the status code
+SUSPICIOUS_STATUSES = {
+    "forbidden": (403,),            # the path resolved outside www/
+    "method_probes": (405,),        # anything but GET
+    "malformed": (400, 414, 431, 505),
+    "timeouts": (408,),             # slow or silent clients
+    "rate_limited": (429, 503),     # the per-IP limits
+}
+# the types log_request() writes each field as (None where it may be missing or null);
+# bool is left out on purpose, since True would otherwise count as status 1
+INTS = {int, type(None)}
+NUMBERS = {int, float, type(None)}
+STRINGS = {str, type(None)}
+HEADERS = {dict, type(None)}
+
+class TopCounter:
+    """Counts keys, keeping memory bounded however many distinct keys there are.
+
+    Keys are counted exactly until there are 2 * capacity of them; then
+    only the capacity most frequent are kept, and the largest count thrown
+    away is remembered as `error`. Any key's count is then at most `error`
+    short, so the top of the list is right unless the log is mostly
+    one-off keys (a scan of random URLs, spoofed addresses).
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.error = 0
+
+    def add(self, key, count=1):
+        counts = self.counts
+        counts[key] = counts.get(key, 0) + count
+        if len(counts) > 2 * self.capacity:
+            self.prune()
+
+    def prune(self):
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        self.error = max(self.error, ranked[self.capacity][1])
+        self.counts = dict(ranked[:self.capacity])
+
+    def merge(self, other):
+        for key, count in other.counts.items():
+            self.add(key, count)
+        self.error = max(self.error, other.error)
+
+    def most_common(self, n):
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+
+class IpCounter(TopCounter):
+    """A TopCounter that also remembers when each IP was first and last seen."""
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        super().__init__(capacity)
+        self.seen = {}      # ip -> [first ts, last ts], as the log's ISO strings (they sort as text)
+
+    def add_request(self, ip, ts):
+        seen = self.seen.get(ip)
+        if seen is None:
+            self.seen[ip] = [ts, ts]
+            self.counts[ip] = 1
+            if len(self.counts) > 2 * self.capacity:
+                self.prune()
+            return
+        if ts < seen[0]:
+            seen[0] = ts
+        elif ts > seen[1]:
+            seen[1] = ts
+        self.counts[ip] += 1
+
+    def prune(self):
+        super().prune()
+        self.seen = {ip: self.seen[ip] for ip in self.counts if ip in self.seen}
+
+    def merge(self, other):
+        super().merge(other)
+        for ip, (first, last) in other.seen.items():
+            if ip in self.counts:   # it may have been pruned on the way
+                seen = self.seen.setdefault(ip, [first, last])
+                seen[0] = min(seen[0], first)
+                seen[1] = max(seen[1], last)
+
+class Summary:
+    """Everything counted over some part of the log; summaries of the parts merge."""
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.lines = 0
+        self.entries = 0            # lines inside the time window
+        self.bad_lines = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.bytes_sent = 0
+        self.statuses = {}
+        self.methods = {}
+        self.paths = TopCounter(capacity)
+        self.ips = IpCounter(capacity)
+        self.latency = Histogram()  # microseconds
+        self.pending = {}           # (status, method, path) -> count, not added up yet
+        self.durations = {}         # duration_ms -> count, not in latency yet
+        # the ones that depend on more than the status code (see SUSPICIOUS_STATUSES)
+        self.suspicious = {
+            "traversal": 0,         # "..", encoded slashes or NULs in the path
+            "scanner_paths": 0,     # well-known admin/config/exploit URLs
+            "missing_host": 0,      # parsed requests without a Host header
+        }
+
+    def add(self, entry, ts):
+        # Called for every line, so it does as little as it can: requests are counted by
+        # (status, method, path) and durations by value, and the rest is worked out in flush().
+        get = entry.get
+        status = get("status")
+        length = get("length")
+        duration = get("duration_ms")
+        if (type(status) not in INTS or type(length) not in INTS or type(duration) not in NUMBERS
+                or type(get("method")) not in STRINGS or type(get("path")) not in STRINGS
+                or type(get("ip")) not in STRINGS or type(get("headers")) not in HEADERS
+                or (type(duration) is float and not math.isfinite(duration))):
+            self.bad_lines += 1     # not something log_request() wrote; counting it would only raise later
+            return
+        self.entries += 1
+        if self.first_ts is None:
+            self.first_ts = self.last_ts = ts
+        elif ts < self.first_ts:
+            self.first_ts = ts
+        elif ts > self.last_ts:
+            self.last_ts = ts
+        key = (status, get("method") or "-", get("path") or "-")
+        pending = self.pending
+        pending[key] = pending.get(key, 0) + 1
+        self.bytes_sent += length or 0
+        self.ips.add_request(get("ip") or "-", ts)
+        if duration is not None:
+            durations = self.durations
+            durations[duration] = durations.get(duration, 0) + 1
+        if status is not None and status < 400:     # error responses are logged without headers
+            headers = get("headers")
+            if not headers or ("Host" not in headers and not any(name.lower() == "host" for name in headers)):
+                self.suspicious["missing_host"] += 1
+        if len(pending) > MAX_PENDING or len(self.durations) > MAX_PENDING:
+            self.flush()
+
+    def flush(self):
+        statuses, methods, suspicious = self.statuses, self.methods, self.suspicious
+        for (status, method, path), count in self.pending.items():
+            statuses[status] = statuses.get(status, 0) + count
+            methods[method] = methods.get(method, 0) + count
+            if path == "-":
+                continue
+            if TRAVERSAL.search(path):
+                suspicious["traversal"] += count
+            if SCANNER_PATHS.search(path):
+                suspicious["scanner_paths"] += count
+            if status is not None and status < 400:
+                self.paths.add(path.split("?", 1)[0], count)
+        self.pending = {}
+        for duration, count in self.durations.items():
+            self.latency.record(max(0, round(duration * 1000)), count)
+        self.durations = {}
+
+    def merge(self, other):
+        other.flush()
+        self.flush()
+        self.lines += other.lines
+        self.entries += other.entries
+        self.bad_lines += other.bad_lines
+        for ts in (other.first_ts, other.last_ts):
+            if ts is not None:
+                self.first_ts = ts if self.first_ts is None else min(self.first_ts, ts)
+                self.last_ts = ts if self.last_ts is None else max(self.last_ts, ts)
+        self.bytes_sent += other.bytes_sent
+        for mine, theirs in ((self.statuses, other.statuses), (self.methods, other.methods),
+                             (self.suspicious, other.suspicious)):
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+        self.paths.merge(other.paths)
+        self.ips.merge(other.ips)
+        self.latency.merge(other.latency)
+
+def normalize_ts(ts):
+    # isoformat() leaves out the fraction when it's zero; put it back so timestamps compare
+    # as text. None if it isn't one of our timestamps at all (the line counts as bad).
+    if len(ts) == TS_LENGTH - 7:
+        ts = ts[:19] + ".000000Z"
+    elif len(ts) != TS_LENGTH or ts[19] != "." or not ts[20:26].isdigit():
+        return None
+    if ts[-1] != "Z" or ts[10] != "T" or not ts.isascii() or not valid_second(ts[:19]):
+        return None
+    return ts
+
+@functools.lru_cache(maxsize=4096)
+def valid_second(text):
+    # lines come roughly in time order, so this is nearly always a cache hit
+    try:
+        datetime.fromisoformat(text)
+    except ValueError:
+        return False
+    return True
+
+def parse_time(text, now=None):
+    # "2h", "30m", "7d" (that long ago) or an ISO date/time (UTC unless it says otherwise)
+    match = RELATIVE_TIME.match(text.strip())
+    if match:
+        now = now or datetime.now(timezone.utc)
+        moment = now - timedelta(**{TIME_UNITS[match.group(2)]: float(match.group(1))})
+    else:
+        moment = datetime.fromisoformat(text.strip().replace("Z", "+00:00"))
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+def open_log(path):
+    name = str(path)
+    if name.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if name.endswith(".zst"):
+        if zstandard is None:
+            raise SystemExit(f"{path}: reading .zst segments needs the zstandard package")
+        # buffered, since the decompressing reader can't read lines by itself
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+    return open(path, "rb")
+
+def log_files(log):
+    # rotated segments oldest first (their timestamps sort as text), then the live file
+    segments = sorted(p for p in log.parent.glob(log.name + ".*") if not p.name.endswith(".tmp"))
+    return segments + ([log] if log.exists() else [])
+
+def plan_jobs(paths, chunk_bytes=CHUNK_BYTES):
+    # (path, start, end) pieces; compressed files can't be split, so they're one piece each
+    jobs = []
+    for path in paths:
+        if str(path).endswith((".gz", ".zst")):
+            jobs.append((str(path), 0, None))
+            continue
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), chunk_bytes):
+            jobs.append((str(path), start, min(start + chunk_bytes, size)))
+    return jobs
+
+def read_lines(path, start, end):
+    # the lines that begin in [start, end); end=None reads the whole (compressed) file
+    with open_log(path) as f:
+        if end is None:
+            yield from f
+            return
+        if start:
+            f.seek(start - 1)
+            f.readline()    # finish the line that began before start; it belongs to the previous piece
+        position = f.tell()
+        for line in f:
+            if position >= end:
+                return
+            position += len(line)
+            yield line
+
+def scan(job, since=None, until=None, capacity=DEFAULT_CAPACITY):
+    path, start, end = job
+    summary = Summary(capacity)
+    window = since is not None or until is not None
+    lines = 0
+    for line in read_lines(path, start, end):
+        lines += 1
+        ts = None
+        if window and line.startswith(TS_PREFIX):
+            # filter on the timestamp before paying for a full parse
+            ts = normalize_ts(line[len(TS_PREFIX):line.find(b'"', len(TS_PREFIX))].decode("ascii", "replace"))
+            if ts is None:
+                summary.bad_lines += 1
+                continue
+            if (since is not None and ts < since) or (until is not None and ts >= until):
+                continue
+        try:
+            entry = loads(line)
+        except ValueError:  # a truncated last line, or something that isn't ours
+            summary.bad_lines += 1
+            continue
+        if not isinstance(entry, dict):
+            summary.bad_lines += 1
+            continue
+        if ts is None:
+            ts = normalize_ts(str(entry.get("ts", "")))
+            if ts is None:
+                summary.bad_lines += 1
+                continue
+            if window and ((since is not None and ts < since) or (until is not None and ts >= until)):
+                continue
+        summary.add(entry, ts)
+    summary.lines = lines
+    summary.flush()
+    return summary
+
+def scan_all(jobs, since, until, capacity, processes):
+    total = Summary(capacity)
+    if processes <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            total.merge(scan(job, since, until, capacity))
+        return total
+    with multiprocessing.get_context("fork").Pool(min(processes, len(jobs))) as pool:
+        for part in pool.imap_unordered(scan_job, [(job, since, until, capacity) for job in jobs]):
+            total.merge(part)
+    return total
+
+def scan_job(args):
+    return scan(*args)
+
+def seconds_between(first, last):
+    parse = lambda ts: datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    return (parse(last) - parse(first)).total_seconds()
+
+def report(summary, files, top, elapsed):
+    ips = []
+    for ip, count in summary.ips.most_common(top):
+        first, last = summary.ips.seen[ip]
+        span = seconds_between(first, last)
+        ips.append({
+            "ip": ip,
+            "requests": count,
+            "first": first,
+            "last": last,
+            "per_second": round(count / max(span, 1.0), 3),   # over the time it was active
+        })
+    status_classes = {}
+    for status, count in summary.statuses.items():
+        label = f"{status // 100}xx" if isinstance(status, int) else str(status)
+        status_classes[label] = status_classes.get(label, 0) + count
+    span = seconds_between(summary.first_ts, summary.last_ts) if summary.entries else 0
+    suspicious = {name: sum(summary.statuses.get(status, 0) for status in statuses)
+                  for name, statuses in SUSPICIOUS_STATUSES.items()}
+    suspicious.update(summary.suspicious)
+    return {
+        "files": [str(path) for path in files],
+        "lines": summary.lines,
+        "bad_lines": summary.bad_lines,
+        "requests": summary.entries,
+        "first": summary.first_ts,
+        "last": summary.last_ts,
+        "per_second": round(summary.entries / max(span, 1.0), 3),
+        "bytes_sent": summary.bytes_sent,
+        "status": {str(status): count for status, count in sorted(summary.statuses.items(), key=lambda item: str(item[0]))},
+        "status_classes": dict(sorted(status_classes.items())),
+        "methods": dict(sorted(summary.methods.items(), key=lambda item: -item[1])),
+        "top_paths": summary.paths.most_common(top),
+        "top_ips": ips,
+        "approximate": bool(summary.paths.error or summary.ips.error),  # too many distinct keys to count them all
+        "latency_ms": summary.latency.summary(scale=1000),
+        "suspicious": suspicious,
+        "elapsed_s": round(elapsed, 3),
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize the access log (and its rotated segments).")
+    parser.add_argument("files", nargs="*", type=Path,
+                        help=f"log files to read (default: {DEFAULT_LOG} and its rotated segments)")
+    parser.add_argument("--log", type=Path, default=DEFAULT_LOG,
+                        help="live log whose rotated segments are read too when no files are given")
+    parser.add_argument("--no-rotated", action="store_true", help="only read the live log, not its segments")
+    parser.add_argument("--since", help="only entries at or after this time: ISO time (UTC) or 30m/2h/7d ago")
+    parser.add_argument("--until", help="only entries before this time, in the same forms as --since")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="paths and IPs listed")
+    parser.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY,
+                        help="distinct paths and IPs counted exactly before rare ones are pruned")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="processes reading the logs")
+    parser.add_argument("--output", help="also write the report to this file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.files:
+        files = args.files
+    elif args.no_rotated:
+        files = [args.log] if args.log.exists() else []
+    else:
+        files = log_files(args.log)
+    if not files:
+        sys.exit(f"no log files found at {args.log}")
+    try:
+        since = parse_time(args.since) if args.since else None
+        until = parse_time(args.until) if args.until else None
+    except ValueError as e:
+        sys.exit(f"bad time: {e}")
+    started = time.perf_counter()
+    summary = scan_all(plan_jobs(files), since, until, max(1, args.capacity), args.jobs)
+    result = report(summary, files, args.top, time.perf_counter() - started)
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
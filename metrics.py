@@ -0,0 +1,172 @@
+"""
+In-process request metrics, exported in the Prometheus text format.
+"""
+
+import threading
+from bisect import bisect_left
+
+DEFAULT_MAX_PATHS = 200     # distinct path labels before the rest are lumped together as OTHER_PATH
+OTHER_PATH = "other"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "lab_http"
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Shard:
+    """One thread's counters. Only its own thread ever writes to it."""
+    __slots__ = ("requests", "bytes_sent", "connections_opened", "connections_closed", "timeouts", "latency")
+
+    def __init__(self):
+        self.requests = {}          # (method, status) -> count
+        self.bytes_sent = 0
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.timeouts = {}          # phase -> count
+        self.latency = {}           # path -> [count per bucket..., count above the last, sum of seconds]
+
+class MetricsRegistry:
+    """Counters and latency histograms fed by the request handlers.
+
+    Every thread records into its own Shard, found through a
+    threading.local, so recording a request is a few dict and list
+    updates with no lock at all; a lock is only taken the first time a
+    thread records anything. render() adds the shards up when the metrics
+    are scraped, copying each dict or list in one step so it never sees a
+    half-applied update.
+
+    Paths are only used as labels for successful responses and only for
+    the first max_paths distinct ones; everything else is counted under
+    "other", so a scan of random URLs can't grow the registry without end.
+
+    Each prefork worker process has its own registry, so a scrape only
+    shows the worker that happened to accept it.
+    """
+    def __init__(self, max_paths=DEFAULT_MAX_PATHS, buckets=LATENCY_BUCKETS):
+        self.max_paths = max_paths
+        self.buckets = tuple(sorted(buckets))
+        self.paths = set()
+        self.shards = []
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = self.local.shard = Shard()
+            with self.lock:
+                self.shards.append(shard)
+        return shard
+
+    def connection_opened(self):
+        self.shard().connections_opened += 1
+
+    def connection_closed(self):
+        self.shard().connections_closed += 1
+
+    def timed_out(self, phase):
+        timeouts = self.shard().timeouts
+        timeouts[phase] = timeouts.get(phase, 0) + 1
+
+    def record(self, method, path, status, length, duration=None):
+        shard = self.shard()
+        key = (method, status)
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+        shard.bytes_sent += length
+        if duration is None:
+            return
+        label = self.path_label(path, status)
+        histogram = shard.latency.get(label)
+        if histogram is None:
+            histogram = shard.latency[label] = [0] * (len(self.buckets) + 2)
+        histogram[bisect_left(self.buckets, duration)] += 1
+        histogram[-1] += duration
+
+    def path_label(self, path, status):
+        if status >= 400:
+            return OTHER_PATH
+        path = path.split("?", 1)[0]
+        if path in self.paths:
+            return path
+        with self.lock:
+            if len(self.paths) < self.max_paths:
+                self.paths.add(path)
+                return path
+        return OTHER_PATH
+
+    def add_collector(self, name, stats, counters=()):
+        # Export a component's stats() dict too: name_<key> for each key, as a counter
+        # (name_<key>_total) for the keys listed in counters and a gauge otherwise.
+        self.collectors.append((name, stats, frozenset(counters)))
+
+    def snapshot(self):
+        with self.lock:
+            shards = list(self.shards)
+        requests = {}
+        timeouts = {}
+        latency = {}
+        totals = {"bytes_sent": 0, "connections_opened": 0, "connections_closed": 0}
+        for shard in shards:
+            for key, count in dict(shard.requests).items():
+                requests[key] = requests.get(key, 0) + count
+            for name in totals:
+                totals[name] += getattr(shard, name)
+            for phase, count in dict(shard.timeouts).items():
+                timeouts[phase] = timeouts.get(phase, 0) + count
+            for path, histogram in dict(shard.latency).items():
+                histogram = list(histogram)
+                merged = latency.setdefault(path, [0] * len(histogram))
+                for i, value in enumerate(histogram):
+                    merged[i] += value
+        return requests, timeouts, latency, totals
+
+    def timeouts(self):
+        return self.snapshot()[1]
+
+    def render(self):
+        requests, timeouts, latency, totals = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+
+        metric("requests_total", "counter", "Responses sent, by request method and status code.")
+        for (method, status), count in sorted(requests.items()):
+            lines.append(f'{PREFIX}_requests_total{{method="{escape_label(method)}",status="{status}"}} {count}')
+        metric("response_bytes_total", "counter", "Response body bytes sent.")
+        lines.append(f"{PREFIX}_response_bytes_total {totals['bytes_sent']}")
+        metric("connections_total", "counter", "Connections accepted.")
+        lines.append(f"{PREFIX}_connections_total {totals['connections_opened']}")
+        metric("connections_active", "gauge", "Connections currently open.")
+        lines.append(f"{PREFIX}_connections_active {totals['connections_opened'] - totals['connections_closed']}")
+        metric("request_timeouts_total", "counter", "Connections closed for missing a read deadline, by phase.")
+        for phase, count in sorted(timeouts.items()):
+            lines.append(f'{PREFIX}_request_timeouts_total{{phase="{escape_label(phase)}"}} {count}')
+
+        metric("request_duration_seconds", "histogram", "Time to answer a request, by path.")
+        for path, histogram in sorted(latency.items()):
+            label = f'path="{escape_label(path)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram):
+                cumulative += count
+                lines.append(f'{PREFIX}_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            cumulative += histogram[len(self.buckets)]
+            lines.append(f'{PREFIX}_request_duration_seconds_bucket{{{label},le="+Inf"}} {cumulative}')
+            lines.append(f"{PREFIX}_request_duration_seconds_sum{{{label}}} {histogram[-1]!r}")
+            lines.append(f"{PREFIX}_request_duration_seconds_count{{{label}}} {cumulative}")
+
+        for name, stats, counters in self.collectors:
+            for key, value in stats().items():
+                if key in counters:
+                    metric(f"{name}_{key}_total", "counter", f"{name.replace('_', ' ')}: {key.replace('_', ' ')}.")
+                    lines.append(f"{PREFIX}_{name}_{key}_total {format_value(value)}")
+                else:
+                    metric(f"{name}_{key}", "gauge", f"{name.replace('_', ' ')}: {key.replace('_', ' ')}.")
+                    lines.append(f"{PREFIX}_{name}_{key} {format_value(value)}")
+        return ("\n".join(lines) + "\n").encode("utf-8")
@@ -0,0 +1,110 @@
+"""
+File extension -> Content-Type table.
+"""
+
+import functools
+import os
+
+DEFAULT_TYPE = "application/octet-stream"
+DEFAULT_CHARSET = "utf-8"
+DEFAULT_TYPES = {
+    # text
+    "text/html": ("html", "htm"),
+    "text/css": ("css",),
+    "text/javascript": ("js", "mjs"),
+    "text/plain": ("txt", "text", "log"),
+    "text/csv": ("csv",),
+    "text/markdown": ("md", "markdown"),
+    "application/json": ("json", "map"),
+    "application/manifest+json": ("webmanifest",),
+    "application/ld+json": ("jsonld",),
+    "application/xml": ("xml", "xsl"),
+    "application/xhtml+xml": ("xhtml",),
+    "application/rss+xml": ("rss",),
+    "application/atom+xml": ("atom",),
+    # images
+    "image/svg+xml": ("svg",),
+    "image/png": ("png",),
+    "image/jpeg": ("jpg", "jpeg"),
+    "image/gif": ("gif",),
+    "image/webp": ("webp",),
+    "image/avif": ("avif",),
+    "image/x-icon": ("ico",),
+    "image/bmp": ("bmp",),
+    # fonts
+    "font/woff": ("woff",),
+    "font/woff2": ("woff2",),
+    "font/ttf": ("ttf",),
+    "font/otf": ("otf",),
+    "application/vnd.ms-fontobject": ("eot",),
+    # audio and video
+    "audio/mpeg": ("mp3",),
+    "audio/ogg": ("ogg", "oga"),
+    "audio/wav": ("wav",),
+    "video/mp4": ("mp4",),
+    "video/webm": ("webm",),
+    # everything else
+    "application/wasm": ("wasm",),
+    "application/pdf": ("pdf",),
+    "application/zip": ("zip",),
+    "application/gzip": ("gz",),
+    "application/x-tar": ("tar",),
+}
+# types that get "; charset=..." besides text/*
+CHARSET_TYPES = {"application/json", "application/manifest+json", "application/ld+json", "application/xml",
+                 "application/xhtml+xml", "application/rss+xml", "application/atom+xml", "image/svg+xml"}
+
+@functools.lru_cache(maxsize=None)
+def header_line(content_type):
+    # b"Content-Type: ...\r\n", built once per type and shared by every response using it
+    return f"Content-Type: {content_type}\r\n".encode("latin-1")
+
+class MimeTable:
+    """Maps file names to Content-Type values by extension (case-insensitive).
+
+    Text types get "; charset=<default_charset>" unless a charset is given
+    explicitly. load() reads extra or overriding entries from a file in
+    the mime.types format, one type per line followed by its extensions:
+
+        # comments and blank lines are ignored
+        text/markdown           md markdown
+        text/plain;charset=latin-1  txt
+        application/x-sh        sh
+    """
+    def __init__(self, types=DEFAULT_TYPES, default_type=DEFAULT_TYPE, default_charset=DEFAULT_CHARSET):
+        self.default_charset = default_charset
+        self.default_type = default_type
+        self.types = {}     # ".html" -> "text/html; charset=utf-8"
+        for mime_type, extensions in types.items():
+            self.add(mime_type, *extensions)
+
+    def add(self, mime_type, *extensions, charset=None):
+        mime_type = mime_type.strip().lower()
+        if ";" in mime_type:
+            mime_type, _, params = mime_type.partition(";")
+            key, _, value = params.strip().partition("=")
+            if key.strip() == "charset" and value.strip():
+                charset = value.strip()
+            mime_type = mime_type.strip()
+        if charset is None and self.default_charset and (mime_type.startswith("text/") or mime_type in CHARSET_TYPES):
+            charset = self.default_charset
+        content_type = f"{mime_type}; charset={charset}" if charset else mime_type
+        for extension in extensions:
+            self.types["." + extension.lower().lstrip(".")] = content_type
+        header_line(content_type)   # build the header bytes now rather than on a request
+
+    def load(self, path):
+        with open(path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.split("#", 1)[0].strip().rstrip(";")
+                if not line:
+                    continue
+                # "type;charset=x ext..." or "type; charset=x ext..."
+                line = line.replace("; ", ";")
+                mime_type, *extensions = line.split()
+                if "/" not in mime_type:
+                    raise ValueError(f"{path}:{line_number}: {mime_type!r} isn't a MIME type")
+                self.add(mime_type, *extensions)
+
+    def content_type(self, path):
+        return self.types.get(os.path.splitext(path)[1].lower(), self.default_type)
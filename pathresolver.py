@@ -0,0 +1,150 @@
+"""
+Memoized mapping from request paths to files under the www/ sandbox.
+"""
+
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+from filecache import DEFAULT_REVALIDATE_INTERVAL, stat_key
+
+DEFAULT_MAX_ENTRIES = 4096
+MAX_CHECK_DEPTH = 32        # deeper paths are resolved every time instead of being remembered
+INDEX_FILE = "index.html"
+
+FILE = "file"               # serve Resolution.path
+REDIRECT = "redirect"       # a directory asked for without the trailing slash
+FORBIDDEN = "forbidden"     # resolves to somewhere outside the root
+MISSING = "missing"
+
+class Resolution:
+    __slots__ = ("kind", "path", "checks", "checked_at")
+
+    def __init__(self, kind, path=None, checks=None):
+        self.kind = kind
+        self.path = path            # the real file to serve, for FILE
+        self.checks = checks        # ((path, stat key or None), ...) the answer depends on
+        self.checked_at = 0
+
+def path_key(path):
+    try:
+        return stat_key(os.stat(path))
+    except (OSError, ValueError):
+        return None
+
+class PathResolver:
+    """LRU cache from decoded request path to what it resolves to.
+
+    The slow path is what the handler used to do on every request:
+    resolve symlinks and "..", make sure the result is still inside root,
+    and tell files from directories. The answer is remembered together
+    with the stat() of every directory the request path walks through;
+    creating, deleting, renaming or re-pointing anything in them changes
+    one of those, so an entry is re-checked at most once every
+    revalidate_interval seconds and thrown away if any of them differ.
+    In between, a hit is one dict lookup.
+
+    Missing and forbidden paths are remembered too, so scanners hammering
+    made-up URLs don't cost a realpath() each; the size bound keeps them
+    from crowding out memory.
+    """
+    def __init__(self, root, max_entries=DEFAULT_MAX_ENTRIES, revalidate_interval=DEFAULT_REVALIDATE_INTERVAL):
+        self.root = os.path.realpath(root)
+        self.max_entries = max_entries
+        self.revalidate_interval = revalidate_interval
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def resolve(self, decoded_path):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(decoded_path)
+            if entry is not None:
+                self.entries.move_to_end(decoded_path)
+                if now - entry.checked_at < self.revalidate_interval:
+                    self.hits += 1
+                    return entry
+        if entry is not None:
+            # stat outside the lock so one slow disk doesn't stall every thread
+            if all(path_key(directory) == key for directory, key in entry.checks):
+                entry.checked_at = now
+                with self.lock:
+                    self.hits += 1
+                return entry
+            with self.lock:
+                self.invalidations += 1
+        checks = self.checks_for(decoded_path)
+        entry = self.classify(decoded_path)
+        with self.lock:
+            self.misses += 1
+            if checks is not None and self.max_entries > 0:
+                entry.checks = checks
+                entry.checked_at = now
+                self.entries[decoded_path] = entry
+                self.entries.move_to_end(decoded_path)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return entry
+
+    def checks_for(self, decoded_path):
+        # stat() of root and of each directory on the way to the last path component,
+        # taken before classifying so a change in between is caught next time
+        parts = [part for part in decoded_path.split("/")[:-1] if part not in ("", ".")]
+        if len(parts) > MAX_CHECK_DEPTH:
+            return None
+        directory = self.root
+        checks = [(directory, path_key(directory))]
+        for part in parts:
+            directory = os.path.join(directory, part)
+            checks.append((directory, path_key(directory)))
+        # and of the target itself: a directory's index file or redirect depends on it
+        last = os.path.join(directory, decoded_path.rsplit("/", 1)[-1])
+        checks.append((last, path_key(last)))
+        return tuple(checks)
+
+    def classify(self, decoded_path):
+        try:
+            full_path = os.path.realpath(os.path.join(self.root, decoded_path.lstrip("/")))
+        except ValueError:  # a NUL byte in the path
+            return Resolution(MISSING)
+        # Don't let the user leave the root
+        if full_path != self.root and not full_path.startswith(self.root + os.sep):
+            return Resolution(FORBIDDEN)
+        try:
+            mode = os.stat(full_path).st_mode
+        except OSError:
+            return Resolution(MISSING)
+        if stat.S_ISDIR(mode):
+            if not decoded_path.endswith("/"):
+                return Resolution(REDIRECT)
+            # serve index.html within the directory by default
+            full_path = os.path.join(full_path, INDEX_FILE)
+            try:
+                mode = os.stat(full_path).st_mode
+            except OSError:
+                return Resolution(MISSING)
+        if not stat.S_ISREG(mode):
+            return Resolution(MISSING)
+        return Resolution(FILE, full_path)
+
+    def invalidate(self, decoded_path=None):
+        # forget one path, or everything
+        with self.lock:
+            if decoded_path is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(decoded_path, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
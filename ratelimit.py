@@ -0,0 +1,126 @@
+"""
+Per-client-IP request rate limits and concurrent connection caps.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_BURST = 20              # requests a client can make at once before the rate applies
+DEFAULT_MAX_CLIENTS = 65536     # IPs tracked before the least recently seen idle ones are forgotten
+CONNECTION_RETRY_AFTER = 1      # seconds suggested to a client over its connection cap, or when the table is full
+
+class ClientState:
+    __slots__ = ("tokens", "updated", "connections")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+        self.connections = 0
+
+class RateLimiter:
+    """A token bucket and an open-connection count for each client IP.
+
+    Each IP's bucket holds up to `burst` tokens and refills at `rate`
+    tokens a second; a request takes one, and a client with an empty
+    bucket is told when the next token arrives. Refilling is worked out
+    from the time since the last request, so there's no timer, and every
+    operation is a dict lookup plus a little arithmetic.
+
+    The table is bounded by max_clients: when it's full, the least
+    recently seen IP without open connections is dropped (a forgotten IP
+    just starts again with a full bucket). IPs with open connections are
+    kept apart from that LRU and never dropped, since forgetting one
+    would reset its connection count; if every entry is such an IP, a
+    new one is refused until a connection closes. A flood from spoofed
+    or rotating addresses therefore costs a fixed amount of memory.
+
+    rate=0 turns off request limiting and max_connections=0 turns off the
+    connection cap. Limits are per process, so in prefork mode each worker
+    applies them separately.
+    """
+    def __init__(self, rate=0, burst=DEFAULT_BURST, max_connections=0, max_clients=DEFAULT_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_connections = max_connections
+        self.max_clients = max(1, max_clients)
+        self.idle = OrderedDict()   # IPs without open connections, least recently seen first
+        self.busy = {}              # IPs with open connections
+        self.lock = threading.Lock()
+        self.limited_requests = 0
+        self.limited_connections = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return bool(self.rate or self.max_connections)
+
+    def client(self, ip, now):
+        # caller holds self.lock; None if the table is full of clients with open connections
+        state = self.busy.get(ip)
+        if state is not None:
+            return state
+        state = self.idle.get(ip)
+        if state is not None:
+            self.idle.move_to_end(ip)
+            return state
+        if len(self.idle) + len(self.busy) >= self.max_clients:
+            if not self.idle:
+                return None
+            self.idle.popitem(last=False)
+            self.evictions += 1
+        state = self.idle[ip] = ClientState(self.burst, now)
+        return state
+
+    def open_connection(self, ip):
+        # Returns True if the client may have another connection (call close_connection() later).
+        if not self.max_connections:
+            return True
+        with self.lock:
+            state = self.client(ip, time.monotonic())
+            if state is None or state.connections >= self.max_connections:
+                self.limited_connections += 1
+                return False
+            if not state.connections:
+                self.busy[ip] = self.idle.pop(ip)
+            state.connections += 1
+            return True
+
+    def close_connection(self, ip):
+        if not self.max_connections:
+            return
+        with self.lock:
+            state = self.busy.get(ip)
+            if state is None:
+                return
+            state.connections -= 1
+            if not state.connections:
+                self.idle[ip] = self.busy.pop(ip)   # most recently seen
+
+    def allow_request(self, ip):
+        # Returns 0 if the request may go ahead, otherwise whole seconds until it could.
+        if not self.rate:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            state = self.client(ip, now)
+            if state is None:
+                self.limited_requests += 1
+                return CONNECTION_RETRY_AFTER
+            state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+            state.updated = now
+            if state.tokens >= 1:
+                state.tokens -= 1
+                return 0
+            self.limited_requests += 1
+            return max(1, math.ceil((1 - state.tokens) / self.rate))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "clients": len(self.idle) + len(self.busy),
+                "limited_requests": self.limited_requests,
+                "limited_connections": self.limited_connections,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,188 @@
+"""
+Incremental HTTP/1.x request head parser.
+"""
+
+DEFAULT_MAX_LINE = 8190             # longest request line (414 beyond this)
+DEFAULT_MAX_HEADER_BYTES = 65536    # all header lines together (431 beyond this)
+DEFAULT_MAX_HEADERS = 100           # number of header fields (431 beyond this)
+MAX_LEADING_BLANK_LINES = 8         # empty lines tolerated before a request line (400 beyond this)
+SUPPORTED_VERSIONS = ("HTTP/1.0", "HTTP/1.1")
+TOKEN_CHARS = frozenset("!#$%&'*+-.^_`|~0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz")
+
+class HttpParseError(Exception):
+    """The request can't be parsed; status and reason say what to answer with."""
+    def __init__(self, status, reason):
+        super().__init__(f"{status} {reason}")
+        self.status = status
+        self.reason = reason
+
+class Request:
+    __slots__ = ("method", "path", "version", "headers")
+
+    def __init__(self, method, path, version, headers):
+        self.method = method
+        self.path = path            # request target as sent, still percent-encoded
+        self.version = version
+        self.headers = headers      # {name as sent: value}, repeated fields joined with ", "
+
+class RequestParser:
+    """Parses request heads out of a byte stream, however it's split up.
+
+    feed() appends whatever the socket returned to one bytearray that lives
+    as long as the connection. parse() scans only the lines it hasn't seen
+    yet, slicing through a memoryview, and returns True once the blank line
+    ending the head has arrived; next_request() then hands over the Request
+    (or None if it's not complete yet). Whatever follows stays buffered, so
+    pipelined requests come out one by one.
+
+    Limits are checked as bytes arrive, so an oversized head is rejected
+    without waiting for it to finish. Once a parse error is raised the
+    connection is unusable, and every later call raises it again.
+    """
+    def __init__(self, max_line=DEFAULT_MAX_LINE, max_header_bytes=DEFAULT_MAX_HEADER_BYTES,
+                 max_headers=DEFAULT_MAX_HEADERS):
+        self.max_line = max_line
+        self.max_header_bytes = max_header_bytes
+        self.max_headers = max_headers
+        self.buffer = bytearray()
+        self.error = None
+        self.reset()
+
+    def reset(self):
+        self.scanned = 0            # buffer offset of the first line not parsed yet
+        self.request_line = None    # (method, path, version) once parsed
+        self.headers = {}
+        self.header_count = 0
+        self.header_bytes = 0
+        self.blank_lines = 0
+        self.complete = False
+
+    def feed(self, data):
+        self.buffer += data
+
+    def discard(self, size):
+        # drop up to size bytes (a request body) from the front of the buffer; returns how many
+        size = min(size, len(self.buffer))
+        del self.buffer[:size]
+        return size
+
+    def next_request(self):
+        if not self.parse():
+            return None
+        method, path, version = self.request_line
+        request = Request(method, path, version, self.headers)
+        del self.buffer[:self.scanned]  # keep anything pipelined after this request
+        self.reset()
+        return request
+
+    def parse(self):
+        if self.error is not None:
+            raise self.error
+        if self.complete:
+            return True
+        try:
+            self.complete = self.scan()
+        except HttpParseError as e:
+            self.error = e
+            raise
+        if self.request_line is None and self.scanned:
+            # only blank lines so far: nothing to keep them for
+            del self.buffer[:self.scanned]
+            self.scanned = 0
+        return self.complete
+
+    def scan(self):
+        buffer = self.buffer
+        with memoryview(buffer) as view:
+            while True:
+                end = buffer.find(b"\n", self.scanned)
+                if end == -1:
+                    self.check_partial_line(len(buffer) - self.scanned)
+                    return False
+                start = self.scanned
+                self.scanned = end + 1
+                if end > start and buffer[end - 1] == 0x0D:     # drop the \r of \r\n
+                    end -= 1
+
+                if self.request_line is None:
+                    if end == start:    # RFC 9112 2.2: ignore blank lines before the request line...
+                        self.blank_lines += 1
+                        if self.blank_lines > MAX_LEADING_BLANK_LINES:
+                            raise HttpParseError(400, "Bad Request")    # ...but not an endless stream of them
+                        continue
+                    if end - start > self.max_line:
+                        raise HttpParseError(414, "URI Too Long")
+                    self.request_line = self.parse_request_line(buffer, view, start, end)
+                    continue
+
+                if end == start:    # blank line: end of the head
+                    return True
+
+                self.header_bytes += self.scanned - start
+                self.header_count += 1
+                if self.header_bytes > self.max_header_bytes or self.header_count > self.max_headers:
+                    raise HttpParseError(431, "Request Header Fields Too Large")
+                self.parse_header(buffer, view, start, end)
+
+    def check_partial_line(self, pending):
+        # the line being received is already too long, no point waiting for the rest of it
+        if self.request_line is None:
+            if pending > self.max_line:
+                raise HttpParseError(414, "URI Too Long")
+        elif self.header_bytes + pending > self.max_header_bytes:
+            raise HttpParseError(431, "Request Header Fields Too Large")
+
+    def parse_request_line(self, buffer, view, start, end):
+        # method SP request-target SP HTTP-version
+        first = buffer.find(b" ", start, end)
+        last = buffer.rfind(b" ", start, end)
+        if first <= start or last == first or last == end - 1:
+            raise HttpParseError(400, "Bad Request")
+        method = str(view[start:first], "ascii", "replace")
+        # latin-1 keeps every byte as one character, so percent_decode can rebuild raw UTF-8
+        path = str(view[first + 1:last], "latin-1")
+        version = str(view[last + 1:end], "ascii", "replace")
+        if not TOKEN_CHARS.issuperset(method) or not path or " " in path:
+            raise HttpParseError(400, "Bad Request")
+        if not version.startswith("HTTP/"):
+            raise HttpParseError(400, "Bad Request")
+        if version not in SUPPORTED_VERSIONS:
+            raise HttpParseError(505, "HTTP Version Not Supported")
+        return method, path, version
+
+    def parse_header(self, buffer, view, start, end):
+        if buffer[start] in b" \t":
+            raise HttpParseError(400, "Bad Request")    # obsolete line folding
+        colon = buffer.find(b":", start, end)
+        if colon <= start or buffer[colon - 1] in b" \t":
+            raise HttpParseError(400, "Bad Request")    # no name, or space before the colon
+        name = str(view[start:colon], "latin-1")
+        value = str(view[colon + 1:end], "latin-1").strip(" \t")
+        if name in self.headers:
+            self.headers[name] += ", " + value
+        else:
+            self.headers[name] = value
+
+def body_length(headers):
+    """How many bytes of body follow a request head with these headers.
+
+    Only Content-Length framing is accepted: a chunked body would have to be
+    decoded just to find where it ends, so Transfer-Encoding gets a 411, and
+    a Content-Length that isn't a plain number (or repeats disagree) a 400.
+    Either way the connection can't be trusted with another request.
+    """
+    values = set()
+    for name, value in headers.items():
+        name = name.lower()
+        if name == "transfer-encoding":
+            raise HttpParseError(411, "Length Required")
+        if name == "content-length":
+            values.update(part.strip() for part in value.split(","))   # repeats were joined with ", "
+    if not values:
+        return 0
+    if len(values) != 1:
+        raise HttpParseError(400, "Bad Request")
+    length = values.pop()
+    if not (length.isascii() and length.isdigit()):
+        raise HttpParseError(400, "Bad Request")
+    return int(length)
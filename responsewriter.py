@@ -0,0 +1,113 @@
+"""
+Gathers the pieces of HTTP responses and sends them with as few syscalls as possible.
+"""
+
+import os
+import selectors
+import socket
+
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")     # most buffers one sendmsg() takes
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = -1
+if IOV_MAX <= 0:
+    IOV_MAX = 1024
+MAX_QUEUED = 256 * 1024     # bytes queued before write() flushes by itself
+
+class ResponseWriter:
+    """Queues bytes for a socket and sends them all with one sendmsg().
+
+    write() only keeps a reference to what it's given (no copying), so a
+    status line, a prebuilt header block, the Connection header and a
+    cached body go out together as one scatter/gather write, and a small
+    response is a single TCP segment. Nothing is sent until flush() (or
+    until MAX_QUEUED bytes are waiting); the handler flushes before it
+    waits for the next request, so responses to pipelined requests are
+    coalesced as well. Whatever is passed to write()
+    must not change until it's been flushed.
+
+    TCP_NODELAY is turned on, since every flush is a complete response (or
+    a full buffer) and there's nothing to gain from Nagle's algorithm
+    holding back the last partial segment until the previous one is
+    acknowledged. For a body sent with sendfile() after the headers, cork()
+    sets TCP_CORK (where the OS has it) so the headers share a segment with
+    the start of the body; uncork() pushes out whatever is left.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.parts = []
+        self.queued = 0
+        self.corked = False
+        self.syscalls = 0
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):  # not TCP
+            pass
+
+    def write(self, data):
+        if data:
+            self.parts.append(data)
+            self.queued += len(data)
+            if self.queued >= MAX_QUEUED:
+                self.flush()
+
+    def flush(self):
+        parts = self.parts
+        if not parts:
+            return
+        self.parts = []
+        self.queued = 0
+        if len(parts) == 1 or not hasattr(self.sock, "sendmsg"):
+            self.send_all(parts[0] if len(parts) == 1 else b"".join(parts))
+            return
+        views = [memoryview(part).cast("B") for part in parts]
+        first = 0
+        while first < len(views):
+            n = self.sock.sendmsg(views[first:first + IOV_MAX])
+            self.syscalls += 1
+            # skip past everything that was sent; a partial send leaves part of one piece
+            while n and first < len(views):
+                size = len(views[first])
+                if n >= size:
+                    n -= size
+                    first += 1
+                else:
+                    views[first] = views[first][n:]
+                    n = 0
+
+    def send_all(self, data):
+        view = memoryview(data).cast("B")
+        while view:
+            n = self.sock.send(view)
+            self.syscalls += 1
+            view = view[n:]
+
+    def wait_writable(self):
+        # For os.sendfile() on the socket's descriptor: with a timeout set, the socket is
+        # non-blocking underneath, and only the socket methods wait by themselves.
+        # (a selector, not select.select(), which can't take descriptors >= 1024)
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.sock, selectors.EVENT_WRITE)
+            writable = selector.select(self.sock.gettimeout())
+        if not writable:
+            raise TimeoutError("timed out sending response")
+
+    def discard(self):
+        # drop whatever is queued without sending it (the client has stopped reading)
+        self.parts = []
+        self.queued = 0
+
+    def cork(self):
+        self.set_cork(True)
+
+    def uncork(self):
+        self.set_cork(False)
+
+    def set_cork(self, on):
+        if on == self.corked or not hasattr(socket, "TCP_CORK"):
+            return
+        try:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, int(on))
+            self.corked = on
+        except OSError:
+            pass
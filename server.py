@@ -1,177 +1,1194 @@
-#!/usr/bin/env python3
-
-"""
-A basic Python 3 HTTP/1.1 server.
-"""
-
-import socketserver
-from datetime import datetime
-import json
-import pathlib
-import time
-from pathlib import Path
-
-HOST = "0.0.0.0"
-PORT = 8000
-BUFSIZE = 4096
-LINE_ENDING='\r\n'
-SERVE_PATH = Path('www').resolve()
-REQUEST_LOG_FILE = Path("logs/access.jsonl")
-REQUEST_LOG_FILE.parent.mkdir(exist_ok=True)
-HTTP_1_1 = 'HTTP/1.1'
-
-class LabHttpTcpServer(socketserver.TCPServer):
-    allow_reuse_address = True
-
-class LabHttpTCPHandler(socketserver.StreamRequestHandler):
-    def __init__(self, *args, **kwargs):
-        self.charset = "UTF-8"
-        self.serve_path = pathlib.Path("www").resolve()
-        super().__init__(*args, **kwargs)
-
-    def receive_line(self):
-        return self.rfile.readline().strip().decode(self.charset, 'ignore')
-    
-    def send_line(self, line):
-        self.wfile.write((line + LINE_ENDING).encode(self.charset, 'ignore'))
-
-    def handle(self):
-        start_time = time.time()    # for tracking processing time
-
-        # Receive and decode the request
-        request_line = self.rfile.readline().strip().decode('utf-8')
-        
-        # Extract the method and path from the request
-        method, path, _ = request_line.split(' ', 2)
-        # save the method and path in case the error function needs to log the request
-        self.last_method = method
-        self.last_path = path
-        if method != "GET":
-            self.send_error(405, "Method Not Allowed")
-            return
-        decoded_path = self.percent_decode(path)
-        headers = self.parse_headers()
-        
-        serving_dir = Path("./www").resolve()
-        full_path = (serving_dir / decoded_path.lstrip("/")).resolve()  # this doesn't work unless I remove the first "/"
-        # Don't let the user leave ./www
-        if serving_dir not in full_path.parents and full_path != serving_dir:
-            self.send_error(403, "Forbidden")
-            return
-        if not full_path.exists():
-            self.send_error(404, "Not Found")
-            return
-        if full_path.is_dir():
-            if decoded_path[-1] != "/":
-                # redirect to directory path
-                self.send_error(301, "Moved Permanently", headers={"Location": path + "/"})
-                return
-            else:
-                # serve index.html within the directory by default
-                full_path = full_path / "index.html"
-        
-        if not full_path.exists():
-            self.send_error(404, "Not Found")
-            return
-        
-        content = full_path.read_bytes()
-        # get the mime type of the file being served (assume only html and css)
-        extension = full_path.suffix.lower()
-        mime_type = "application/octet-stream"  # just in case the filetype isn't html or css
-        if extension == ".html":
-            mime_type = "text/html"
-        elif extension == ".css":
-            mime_type = "text/css"
-
-        self.wfile.write(f"HTTP/1.1 200 OK\r\n".encode())
-        self.wfile.write(f"Content-Length: {len(content)}\r\n".encode())
-        self.wfile.write(f"Content-Type: {mime_type}\r\n".encode())
-        self.wfile.write(b"Connection: close\r\n")
-        self.wfile.write(b"\r\n")
-        self.wfile.write(content)   
-
-        duration = time.time() - start_time
-
-        # log successful request
-        self.log_request(
-            self.client_address[0], # ip
-            method,                 # GET, POST, etc.
-            path,                   # requested path
-            200,                    # status code (success)
-            len(content),           # response length
-            headers=headers,
-            duration=duration,
-            src_port=self.client_address[1]
-        )     
-
-    def parse_headers(self):
-        headers = {}
-        while True:
-            line = self.rfile.readline().strip().decode('utf-8')
-            if not line:
-                break
-            key, value = line.split(":", 1)
-            headers[key.strip()] = value.strip()
-        return headers
-
-    def percent_decode(self, string):
-        result = []
-        i = 0
-        while i < len(string):
-            char = string[i]
-            if char == "%" and i + 2 < len(string): # if we're currently on an encoded character
-                hex_val = string[i+1:i+3]   # set the hexadecimal value to be the 2 characters after %
-                byte = int(hex_val, 16)     # convert to decimal
-                result.append(byte)
-                i += 3
-            else:
-                result.append(ord(char))
-                i += 1
-
-        return bytes(result).decode("utf-8")    # turn result into bytes like xc3 and then decode to normal chars
-
-    def send_error(self, code, message, headers=None):
-        self.wfile.write(f"HTTP/1.1 {str(code)} {message}\r\n".encode())
-        if headers:
-            for key, value in headers.items():
-                self.wfile.write(f"{key}: {value}\r\n".encode())
-        self.wfile.write(f"Content-Length: 0\r\n".encode())
-        self.wfile.write(b"Connection: close\r\n")
-        self.wfile.write(b"\r\n")
-
-        # log error
-        self.log_request(
-            self.client_address[0],
-            getattr(self, "last_method", "-"),  # fallback if method not parsed
-            getattr(self, "last_path", "-"),
-            code,
-            0
-        )
-
-        return
-
-    def log_request(self, client_ip, method, path, status, length, headers=None, duration=None, src_port=None):
-        entry = {
-            "ts": datetime.utcnow().isoformat() + "Z",
-            "ip": client_ip,
-            "src_port": src_port,
-            "method": method,
-            "path": path,
-            "status": status,
-            "length": length,
-            "duration_ms": round(duration * 1000, 2) if duration else None,
-            "headers": headers or {}
-        }
-        with REQUEST_LOG_FILE.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(entry) + "\n")
-
-def main():
-    # From https://docs.python.org/3/library/socketserver.html, The Python Software Foundation, downloaded 2024-01-07
-    with LabHttpTcpServer((HOST,PORT),LabHttpTCPHandler) as server:
-        print("server is starting")
-        print("running")
-        server.serve_forever() 
-
-
-if __name__ == "__main__":
+#!/usr/bin/env python3
+
+"""
+A basic Python 3 HTTP/1.1 server.
+"""
+
+import socketserver
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+import argparse
+import asyncio
+import contextlib
+import errno
+import json
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import accesslog
+import anomaly
+import filecache
+import logcolumns
+import metrics
+import mimetable
+import pathresolver
+import ratelimit
+import requestparser
+import wwwindex
+from accesslog import AccessLogWriter, LogRotator
+from anomaly import AnomalyDetector
+from filecache import CompressedCache, FileCache
+from metrics import MetricsRegistry
+from mimetable import MimeTable
+from pathresolver import PathResolver
+from ratelimit import RateLimiter
+from requestparser import HttpParseError, RequestParser
+from responsewriter import ResponseWriter
+from wwwindex import WwwIndex
+
+HOST = "0.0.0.0"
+PORT = 8000
+BUFSIZE = 4096
+LINE_ENDING='\r\n'
+SERVE_PATH = Path('www').resolve()
+REQUEST_LOG_FILE = Path("logs/access.jsonl")
+REQUEST_LOG_FILE.parent.mkdir(exist_ok=True)
+HTTP_1_1 = 'HTTP/1.1'
+MODES = ("serial", "threaded", "prefork", "asyncio")
+DEFAULT_THREADS = 16
+DEFAULT_WORKERS = os.cpu_count() or 1
+LISTEN_BACKLOG = 128
+ACCEPT_RETRY_DELAY = 0.1        # seconds to wait after accept() fails (e.g. EMFILE) before trying again
+KEEP_ALIVE_TIMEOUT = 5          # seconds a persistent connection may sit idle between requests
+FIRST_BYTE_TIMEOUT = 5          # seconds a new connection gets to start sending its first request
+HEADER_TIMEOUT = 10             # seconds from a request's first byte until its whole head must be in
+SEND_TIMEOUT = 30               # seconds a client may go without taking any of a response before it's dropped
+MAX_KEEP_ALIVE_REQUESTS = 100   # requests served on one connection before it is closed
+SENDFILE_CHUNK = 1024 * 1024    # most bytes handed to one os.sendfile() call
+READ_CHUNK = 64 * 1024          # buffer size when streaming a file without sendfile
+MAX_DISCARDED_BODY = 1024 * 1024    # biggest request body read and thrown away; 413 beyond this
+HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+MAX_RANGES = 16                 # more ranges than this in one request and we just send the whole file
+# which read deadline a client missed
+FIRST_BYTE = "first_byte"
+HEADERS = "headers"
+IDLE = "idle"
+BODY = "body"
+SEND = "send"
+
+class LabHttpTcpServer(socketserver.TCPServer):
+    allow_reuse_address = True
+    request_queue_size = LISTEN_BACKLOG
+
+class ThreadPoolLabHttpTcpServer(LabHttpTcpServer):
+    """Hands accepted connections to a fixed number of worker threads.
+
+    The hand-off queue is bounded, so when every worker is busy the accept
+    loop blocks and new clients wait in the kernel's listen backlog instead
+    of piling up as threads inside the process.
+    """
+    def __init__(self, server_address, handler_class, threads=DEFAULT_THREADS, bind_and_activate=True):
+        self.threads = max(1, threads)
+        self.pending = queue.Queue(maxsize=self.threads * 2)
+        self.workers = []
+        super().__init__(server_address, handler_class, bind_and_activate)
+        for i in range(self.threads):
+            worker = threading.Thread(target=self.worker_loop, name=f"http-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def worker_loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:    # sentinel from server_close()
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        # runs on the accept loop; a worker thread does the actual handling
+        self.pending.put((request, client_address))
+
+    def server_close(self):
+        super().server_close()
+        for _ in self.workers:
+            self.pending.put(None)
+        for worker in self.workers:
+            worker.join()
+
+class PreforkLabHttpTcpServer(LabHttpTcpServer):
+    # every worker process binds its own listening socket and the kernel
+    # spreads incoming connections between them
+    allow_reuse_port = True
+
+class PreforkThreadPoolLabHttpTcpServer(ThreadPoolLabHttpTcpServer):
+    allow_reuse_port = True
+
+class AsyncioLabHttpServer:
+    """Accepts connections on an asyncio event loop.
+
+    The first request head is read on the loop with non-blocking reads, so
+    idle or slow clients don't hold a worker. Once it has arrived, the
+    blocking handler runs on a bounded thread pool (picking up the parser
+    with the bytes read so far), so the handler code is the same as in the
+    other modes. The per-IP connection cap is checked (and counted) here,
+    on accept, since a connection that never sends anything otherwise
+    never reaches a handler. The first-byte and header deadlines are
+    enforced here too; a client that misses one is still handed to a
+    handler, which answers it with the 408.
+    """
+    def __init__(self, server_address, handler_class, threads=DEFAULT_THREADS):
+        self.server_address = server_address
+        self.RequestHandlerClass = handler_class
+        self.threads = max(1, threads)
+        self.socket = socket.create_server(server_address, backlog=LISTEN_BACKLOG)
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()
+        self.loop = None
+        self.stopping = None
+        self.parsers = {}   # connection -> parser holding its first request, until a handler takes it
+        self.refused = set()    # connections over their client's cap, for the handler to answer with a 503
+        self.timed_out = set()  # connections whose first request head was too slow, for a 408
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.server_close()
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        slots = asyncio.Semaphore(self.threads)
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="http-worker") as pool:
+            accept_task = asyncio.ensure_future(self.accept_loop(pool, slots))
+            await self.stopping.wait()
+            accept_task.cancel()
+
+    async def accept_loop(self, pool, slots):
+        while True:
+            try:
+                conn, client_address = await self.loop.sock_accept(self.socket)
+            except OSError as e:
+                # out of file descriptors, or the client gave up before we got to it:
+                # wait a moment and carry on, like socketserver does
+                print("accept failed:", e, file=sys.stderr)
+                await asyncio.sleep(ACCEPT_RETRY_DELAY)
+                continue
+            asyncio.ensure_future(self.dispatch(pool, slots, conn, client_address))
+
+    async def dispatch(self, pool, slots, conn, client_address):
+        limiter = self.RequestHandlerClass.rate_limiter
+        counted = False
+        try:
+            if limiter is not None and not limiter.open_connection(client_address[0]):
+                self.refused.add(conn)  # straight to the handler, without reading anything
+            else:
+                counted = limiter is not None
+                parser = self.RequestHandlerClass.make_parser()
+                if not await self.read_head(conn, parser):
+                    return
+                self.parsers[conn] = parser
+            async with slots:
+                conn.setblocking(True)
+                await self.loop.run_in_executor(pool, self.finish_request, conn, client_address)
+        except Exception:
+            self.handle_error(conn, client_address)
+        finally:
+            if counted:
+                limiter.close_connection(client_address[0])
+            self.parsers.pop(conn, None)
+            self.refused.discard(conn)
+            self.timed_out.discard(conn)
+            self.shutdown_request(conn)
+
+    async def read_head(self, conn, parser):
+        # Feed the parser until a whole request head (or a parse error to report) is buffered,
+        # or the client misses its deadline (the handler sends the 408).
+        # Returns False if the client went away.
+        buffer = bytearray(BUFSIZE)
+        deadline = self.loop.time() + self.RequestHandlerClass.first_byte_timeout
+        started = False
+        while True:
+            try:
+                if parser.parse():
+                    return True
+            except HttpParseError:
+                return True     # the handler sends the error response
+            try:
+                remaining = deadline - self.loop.time()
+                if remaining <= 0:
+                    raise TimeoutError
+                n = await asyncio.wait_for(self.loop.sock_recv_into(conn, buffer), remaining)
+            except TimeoutError:
+                self.timed_out.add(conn)
+                return True
+            except ConnectionError:
+                return False
+            if not n:
+                return False
+            if not started:     # from the first byte on, the whole head has to arrive in time
+                started = True
+                deadline = self.loop.time() + self.RequestHandlerClass.header_timeout
+            parser.feed(memoryview(buffer)[:n])
+
+    def take_parser(self, conn):
+        return self.parsers.pop(conn, None)
+
+    def admits(self, conn):
+        return conn not in self.refused
+
+    def head_timed_out(self, conn):
+        return conn in self.timed_out
+
+    def finish_request(self, request, client_address):
+        self.RequestHandlerClass(request, client_address, self)
+
+    def handle_error(self, request, client_address):
+        print('-'*40, file=sys.stderr)
+        print('Exception occurred during processing of request from', client_address, file=sys.stderr)
+        traceback.print_exc()
+        print('-'*40, file=sys.stderr)
+
+    def shutdown_request(self, request):
+        try:
+            request.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        request.close()
+
+    def shutdown(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    def server_close(self):
+        self.socket.close()
+
+class LabHttpTCPHandler(socketserver.StreamRequestHandler):
+    keep_alive = True           # False answers every request with Connection: close
+    keep_alive_timeout = KEEP_ALIVE_TIMEOUT
+    first_byte_timeout = FIRST_BYTE_TIMEOUT
+    header_timeout = HEADER_TIMEOUT
+    send_timeout = SEND_TIMEOUT
+    max_keep_alive_requests = MAX_KEEP_ALIVE_REQUESTS
+    max_request_line = requestparser.DEFAULT_MAX_LINE
+    max_header_bytes = requestparser.DEFAULT_MAX_HEADER_BYTES
+    max_headers = requestparser.DEFAULT_MAX_HEADERS
+    file_cache = FileCache()    # shared by every connection in this process
+    compressed_cache = CompressedCache()
+    resolver = PathResolver(SERVE_PATH)
+    mime_types = MimeTable()
+    www_index = None            # a WwwIndex, or None to look every cache miss up on disk
+    access_log = AccessLogWriter(REQUEST_LOG_FILE)
+    metrics = MetricsRegistry()
+    metrics_path = None         # where the metrics are served, None to turn the endpoint off
+    metrics_allow = ("127.0.0.1", "::1")    # client addresses allowed to read them ("*" for anyone)
+    rate_limiter = None         # a RateLimiter, or None to let every client do as much as it likes
+    anomaly_detector = None     # an AnomalyDetector that sees every logged request, or None
+
+    def __init__(self, *args, **kwargs):
+        self.charset = "UTF-8"
+        self.serve_path = SERVE_PATH
+        self.close_connection = True
+        self.requests_served = 0
+        self.counted_connection = False
+        super().__init__(*args, **kwargs)
+
+    def receive_line(self):
+        return self.rfile.readline().strip().decode(self.charset, 'ignore')
+    
+    def send_line(self, line):
+        self.writer.write((line + LINE_ENDING).encode(self.charset, 'ignore'))
+
+    @classmethod
+    def make_parser(cls):
+        return RequestParser(max_line=cls.max_request_line, max_header_bytes=cls.max_header_bytes,
+                             max_headers=cls.max_headers)
+
+    def setup(self):
+        super().setup()
+        # the asyncio backend may already have read the first request into a parser
+        take_parser = getattr(self.server, "take_parser", None)
+        self.parser = (take_parser and take_parser(self.connection)) or self.make_parser()
+        self.recv_buffer = memoryview(bytearray(BUFSIZE))
+        self.writer = ResponseWriter(self.connection)     # responses are queued here and sent in one go
+        self.set_send_timeout()
+        self.metrics.connection_opened()
+
+    def set_send_timeout(self):
+        # Writes wait at most send_timeout for the client to make room, so one that asks
+        # for a big file and never reads it can't keep a handler (or in serial mode, the
+        # whole server) forever. Reads set their own deadlines and put this back after.
+        self.connection.settimeout(self.send_timeout or None)
+
+    def finish(self):
+        try:
+            self.writer.flush()
+        except TimeoutError:
+            self.send_timed_out()
+        except OSError:
+            pass    # the client is gone, nothing more to do
+        try:
+            super().finish()
+        finally:
+            self.metrics.connection_closed()
+
+    def handle(self):
+        # Serve requests off the same connection until the client (or a limit) closes it.
+        # Pipelined requests just sit in the parser's buffer, so they get answered in order.
+        if not self.admit():
+            # refused before reading anything, so it costs next to nothing
+            self.send_error(503, "Service Unavailable",
+                            headers={"Retry-After": ratelimit.CONNECTION_RETRY_AFTER})
+            return
+        self.close_connection = False
+        try:
+            while not self.close_connection:
+                self.handle_one_request()
+        except ConnectionError:
+            pass    # the client went away in the middle of a response
+        except TimeoutError:
+            self.send_timed_out()
+        finally:
+            if self.counted_connection:
+                self.rate_limiter.close_connection(self.client_address[0])
+
+    def admit(self):
+        # Is the client under its connection cap? The asyncio backend has already
+        # checked (and counts the connection itself), so just ask it.
+        admits = getattr(self.server, "admits", None)
+        if admits is not None:
+            return admits(self.connection)
+        if self.rate_limiter is None:
+            return True
+        self.counted_connection = self.rate_limiter.open_connection(self.client_address[0])
+        return self.counted_connection
+
+    def read_request(self):
+        # Returns the next request, or None if the client closed the connection or
+        # missed a read deadline. Raises HttpParseError for a bad request.
+        request = self.parser.next_request()    # maybe already buffered (pipelining)
+        if request is not None:
+            return request
+        # send the responses so far before waiting; pipelined ones go out together
+        self.writer.flush()
+        phase, deadline = self.read_deadline()
+        try:
+            while request is None:
+                # The timeout is whatever is left until the deadline, not a fresh one per
+                # recv(), so trickling in a byte at a time doesn't keep a handler forever.
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError
+                self.connection.settimeout(remaining)
+                n = self.connection.recv_into(self.recv_buffer)
+                if not n:
+                    return None
+                if phase != HEADERS:    # the request has started: now the whole head has to arrive in time
+                    phase, deadline = HEADERS, time.monotonic() + self.header_timeout
+                self.parser.feed(self.recv_buffer[:n])
+                request = self.parser.next_request()
+        except TimeoutError:
+            self.request_timed_out(phase)
+            return None
+        except ConnectionError:
+            return None
+        finally:
+            self.set_send_timeout()
+        return request
+
+    def read_deadline(self):
+        # (phase, deadline) for the next request head
+        now = time.monotonic()
+        if self.requests_served == 0:
+            head_timed_out = getattr(self.server, "head_timed_out", None)
+            if head_timed_out is not None and head_timed_out(self.connection):
+                # the asyncio backend already waited it out
+                return (HEADERS if self.parser.buffer else FIRST_BYTE), now
+        if self.parser.buffer:  # part of it is already here
+            return HEADERS, now + self.header_timeout
+        if self.requests_served == 0:
+            return FIRST_BYTE, now + self.first_byte_timeout
+        return IDLE, now + self.keep_alive_timeout
+
+    def discard_body(self, length):
+        # Nothing here uses request bodies, but one left in the parser would be taken for
+        # the next request (request smuggling), so it's read and thrown away. Returns False,
+        # with the connection marked to close, if that couldn't be done.
+        if length > MAX_DISCARDED_BODY:
+            self.close_connection = True
+            self.send_error(413, "Content Too Large")
+            return False
+        length -= self.parser.discard(length)
+        deadline = time.monotonic() + self.header_timeout   # as long as a head gets
+        try:
+            while length:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError
+                self.connection.settimeout(remaining)
+                n = self.connection.recv_into(self.recv_buffer, min(length, len(self.recv_buffer)))
+                if not n:
+                    self.close_connection = True
+                    return False
+                length -= n
+        except TimeoutError:
+            self.request_timed_out(BODY)
+            return False
+        except ConnectionError:
+            self.close_connection = True
+            return False
+        finally:
+            self.set_send_timeout()
+        return True
+
+    def request_timed_out(self, phase):
+        # Every timeout gets an access log entry with its phase. Only a client that
+        # was in the middle of a request is sent a 408.
+        self.metrics.timed_out(phase)
+        self.close_connection = True
+        if phase in (IDLE, SEND):
+            # an idle keep-alive connection is just closed, and one that stopped reading wouldn't take it
+            self.log_request(self.client_address[0], getattr(self, "last_method", "-"),
+                             getattr(self, "last_path", "-"), 408, 0, timeout=phase)
+            return
+        self.send_error(408, "Request Timeout", timeout=phase)
+
+    def send_timed_out(self):
+        # the client stopped taking what we send; what's still queued would only wait again
+        self.writer.discard()
+        self.request_timed_out(SEND)
+
+    def handle_one_request(self):
+        self.last_method = "-"
+        self.last_path = "-"
+        try:
+            request = self.read_request()
+        except HttpParseError as e:
+            # we can't tell where the next request would start, so this is the last one
+            self.close_connection = True
+            self.send_error(e.status, e.reason)
+            return
+        if request is None:
+            self.close_connection = True
+            return
+        start_time = time.time()    # for tracking processing time
+        self.requests_served += 1
+
+        method, path, version, headers = request.method, request.path, request.version, request.headers
+        # save the method and path in case the error function needs to log the request
+        self.last_method = method
+        self.last_path = path
+        self.close_connection = not self.wants_keep_alive(version, headers)
+        if self.rate_limiter is not None:
+            retry_after = self.rate_limiter.allow_request(self.client_address[0])
+            if retry_after:
+                # don't give a client that's over its rate a connection to keep trying on
+                self.close_connection = True
+                self.send_error(429, "Too Many Requests", headers={"Retry-After": retry_after})
+                return
+        try:
+            body_length = requestparser.body_length(headers)
+        except HttpParseError as e:
+            self.close_connection = True
+            self.send_error(e.status, e.reason)
+            return
+        if body_length and not self.discard_body(body_length):
+            return
+        if method != "GET":
+            self.send_error(405, "Method Not Allowed")
+            return
+        if self.metrics_path is not None and path.split("?", 1)[0] == self.metrics_path \
+                and self.metrics_allowed(self.client_address[0]):
+            self.send_metrics(method, path, headers, start_time)
+            return
+        try:
+            decoded_path = self.percent_decode(path)
+        except ValueError:  # bad %xx escape, or not UTF-8 underneath
+            self.send_error(400, "Bad Request")
+            return
+
+        cached = self.file_cache.get(decoded_path)
+        if cached is None:
+            cached = self.load_file(decoded_path, path)
+            if cached is None:  # an error response was already sent
+                return
+        cached = self.choose_encoding(cached, headers)
+
+        if self.not_modified(cached, headers):
+            self.writer.write(b"HTTP/1.1 304 Not Modified\r\n")
+            self.writer.write(cached.representation_headers)
+            self.writer.write(self.connection_header())
+            self.writer.write(b"\r\n")
+            self.log_request(self.client_address[0], method, path, 304, 0, headers=headers,
+                             duration=time.time() - start_time, src_port=self.client_address[1])
+            return
+
+        ranges = None
+        range_header = self.get_header(headers, "Range")
+        if range_header is not None and self.if_range_matches(cached, headers):
+            ranges = self.parse_range(range_header, cached.size)
+        if ranges == []:
+            self.send_error(416, "Range Not Satisfiable", headers={"Content-Range": f"bytes */{cached.size}"})
+            return
+
+        with self.open_body(cached) as f:
+            if ranges is None:
+                self.writer.write(cached.header_block)
+                self.writer.write(self.connection_header())
+                self.writer.write(b"\r\n")
+                status = 200
+                sent = self.send_body(cached, f, 0, cached.size)
+                expected = cached.size
+            else:
+                status = 206
+                sent, expected = self.send_ranges(cached, f, ranges)
+        if sent != expected:
+            # the file changed under us, so the body doesn't match Content-Length
+            self.close_connection = True
+
+        duration = time.time() - start_time
+
+        # log successful request
+        self.log_request(
+            self.client_address[0], # ip
+            method,                 # GET, POST, etc.
+            path,                   # requested path
+            status,                 # status code (success)
+            sent,                   # response length
+            headers=headers,
+            duration=duration,
+            src_port=self.client_address[1]
+        )     
+
+    def metrics_allowed(self, client_ip):
+        if client_ip.startswith("::ffff:"):     # IPv4 client on a dual-stack socket
+            client_ip = client_ip[len("::ffff:"):]
+        return "*" in self.metrics_allow or client_ip in self.metrics_allow
+
+    def send_metrics(self, method, path, headers, start_time):
+        body = self.metrics.render()
+        self.writer.write((f"HTTP/1.1 200 OK\r\n"
+                          f"Content-Type: {metrics.CONTENT_TYPE}\r\n"
+                          f"Content-Length: {len(body)}\r\n"
+                          f"Cache-Control: no-store\r\n").encode())
+        self.writer.write(self.connection_header())
+        self.writer.write(b"\r\n")
+        self.writer.write(body)
+        self.log_request(self.client_address[0], method, path, 200, len(body), headers=headers,
+                         duration=time.time() - start_time, src_port=self.client_address[1])
+
+    def open_body(self, cached):
+        # big files are streamed from disk; cached ones are already in memory
+        if cached.content is None:
+            return open(cached.path, "rb")
+        return contextlib.nullcontext()
+
+    def send_body(self, cached, f, offset, count):
+        if cached.content is not None:
+            self.writer.write(memoryview(cached.content)[offset:offset + count])
+            return count
+        return self.send_file(f, offset, count)
+
+    def choose_encoding(self, cached, headers):
+        # Content negotiation on Accept-Encoding: use a .br/.gz sibling if there is one,
+        # otherwise a cached compressed copy. Falls back to the file as it is.
+        if not filecache.is_compressible(cached.content_type):
+            return cached
+        accept_encoding = self.get_header(headers, "Accept-Encoding")
+        if not accept_encoding:
+            return cached
+        qualities = {}
+        for item in accept_encoding.split(","):
+            coding, _, params = item.partition(";")
+            q = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    q = float(params[2:])
+                except ValueError:
+                    q = 0.0
+            qualities[coding.strip().lower()] = q
+        offered = sorted(("br", "gzip"), key=lambda coding: -qualities.get(coding, qualities.get("*", 0)))
+        for coding in offered:   # best first, ties keep br ahead of gzip
+            if qualities.get(coding, qualities.get("*", 0)) <= 0:
+                continue
+            variant = self.compressed_cache.get(cached, coding)
+            if variant is not None:
+                return variant
+        return cached
+
+    def if_range_matches(self, cached, headers):
+        # If-Range: only honour Range if the client's copy is still current (strong comparison)
+        if_range = self.get_header(headers, "If-Range")
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            return if_range == cached.etag
+        try:
+            return parsedate_to_datetime(if_range).timestamp() == cached.last_modified
+        except (TypeError, ValueError):
+            return False
+
+    def parse_range(self, value, size):
+        # Parse "bytes=0-99,200-,-50" into a list of (first, last) byte positions.
+        # Returns None when the header should be ignored (bad syntax, too many ranges)
+        # and [] when none of the ranges overlap the file (416).
+        unit, _, specs = value.partition("=")
+        if unit.strip().lower() != "bytes" or not specs:
+            return None
+        ranges = []
+        specs = specs.split(",")
+        if len(specs) > MAX_RANGES:
+            return None
+        for spec in specs:
+            first, dash, last = spec.strip().partition("-")
+            if not dash or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+                return None
+            if first == "":
+                if last == "":
+                    return None
+                # suffix range: the last N bytes
+                length = int(last)
+                if length == 0 or size == 0:    # nothing to take the last bytes of
+                    continue
+                ranges.append((max(0, size - length), size - 1))
+                continue
+            first = int(first)
+            if last != "" and int(last) < first:
+                return None     # "500-100" is invalid, not just unsatisfiable
+            if first >= size:
+                continue
+            last = size - 1 if last == "" else min(int(last), size - 1)
+            ranges.append((first, last))
+        return ranges
+
+    def send_ranges(self, cached, f, ranges):
+        # 206 for one range, multipart/byteranges for several. Returns (sent, expected) body bytes.
+        if len(ranges) == 1:
+            first, last = ranges[0]
+            count = last - first + 1
+            self.writer.write((f"HTTP/1.1 206 Partial Content\r\n"
+                              f"Content-Length: {count}\r\n"
+                              f"Content-Range: bytes {first}-{last}/{cached.size}\r\n").encode())
+            self.writer.write(cached.content_type_line)
+            self.writer.write(cached.representation_headers)
+            self.writer.write(b"Accept-Ranges: bytes\r\n")
+            self.writer.write(self.connection_header())
+            self.writer.write(b"\r\n")
+            return self.send_body(cached, f, first, count), count
+
+        boundary = os.urandom(12).hex()
+        part_headers = [f"--{boundary}\r\n".encode() + cached.content_type_line +
+                        f"Content-Range: bytes {first}-{last}/{cached.size}\r\n\r\n".encode()
+                        for first, last in ranges]
+        closing = f"\r\n--{boundary}--\r\n".encode()
+        # each part after the first starts on a new line
+        length = (sum(len(h) for h in part_headers) + 2 * (len(ranges) - 1) + len(closing)
+                  + sum(last - first + 1 for first, last in ranges))
+        self.writer.write((f"HTTP/1.1 206 Partial Content\r\n"
+                          f"Content-Length: {length}\r\n"
+                          f"Content-Type: multipart/byteranges; boundary={boundary}\r\n").encode())
+        self.writer.write(cached.representation_headers)
+        self.writer.write(b"Accept-Ranges: bytes\r\n")
+        self.writer.write(self.connection_header())
+        self.writer.write(b"\r\n")
+        sent = expected = 0
+        for i, (first, last) in enumerate(ranges):
+            if i:
+                self.writer.write(b"\r\n")
+            self.writer.write(part_headers[i])
+            sent += self.send_body(cached, f, first, last - first + 1)
+            expected += last - first + 1
+        self.writer.write(closing)
+        return sent, expected
+
+    def load_file(self, decoded_path, path):
+        # Find a file that isn't in the cache, and read and cache it if it's small.
+        # Returns None if it sent an error response instead.
+        found = self.www_index.lookup(decoded_path) if self.www_index is not None else None
+        if found is None:
+            found = self.resolve_on_disk(decoded_path)
+        kind, described = found
+        if kind == pathresolver.FORBIDDEN:
+            self.send_error(403, "Forbidden")
+            return None
+        if kind == pathresolver.REDIRECT:
+            # redirect to directory path
+            self.send_error(301, "Moved Permanently", headers={"Location": path + "/"})
+            return None
+        if kind == pathresolver.MISSING:
+            self.send_error(404, "Not Found")
+            return None
+
+        if described.size > self.file_cache.max_file_bytes:
+            # too big to cache, so it gets streamed instead of read into memory
+            return described
+        try:
+            with open(described.path, "rb") as f:
+                stat_result = os.fstat(f.fileno())     # before reading, so a write during the read invalidates the entry
+                content = f.read()
+        except OSError:     # deleted since it was found
+            self.resolver.invalidate(decoded_path)
+            self.send_error(404, "Not Found")
+            return None
+        entry = filecache.CachedFile(described.path, content, stat_result, described.content_type,
+                                     vary=filecache.is_compressible(described.content_type))
+        self.file_cache.put(decoded_path, entry)
+        return entry
+
+    def resolve_on_disk(self, decoded_path):
+        # (kind, CachedFile without contents) for a path the www/ index can't answer
+        resolution = self.resolver.resolve(decoded_path)    # symlinks, "..", and staying inside ./www
+        if resolution.kind != pathresolver.FILE:
+            return resolution.kind, None
+        try:
+            stat_result = os.stat(resolution.path)
+        except OSError:     # deleted since it was resolved
+            self.resolver.invalidate(decoded_path)
+            return pathresolver.MISSING, None
+        return pathresolver.FILE, filecache.describe_file(resolution.path, stat_result,
+                                                           self.mime_types.content_type(resolution.path))
+
+    def send_file(self, f, offset, count):
+        # Send count bytes of f starting at offset. Uses os.sendfile so the data goes
+        # from the page cache to the socket without passing through Python; if that
+        # isn't possible, falls back to a read loop with one fixed-size buffer.
+        # Either way memory use doesn't depend on the file size. Returns bytes sent.
+        sent = 0
+        if hasattr(os, "sendfile"):
+            # hold the queued headers back until the first full segment of the file joins them
+            self.writer.cork()
+            try:
+                self.writer.flush()
+                while sent < count:
+                    try:
+                        n = os.sendfile(self.connection.fileno(), f.fileno(), offset + sent,
+                                        min(SENDFILE_CHUNK, count - sent))
+                    except BlockingIOError:     # the send timeout makes the socket non-blocking underneath
+                        self.writer.wait_writable()
+                        continue
+                    if n == 0:  # end of file
+                        return sent
+                    sent += n
+                return sent
+            except OSError as e:
+                if sent or e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP):
+                    raise
+            finally:
+                self.writer.uncork()
+
+        buffer = memoryview(bytearray(READ_CHUNK))
+        f.seek(offset)
+        while sent < count:
+            n = f.readinto(buffer[:min(READ_CHUNK, count - sent)])
+            if not n:
+                break
+            self.writer.write(buffer[:n])
+            self.writer.flush()     # the buffer gets reused for the next piece
+            sent += n
+        return sent
+
+    def get_header(self, headers, name, default=None):
+        # header names are case-insensitive, but the parser keeps them as sent (for the logs)
+        name = name.lower()
+        for key, value in headers.items():
+            if key.lower() == name:
+                return value
+        return default
+
+    def not_modified(self, cached, headers):
+        # Conditional GET (RFC 9110 section 13). If-None-Match wins over If-Modified-Since.
+        if_none_match = self.get_header(headers, "If-None-Match")
+        if if_none_match is not None:
+            if if_none_match.strip() == "*":
+                return True
+            # If-None-Match uses the weak comparison, so ignore any W/ prefix
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return cached.etag in tags
+        if_modified_since = self.get_header(headers, "If-Modified-Since")
+        if if_modified_since is not None and cached.last_modified is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False    # an invalid date is ignored
+            return cached.last_modified <= since
+        return False
+
+    def wants_keep_alive(self, version, headers):
+        if not self.keep_alive or self.requests_served >= self.max_keep_alive_requests:
+            return False
+        connection = self.get_header(headers, "Connection", "").lower()
+        if "close" in connection:
+            return False
+        if version.strip() == HTTP_1_1:
+            return True     # HTTP/1.1 connections are persistent by default
+        return "keep-alive" in connection
+
+    def connection_header(self):
+        if self.close_connection:
+            return b"Connection: close\r\n"
+        return (f"Connection: keep-alive\r\n"
+                f"Keep-Alive: timeout={self.keep_alive_timeout:g}, max={self.max_keep_alive_requests - self.requests_served}\r\n").encode()
+
+    def percent_decode(self, string):
+        result = []
+        i = 0
+        while i < len(string):
+            char = string[i]
+            if char == "%": # if we're currently on an encoded character
+                hex_val = string[i+1:i+3]   # set the hexadecimal value to be the 2 characters after %
+                if len(hex_val) != 2 or not HEX_DIGITS.issuperset(hex_val):
+                    # int() would also take "+f" or " f", and a lone % isn't valid either
+                    raise ValueError(f"bad percent-encoding: {string[i:i + 3]!r}")
+                byte = int(hex_val, 16)     # convert to decimal
+                result.append(byte)
+                i += 3
+            else:
+                result.append(ord(char))
+                i += 1
+
+        return bytes(result).decode("utf-8")    # turn result into bytes like xc3 and then decode to normal chars
+
+    def send_error(self, code, message, headers=None, timeout=None):
+        head = f"HTTP/1.1 {code} {message}\r\n"
+        if headers:
+            for key, value in headers.items():
+                head += f"{key}: {value}\r\n"
+        head += "Content-Length: 0\r\n"
+        self.writer.write(head.encode())
+        self.writer.write(self.connection_header())
+        self.writer.write(b"\r\n")
+
+        # log error
+        self.log_request(
+            self.client_address[0],
+            getattr(self, "last_method", "-"),  # fallback if method not parsed
+            getattr(self, "last_path", "-"),
+            code,
+            0,
+            timeout=timeout
+        )
+
+        return
+
+    def log_request(self, client_ip, method, path, status, length, headers=None, duration=None, src_port=None,
+                    timeout=None):
+        entry = {
+            "ts": datetime.utcnow().isoformat() + "Z",
+            "ip": client_ip,
+            "src_port": src_port,
+            "method": method,
+            "path": path,
+            "status": status,
+            "length": length,
+            "duration_ms": round(duration * 1000, 2) if duration else None,
+            "headers": headers or {}
+        }
+        if timeout is not None:
+            entry["timeout"] = timeout  # the phase that timed out
+        self.access_log.write(entry)   # written out in batches by a background thread
+        self.metrics.record(method, path, status, length, duration)
+        if self.anomaly_detector is not None:
+            self.anomaly_detector.observe(entry)
+
+def make_server(mode, address, threads=DEFAULT_THREADS):
+    if mode == "threaded":
+        return ThreadPoolLabHttpTcpServer(address, LabHttpTCPHandler, threads=threads)
+    if mode == "asyncio":
+        return AsyncioLabHttpServer(address, LabHttpTCPHandler, threads=threads)
+    if mode == "prefork":
+        # only ever called inside a forked worker
+        if threads > 1:
+            return PreforkThreadPoolLabHttpTcpServer(address, LabHttpTCPHandler, threads=threads)
+        return PreforkLabHttpTcpServer(address, LabHttpTCPHandler)
+    return LabHttpTcpServer(address, LabHttpTCPHandler)
+
+def serve(server):
+    # From https://docs.python.org/3/library/socketserver.html, The Python Software Foundation, downloaded 2024-01-07
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+def watch_parent(server, parent_pid):
+    # stop a prefork worker if the parent process goes away (e.g. it was killed)
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+    server.shutdown()
+
+def serve_prefork(address, workers, threads):
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise SystemExit("prefork mode needs SO_REUSEPORT, which this platform doesn't have")
+    parent_pid = os.getpid()
+    children = []
+    for _ in range(max(1, workers)):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            server = make_server("prefork", address, threads)
+            threading.Thread(target=watch_parent, args=(server, parent_pid), daemon=True).start()
+            serve(server)
+            LabHttpTCPHandler.access_log.close()
+            if LabHttpTCPHandler.anomaly_detector is not None:
+                LabHttpTCPHandler.anomaly_detector.sink.close()
+            os._exit(0)
+        children.append(pid)
+
+    def stop_children(signum=None, frame=None):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: (stop_children(), sys.exit(0)))
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        stop_children()
+        for pid in children:
+            os.waitpid(pid, 0)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="A basic Python 3 HTTP/1.1 server.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--mode", choices=MODES, default="serial",
+                        help="how connections are served (default: serial, one at a time)")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS,
+                        help="worker threads for threaded/asyncio mode, and per process in prefork mode")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="worker processes for prefork mode (default: one per core)")
+    parser.add_argument("--max-request-line", type=int, default=requestparser.DEFAULT_MAX_LINE,
+                        help="longest request line accepted (414 beyond it)")
+    parser.add_argument("--max-header-bytes", type=int, default=requestparser.DEFAULT_MAX_HEADER_BYTES,
+                        help="total size of request headers accepted (431 beyond it)")
+    parser.add_argument("--max-headers", type=int, default=requestparser.DEFAULT_MAX_HEADERS,
+                        help="number of request headers accepted (431 beyond it)")
+    parser.add_argument("--cache-max-bytes", type=int, default=filecache.DEFAULT_MAX_BYTES,
+                        help="total bytes of file contents kept in the in-memory cache")
+    parser.add_argument("--cache-max-entries", type=int, default=filecache.DEFAULT_MAX_ENTRIES,
+                        help="number of files kept in the in-memory cache (0 disables it)")
+    parser.add_argument("--cache-max-file-bytes", type=int, default=filecache.DEFAULT_MAX_FILE_BYTES,
+                        help="files bigger than this are never cached")
+    parser.add_argument("--cache-revalidate", type=float, default=filecache.DEFAULT_REVALIDATE_INTERVAL,
+                        help="seconds between mtime/inode checks of a cached file or path resolution")
+    parser.add_argument("--mime-types", action="append", metavar="FILE",
+                        help="extra extension to Content-Type mappings, in mime.types format (can be repeated)")
+    parser.add_argument("--default-charset", default=mimetable.DEFAULT_CHARSET,
+                        help="charset added to text types' Content-Type (empty: none)")
+    parser.add_argument("--no-index", action="store_true",
+                        help="don't index www/ at startup; look up every cache miss on disk")
+    parser.add_argument("--index-poll", type=float, default=wwwindex.DEFAULT_POLL_INTERVAL,
+                        help="seconds between checks of www/ for new, changed or deleted files (0: never)")
+    parser.add_argument("--resolve-cache-entries", type=int, default=pathresolver.DEFAULT_MAX_ENTRIES,
+                        help="request paths whose resolution (file, redirect, 403, 404) is remembered")
+    parser.add_argument("--compress-min-bytes", type=int, default=filecache.DEFAULT_COMPRESS_MIN_BYTES,
+                        help="smallest file that gets compressed on the fly")
+    parser.add_argument("--compress-level", type=int, default=filecache.DEFAULT_COMPRESS_LEVEL,
+                        help="gzip/brotli level for on-the-fly compression")
+    parser.add_argument("--compress-cache-bytes", type=int, default=filecache.DEFAULT_COMPRESSED_MAX_BYTES,
+                        help="total bytes of compressed variants kept in memory")
+    parser.add_argument("--log-queue-size", type=int, default=accesslog.DEFAULT_QUEUE_SIZE,
+                        help="access log entries that can wait to be written")
+    parser.add_argument("--log-batch-size", type=int, default=accesslog.DEFAULT_BATCH_SIZE,
+                        help="access log entries written per batch")
+    parser.add_argument("--log-flush-interval", type=float, default=accesslog.DEFAULT_FLUSH_INTERVAL,
+                        help="seconds before a partial batch of access log entries is written")
+    parser.add_argument("--log-when-full", choices=accesslog.WHEN_FULL_POLICIES, default="block",
+                        help="what to do with an access log entry when the queue is full")
+    parser.add_argument("--log-sample-rate", type=int, default=accesslog.DEFAULT_SAMPLE_RATE,
+                        help="with --log-when-full sample, keep 1 in this many entries while backed up")
+    parser.add_argument("--log-rotate-bytes", type=int, default=0,
+                        help="rotate the access log when it would grow past this many bytes (0: never)")
+    parser.add_argument("--log-rotate-when", choices=accesslog.ROTATE_WHEN,
+                        help="also rotate the access log at the start of every UTC hour or day")
+    parser.add_argument("--log-compress", choices=accesslog.COMPRESSIONS, default="gzip",
+                        help="compression for rotated access log segments")
+    parser.add_argument("--log-keep", type=int, default=accesslog.DEFAULT_KEEP,
+                        help="rotated access log segments to keep (0: keep all)")
+    parser.add_argument("--columnar-log", metavar="DIR",
+                        help="also write access log entries as columnar files in this directory (see logcolumns.py)")
+    parser.add_argument("--columnar-format", choices=logcolumns.FORMATS, default="native",
+                        help="format for --columnar-log files (parquet needs pyarrow)")
+    parser.add_argument("--columnar-rows", type=int, default=logcolumns.DEFAULT_ROWS_PER_FILE,
+                        help="rows per --columnar-log file")
+    parser.add_argument("--keep-alive-timeout", type=float, default=KEEP_ALIVE_TIMEOUT,
+                        help="seconds an idle persistent connection is kept open (not in serial mode, which closes after each response)")
+    parser.add_argument("--send-timeout", type=float, default=SEND_TIMEOUT,
+                        help="seconds a client may take no response data before the connection is dropped (0: no limit)")
+    parser.add_argument("--first-byte-timeout", type=float, default=FIRST_BYTE_TIMEOUT,
+                        help="seconds a new connection gets to start sending its first request (408 after)")
+    parser.add_argument("--header-timeout", type=float, default=HEADER_TIMEOUT,
+                        help="seconds from a request's first byte until its whole head must be in (408 after)")
+    parser.add_argument("--max-keep-alive-requests", type=int, default=MAX_KEEP_ALIVE_REQUESTS,
+                        help="requests served on one connection before it is closed")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="requests per second allowed from one client IP (0: no limit); 429 beyond it")
+    parser.add_argument("--rate-burst", type=int, default=ratelimit.DEFAULT_BURST,
+                        help="requests one client IP can make at once before --rate-limit applies")
+    parser.add_argument("--max-conns-per-ip", type=int, default=0,
+                        help="open connections allowed from one client IP (0: no limit); 503 beyond it")
+    parser.add_argument("--rate-limit-clients", type=int, default=ratelimit.DEFAULT_MAX_CLIENTS,
+                        help="client IPs tracked for the limits before idle ones are forgotten")
+    parser.add_argument("--anomaly-log", metavar="FILE",
+                        help="watch requests for scanning, traversal and header attacks, writing alerts here as JSONL")
+    parser.add_argument("--anomaly-window", type=float, default=anomaly.DEFAULT_WINDOW,
+                        help="seconds the anomaly detector's rates and counts cover")
+    parser.add_argument("--anomaly-rate", type=int, default=anomaly.DEFAULT_RATE_THRESHOLD,
+                        help="requests per window from one IP before a rate alert")
+    parser.add_argument("--anomaly-distinct-paths", type=int, default=anomaly.DEFAULT_DISTINCT_PATHS,
+                        help="distinct paths per window from one IP before a scanning alert")
+    parser.add_argument("--anomaly-max-ips", type=int, default=anomaly.DEFAULT_MAX_IPS,
+                        help="client IPs the anomaly detector keeps counters for")
+    parser.add_argument("--metrics-path",
+                        help="serve Prometheus metrics at this path, e.g. /-/metrics (default: off)")
+    parser.add_argument("--metrics-allow", default=",".join(LabHttpTCPHandler.metrics_allow),
+                        help="comma-separated client IPs allowed to read the metrics, * for anyone (default %(default)s)")
+    parser.add_argument("--metrics-max-paths", type=int, default=metrics.DEFAULT_MAX_PATHS,
+                        help="distinct paths given their own latency histogram")
+    args = parser.parse_args(argv)
+    if args.metrics_path is not None and not args.metrics_path.startswith("/"):
+        parser.error("--metrics-path must start with /")
+    if args.log_compress == "zstd" and accesslog.zstandard is None:
+        parser.error("--log-compress zstd needs the zstandard package")
+    if args.columnar_format == "parquet" and logcolumns.pyarrow is None:
+        parser.error("--columnar-format parquet needs the pyarrow package")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    address = (args.host, args.port)
+    # one connection at a time: an idle keep-alive client would hold up everyone else
+    LabHttpTCPHandler.keep_alive = args.mode != "serial"
+    LabHttpTCPHandler.keep_alive_timeout = args.keep_alive_timeout
+    LabHttpTCPHandler.first_byte_timeout = args.first_byte_timeout
+    LabHttpTCPHandler.header_timeout = args.header_timeout
+    LabHttpTCPHandler.send_timeout = args.send_timeout
+    LabHttpTCPHandler.max_keep_alive_requests = args.max_keep_alive_requests
+    LabHttpTCPHandler.max_request_line = args.max_request_line
+    LabHttpTCPHandler.max_header_bytes = args.max_header_bytes
+    LabHttpTCPHandler.max_headers = args.max_headers
+    LabHttpTCPHandler.file_cache = FileCache(
+        max_bytes=args.cache_max_bytes,
+        max_entries=args.cache_max_entries,
+        max_file_bytes=args.cache_max_file_bytes,
+        revalidate_interval=args.cache_revalidate,
+    )
+    LabHttpTCPHandler.compressed_cache = CompressedCache(
+        max_bytes=args.compress_cache_bytes,
+        max_entries=args.cache_max_entries,
+        min_size=args.compress_min_bytes,
+        level=args.compress_level,
+        max_file_bytes=args.cache_max_file_bytes,
+    )
+    rotator = None
+    if args.log_rotate_bytes or args.log_rotate_when:
+        rotator = LogRotator(
+            REQUEST_LOG_FILE,
+            max_bytes=args.log_rotate_bytes,
+            when=args.log_rotate_when,
+            compression=args.log_compress,
+            keep=args.log_keep,
+        )
+    sink = None
+    if args.columnar_log:
+        sink = logcolumns.ColumnarSink(args.columnar_log, format=args.columnar_format,
+                                       rows_per_file=args.columnar_rows)
+    LabHttpTCPHandler.access_log = AccessLogWriter(
+        REQUEST_LOG_FILE,
+        queue_size=args.log_queue_size,
+        batch_size=args.log_batch_size,
+        flush_interval=args.log_flush_interval,
+        when_full=args.log_when_full,
+        sample_rate=args.log_sample_rate,
+        rotator=rotator,
+        sink=sink,
+    )
+    LabHttpTCPHandler.resolver = PathResolver(
+        SERVE_PATH,
+        max_entries=args.resolve_cache_entries,
+        revalidate_interval=args.cache_revalidate,
+    )
+    LabHttpTCPHandler.mime_types = MimeTable(default_charset=args.default_charset)
+    for path in args.mime_types or ():
+        try:
+            LabHttpTCPHandler.mime_types.load(path)
+        except (OSError, ValueError) as e:
+            sys.exit(f"--mime-types: {e}")
+    if not args.no_index:
+        LabHttpTCPHandler.www_index = WwwIndex(SERVE_PATH, LabHttpTCPHandler.mime_types.content_type,
+                                               poll_interval=args.index_poll)
+        LabHttpTCPHandler.www_index.build()
+    if args.rate_limit > 0 or args.max_conns_per_ip > 0:
+        LabHttpTCPHandler.rate_limiter = RateLimiter(
+            rate=max(0, args.rate_limit),
+            burst=args.rate_burst,
+            max_connections=max(0, args.max_conns_per_ip),
+            max_clients=args.rate_limit_clients,
+        )
+    if args.anomaly_log:
+        LabHttpTCPHandler.anomaly_detector = AnomalyDetector(
+            AccessLogWriter(Path(args.anomaly_log), when_full="drop"),
+            window=args.anomaly_window,
+            rate_threshold=args.anomaly_rate,
+            distinct_paths=args.anomaly_distinct_paths,
+            max_ips=args.anomaly_max_ips,
+        )
+    LabHttpTCPHandler.metrics = registry = MetricsRegistry(max_paths=args.metrics_max_paths)
+    LabHttpTCPHandler.metrics_path = args.metrics_path
+    LabHttpTCPHandler.metrics_allow = tuple(ip.strip() for ip in args.metrics_allow.split(","))
+    registry.add_collector("file_cache", LabHttpTCPHandler.file_cache.stats,
+                           counters=("hits", "misses", "evictions", "invalidations"))
+    registry.add_collector("compressed_cache", LabHttpTCPHandler.compressed_cache.stats,
+                           counters=("hits", "misses", "evictions", "compressed"))
+    registry.add_collector("path_resolver", LabHttpTCPHandler.resolver.stats,
+                           counters=("hits", "misses", "invalidations"))
+    if LabHttpTCPHandler.www_index is not None:
+        registry.add_collector("www_index", LabHttpTCPHandler.www_index.stats, counters=("polls", "changes"))
+    if LabHttpTCPHandler.rate_limiter is not None:
+        registry.add_collector("rate_limiter", LabHttpTCPHandler.rate_limiter.stats,
+                               counters=("limited_requests", "limited_connections", "evictions"))
+    if LabHttpTCPHandler.anomaly_detector is not None:
+        registry.add_collector("anomaly", LabHttpTCPHandler.anomaly_detector.stats,
+                               counters=("observed", "evictions", "alerts")
+                                        + tuple(f"alerts_{kind}" for kind in anomaly.ALERT_KINDS))
+    registry.add_collector("access_log", LabHttpTCPHandler.access_log.stats,
+                           counters=("written", "dropped", "sampled_out", "write_errors"))
+    print("server is starting")
+    print(f"running in {args.mode} mode on {args.host}:{args.port}")
+    if args.mode == "prefork":
+        serve_prefork(address, args.workers, args.threads)
+    else:
+        signal.signal(signal.SIGTERM, signal.default_int_handler)  # shut down cleanly on kill
+        serve(make_server(args.mode, address, args.threads))
+        LabHttpTCPHandler.access_log.close()
+        print("file cache:", json.dumps(LabHttpTCPHandler.file_cache.stats()))
+        print("compressed cache:", json.dumps(LabHttpTCPHandler.compressed_cache.stats()))
+        print("path resolver:", json.dumps(LabHttpTCPHandler.resolver.stats()))
+        if LabHttpTCPHandler.www_index is not None:
+            LabHttpTCPHandler.www_index.close()
+            print("www index:", json.dumps(LabHttpTCPHandler.www_index.stats()))
+        if LabHttpTCPHandler.rate_limiter is not None:
+            print("rate limiter:", json.dumps(LabHttpTCPHandler.rate_limiter.stats()))
+        print("timeouts:", json.dumps(registry.timeouts()))
+        print("access log:", json.dumps(LabHttpTCPHandler.access_log.stats()))
+        if sink is not None:
+            print("columnar log:", json.dumps(sink.stats()))
+        if LabHttpTCPHandler.anomaly_detector is not None:
+            LabHttpTCPHandler.anomaly_detector.sink.close()
+            print("anomaly detector:", json.dumps(LabHttpTCPHandler.anomaly_detector.stats()))
+
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
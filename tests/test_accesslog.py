@@ -0,0 +1,94 @@
+import gzip
+import json
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+import accesslog
+from accesslog import AccessLogWriter, LogRotator
+
+def read_entries(path):
+    opener = gzip.open if path.name.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        return [json.loads(line)["who"] for line in f]
+
+class RotationTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "access.jsonl"
+
+    def writer(self, **rotation):
+        # a writer as one prefork worker has it; batches are written straight from the test
+        rotator = LogRotator(self.path, **rotation)
+        self.addCleanup(rotator.close)
+        writer = AccessLogWriter(self.path, rotator=rotator)
+        self.addCleanup(lambda: writer.f is not None and writer.f.close())
+        return writer
+
+    def test_other_worker_follows_a_rotation(self):
+        a = self.writer(max_bytes=100, compression="none")
+        b = self.writer(max_bytes=100, compression="none")
+        a.write_batch([{"who": "a1", "pad": "x" * 40}])
+        b.write_batch([{"who": "b1"}])
+        a.write_batch([{"who": "a2", "pad": "x" * 40}])    # over max_bytes: a renames the file
+        b.write_batch([{"who": "b2"}])      # still small enough for b's old file, which is now a segment
+        [segment] = a.rotator.segments()
+        self.assertEqual(read_entries(segment), ["a1", "b1"])
+        self.assertEqual(read_entries(self.path), ["a2", "b2"])
+
+    def test_deleted_log_is_recreated(self):
+        a = self.writer(max_bytes=10000, compression="none")
+        a.write_batch([{"who": "a1"}])
+        self.path.unlink()
+        a.write_batch([{"who": "a2"}])
+        self.assertEqual(read_entries(self.path), ["a2"])
+
+    def test_segment_is_compressed_after_the_grace_period(self):
+        original, accesslog.COMPRESS_DELAY = accesslog.COMPRESS_DELAY, 0.2
+        self.addCleanup(setattr, accesslog, "COMPRESS_DELAY", original)
+        a = self.writer(max_bytes=60, compression="gzip")
+        b = self.writer(max_bytes=60, compression="gzip")
+        b.write_batch([{"who": "b0"}])
+        a.write_batch([{"who": "a1", "pad": "x" * 30}])    # rotates
+        # b still holds the renamed file: its next batch must not end up in a segment
+        # that's about to be compressed and deleted
+        b.write_batch([{"who": "b1"}])
+        a.rotator.close()   # waits for the compressor
+        b.rotator.close()
+        [segment] = a.rotator.segments()
+        self.assertTrue(segment.name.endswith(".gz"))
+        self.assertEqual(read_entries(segment), ["b0"])
+        self.assertEqual(read_entries(self.path), ["a1", "b1"])
+
+class CounterTest(unittest.TestCase):
+    def test_every_entry_is_accounted_for(self):
+        # handler threads racing to drop and sample must not lose counts
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)     # switch threads as often as possible
+        threads, per_thread = 8, 5000
+        for when_full in ("drop", "sample"):
+            writer = AccessLogWriter(Path(directory.name) / f"{when_full}.jsonl", queue_size=16,
+                                     when_full=when_full, sample_rate=3)
+
+            def hammer():
+                for i in range(per_thread):
+                    writer.write({"i": i})
+            workers = [threading.Thread(target=hammer) for _ in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            writer.close()
+            stats = writer.stats()
+            self.assertEqual(stats["written"] + stats["dropped"] + stats["sampled_out"], threads * per_thread,
+                             when_full)
+            with open(writer.path) as f:
+                self.assertEqual(sum(1 for _ in f), stats["written"])
+
+if __name__ == "__main__":
+    unittest.main()
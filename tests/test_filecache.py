@@ -0,0 +1,67 @@
+import gzip
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from filecache import CachedFile, CompressedCache
+
+TEXT = b"<p>" + b"compress me " * 200 + b"</p>"
+
+class CompressedCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "page.html"
+        self.path.write_bytes(TEXT)
+        self.sibling = Path(f"{self.path}.gz")
+        self.entry = CachedFile(str(self.path), TEXT, os.stat(self.path), "text/html", vary=True)
+        self.cache = CompressedCache(min_size=100)
+
+    def write_sibling(self, content):
+        self.sibling.write_bytes(content)
+        # never older than the file, however coarse the clock
+        stat_result = os.stat(self.path)
+        os.utime(self.sibling, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 10**9))
+
+    def test_sibling_is_used(self):
+        self.write_sibling(b"precompressed")
+        variant = self.cache.get(self.entry, "gzip")
+        self.assertEqual((variant.path, variant.content, variant.size), (str(self.sibling), b"precompressed", 13))
+        self.assertIs(self.cache.get(self.entry, "gzip"), variant)
+
+    def test_compressed_without_a_sibling(self):
+        variant = self.cache.get(self.entry, "gzip")
+        self.assertEqual(variant.path, str(self.path))
+        self.assertEqual(gzip.decompress(variant.content), TEXT)
+
+    def test_replaced_sibling_is_noticed(self):
+        self.write_sibling(b"first")
+        self.assertEqual(self.cache.get(self.entry, "gzip").content, b"first")
+        self.write_sibling(b"second version")
+        self.assertEqual(self.cache.get(self.entry, "gzip").content, b"second version")
+
+    def test_added_and_removed_sibling_is_noticed(self):
+        self.assertEqual(self.cache.get(self.entry, "gzip").path, str(self.path))
+        self.write_sibling(b"precompressed")
+        self.assertEqual(self.cache.get(self.entry, "gzip").path, str(self.sibling))
+        self.sibling.unlink()
+        variant = self.cache.get(self.entry, "gzip")
+        self.assertEqual(gzip.decompress(variant.content), TEXT)
+
+    def test_unreadable_sibling_falls_back(self):
+        # a directory stat()s fine but can't be read, like a sibling without read permission
+        self.sibling.mkdir()
+        stat_result = os.stat(self.path)
+        os.utime(self.sibling, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 10**9))
+        variant = self.cache.get(self.entry, "gzip")
+        self.assertEqual(variant.path, str(self.path))
+        self.assertEqual(gzip.decompress(variant.content), TEXT)
+
+    def test_unreadable_sibling_of_a_small_file_is_identity(self):
+        self.sibling.mkdir()
+        cache = CompressedCache(min_size=len(TEXT) + 1)     # not worth compressing ourselves
+        self.assertIsNone(cache.get(self.entry, "gzip"))
+
+if __name__ == "__main__":
+    unittest.main()
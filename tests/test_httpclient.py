@@ -0,0 +1,33 @@
+import os
+import resource
+import socket
+import unittest
+
+from httpclient import ConnectionPool, PooledConnection
+
+HIGH_FD = 1500      # past FD_SETSIZE, where select.select() gives up
+
+@unittest.skipIf(resource.getrlimit(resource.RLIMIT_NOFILE)[0] <= HIGH_FD, "descriptor limit too low")
+class ClosedByServerTest(unittest.TestCase):
+    def setUp(self):
+        a, self.peer = socket.socketpair()
+        os.dup2(a.fileno(), HIGH_FD)
+        a.close()
+        self.conn = PooledConnection(socket.socket(fileno=HIGH_FD), ("x", 80, socket.AF_INET))
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.conn.close()
+        self.peer.close()
+
+    def test_open_connection_is_reused(self):
+        self.pool.put(self.conn)
+        self.assertIs(self.pool.get(self.conn.key), self.conn)
+
+    def test_connection_closed_by_the_server_is_dropped(self):
+        self.peer.close()
+        self.pool.put(self.conn)
+        self.assertIsNone(self.pool.get(self.conn.key))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import json
+import os
+import tempfile
+import unittest
+
+import logstats
+
+def entry(ts, path="/", status=200, ip="10.0.0.1"):
+    record = {"ts": ts, "ip": ip, "src_port": 40000, "method": "GET", "path": path,
+              "status": status, "length": 10, "duration_ms": 1.5, "headers": {"Host": "x"}}
+    if ts is None:
+        del record["ts"]
+    return json.dumps(record)
+
+class ScanTest(unittest.TestCase):
+    def scan(self, lines, since=None, until=None):
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+            f.write("\n".join(lines) + "\n")
+        self.addCleanup(os.unlink, f.name)
+        return logstats.scan((f.name, 0, os.path.getsize(f.name)), since, until)
+
+    def test_missing_or_bad_ts_is_a_bad_line(self):
+        summary = self.scan([
+            entry("2026-10-17T02:00:00.250000Z"),
+            entry(None),
+            entry("yesterday"),
+            entry("2026-13-45T02:00:00.000000Z"),
+            entry(12345),
+            entry("2026-10-17T02:00:30Z", path="/b"),
+            "[1, 2]",
+            "{truncated",
+        ])
+        self.assertEqual(summary.lines, 8)
+        self.assertEqual(summary.bad_lines, 6)
+        self.assertEqual(summary.entries, 2)
+        self.assertEqual(summary.first_ts, "2026-10-17T02:00:00.250000Z")
+        self.assertEqual(summary.last_ts, "2026-10-17T02:00:30.000000Z")
+        report = logstats.report(summary, [], 5, 0.1)     # must not raise
+        self.assertEqual(report["bad_lines"], 6)
+        self.assertEqual(report["requests"], 2)
+
+    def test_bad_ts_with_time_window(self):
+        # the window check reads ts straight off the line, before the JSON is parsed
+        summary = self.scan([
+            entry("2026-10-17T01:00:00.000000Z"),
+            entry("2026-10-17T02:00:00.000000Z"),
+            entry("not a time at all"),
+            entry(None),
+        ], since="2026-10-17T01:30:00.000000Z")
+        self.assertEqual(summary.entries, 1)
+        self.assertEqual(summary.bad_lines, 2)
+        logstats.report(summary, [], 5, 0.1)
+
+    def test_fields_of_the_wrong_type_are_bad_lines(self):
+        good = json.loads(entry("2026-10-17T02:00:00.000000Z"))
+        lines = [json.dumps(good)]
+        for field, value in (("status", "200"), ("status", 200.0), ("status", True), ("status", [200]),
+                             ("length", "10"), ("length", 1.5), ("duration_ms", "1.5"),
+                             ("duration_ms", {"ms": 1}), ("method", 1), ("path", ["/"]), ("ip", 10),
+                             ("headers", ["Host"]), ("headers", "Host: x")):
+            lines.append(json.dumps(dict(good, **{field: value})))
+        lines.append(json.dumps(good).replace('"duration_ms": 1.5', '"duration_ms": NaN'))
+        # null is how the server writes a missing duration or port
+        lines.append(json.dumps(dict(good, duration_ms=None, length=None)))
+        summary = self.scan(lines)
+        self.assertEqual(summary.bad_lines, 14)
+        self.assertEqual(summary.entries, 2)
+        report = logstats.report(summary, [], 5, 0.1)
+        self.assertEqual(report["requests"], 2)
+
+class NormalizeTsTest(unittest.TestCase):
+    def test_normalize_ts(self):
+        self.assertEqual(logstats.normalize_ts("2026-10-17T02:00:00Z"), "2026-10-17T02:00:00.000000Z")
+        self.assertEqual(logstats.normalize_ts("2026-10-17T02:00:00.123456Z"), "2026-10-17T02:00:00.123456Z")
+        for bad in ("", "None", "2026-10-17T02:00:00.12345xZ", "2026-10-17T02:00:00.123456+",
+                    "2026-02-30T02:00:00.000000Z", "2026-10-17 02:00:00.123456Z"):
+            self.assertIsNone(logstats.normalize_ts(bad), bad)
+
+if __name__ == "__main__":
+    unittest.main()
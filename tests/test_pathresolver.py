@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import server
+from pathresolver import FILE, FORBIDDEN, MISSING, REDIRECT, PathResolver
+
+class PathResolverTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        top = Path(self.directory.name)
+        self.outside = top / "outside"
+        self.outside.mkdir()
+        (self.outside / "secret.txt").write_text("secret")
+        self.www = top / "www"
+        (self.www / "sub").mkdir(parents=True)
+        (self.www / "index.html").write_text("index")
+        (self.www / "sub" / "page.html").write_text("page")
+        # revalidated on every lookup, so changes show up straight away
+        self.resolver = PathResolver(self.www, revalidate_interval=0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def resolve(self, path):
+        resolution = self.resolver.resolve(path)
+        if resolution.kind == FILE:
+            return FILE, Path(resolution.path).relative_to(self.resolver.root).as_posix()
+        return resolution.kind
+
+    def test_files_and_directories(self):
+        self.assertEqual(self.resolve("/"), (FILE, "index.html"))
+        self.assertEqual(self.resolve("/sub/page.html"), (FILE, "sub/page.html"))
+        self.assertEqual(self.resolve("/sub"), REDIRECT)
+        self.assertEqual(self.resolve("/sub/"), MISSING)     # no index.html in it
+        self.assertEqual(self.resolve("/nope.html"), MISSING)
+        self.assertEqual(self.resolve("/a\0b"), MISSING)
+
+    def test_dot_dot(self):
+        self.assertEqual(self.resolve("/sub/../index.html"), (FILE, "index.html"))
+        for path in ("/..", "/../outside/secret.txt", "/sub/../../outside/secret.txt", "/../www/../outside/"):
+            self.assertEqual(self.resolve(path), FORBIDDEN, path)
+        # a sibling whose name starts with the root's isn't inside it
+        (self.www.parent / "www2").mkdir()
+        self.assertEqual(self.resolve("/../www2/"), FORBIDDEN)
+
+    def test_percent_encoded_dot_dot(self):
+        # the handler decodes before resolving, so encoded dots and slashes are no way out
+        decode = server.LabHttpTCPHandler.__new__(server.LabHttpTCPHandler).percent_decode
+        for path in ("/%2e%2e/outside/secret.txt", "/%2E%2E%2Foutside%2Fsecret.txt",
+                     "/sub/%2e%2e/%2e%2e/outside/secret.txt", "/..%2f..%2foutside/secret.txt"):
+            self.assertEqual(self.resolve(decode(path)), FORBIDDEN, path)
+
+    def test_symlinks_out_of_the_root(self):
+        (self.www / "file-link").symlink_to(self.outside / "secret.txt")
+        (self.www / "dir-link").symlink_to(self.outside)
+        self.assertEqual(self.resolve("/file-link"), FORBIDDEN)
+        self.assertEqual(self.resolve("/dir-link/secret.txt"), FORBIDDEN)
+        # a symlink that stays inside is fine
+        (self.www / "inside-link").symlink_to(self.www / "sub" / "page.html")
+        self.assertEqual(self.resolve("/inside-link"), (FILE, "sub/page.html"))
+
+    def test_file_swapped_for_a_symlink_out(self):
+        self.assertEqual(self.resolve("/sub/page.html"), (FILE, "sub/page.html"))
+        (self.www / "sub" / "page.html").unlink()
+        (self.www / "sub" / "page.html").symlink_to(self.outside / "secret.txt")
+        self.assertEqual(self.resolve("/sub/page.html"), FORBIDDEN)
+
+    def test_directory_swapped_for_a_symlink_out(self):
+        self.assertEqual(self.resolve("/sub/page.html"), (FILE, "sub/page.html"))
+        (self.outside / "page.html").write_text("outside")
+        (self.www / "sub").rename(self.www / "old")
+        (self.www / "sub").symlink_to(self.outside)
+        self.assertEqual(self.resolve("/sub/page.html"), FORBIDDEN)
+        self.assertGreaterEqual(self.resolver.stats()["invalidations"], 1)
+
+    def test_directory_swapped_for_another(self):
+        self.assertEqual(self.resolve("/sub/page.html"), (FILE, "sub/page.html"))
+        self.assertEqual(self.resolve("/sub/"), MISSING)
+        new = self.www.parent / "new"
+        new.mkdir()
+        (new / "index.html").write_text("new index")
+        os.rename(self.www / "sub", self.www.parent / "old")
+        os.rename(new, self.www / "sub")
+        self.assertEqual(self.resolve("/sub/page.html"), MISSING)
+        self.assertEqual(self.resolve("/sub/"), (FILE, "sub/index.html"))
+
+    def test_file_swapped_for_a_directory(self):
+        (self.www / "thing").write_text("file")
+        self.assertEqual(self.resolve("/thing"), (FILE, "thing"))
+        (self.www / "thing").unlink()
+        (self.www / "thing").mkdir()
+        self.assertEqual(self.resolve("/thing"), REDIRECT)
+
+    def test_deleted_and_created(self):
+        self.assertEqual(self.resolve("/later.html"), MISSING)
+        (self.www / "later.html").write_text("later")
+        self.assertEqual(self.resolve("/later.html"), (FILE, "later.html"))
+        (self.www / "later.html").unlink()
+        self.assertEqual(self.resolve("/later.html"), MISSING)
+
+    def test_answers_are_remembered_between_checks(self):
+        resolver = PathResolver(self.www, revalidate_interval=3600)
+        self.assertEqual(resolver.resolve("/sub/page.html").kind, FILE)
+        self.assertEqual(resolver.resolve("/sub/page.html").kind, FILE)
+        self.assertEqual((resolver.stats()["misses"], resolver.stats()["hits"]), (1, 1))
+        resolver.invalidate("/sub/page.html")
+        (self.www / "sub" / "page.html").unlink()
+        self.assertEqual(resolver.resolve("/sub/page.html").kind, MISSING)
+
+if __name__ == "__main__":
+    unittest.main()
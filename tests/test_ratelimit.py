@@ -0,0 +1,90 @@
+import unittest
+from unittest import mock
+
+import ratelimit
+from ratelimit import RateLimiter
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(ratelimit.time, "monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_bucket(self):
+        limiter = RateLimiter(rate=2, burst=3)
+        self.assertEqual([limiter.allow_request("a") for _ in range(3)], [0, 0, 0])
+        self.assertEqual(limiter.allow_request("a"), 1)     # empty: the next token is half a second away
+        self.assertEqual(limiter.allow_request("b"), 0)     # other clients have their own bucket
+        self.clock.now += 0.5
+        self.assertEqual(limiter.allow_request("a"), 0)
+        self.assertEqual(limiter.allow_request("a"), 1)
+        self.clock.now += 60    # refills, but only up to burst
+        self.assertEqual([limiter.allow_request("a") for _ in range(4)], [0, 0, 0, 1])
+        self.assertEqual(limiter.stats()["limited_requests"], 3)
+
+    def test_slow_rate_retry_after(self):
+        limiter = RateLimiter(rate=0.1, burst=1)
+        self.assertEqual(limiter.allow_request("a"), 0)
+        self.assertEqual(limiter.allow_request("a"), 10)
+
+    def test_connection_cap(self):
+        limiter = RateLimiter(max_connections=2)
+        self.assertTrue(limiter.open_connection("a"))
+        self.assertTrue(limiter.open_connection("a"))
+        self.assertFalse(limiter.open_connection("a"))
+        self.assertTrue(limiter.open_connection("b"))
+        limiter.close_connection("a")
+        self.assertTrue(limiter.open_connection("a"))
+        self.assertEqual(limiter.stats()["limited_connections"], 1)
+
+    def test_disabled(self):
+        limiter = RateLimiter()
+        self.assertFalse(limiter.enabled)
+        self.assertEqual(limiter.allow_request("a"), 0)
+        self.assertTrue(all(limiter.open_connection("a") for _ in range(100)))
+        self.assertEqual(limiter.stats()["clients"], 0)
+
+    def test_least_recently_seen_idle_client_is_evicted(self):
+        limiter = RateLimiter(rate=1, burst=1, max_clients=2)
+        limiter.allow_request("a")
+        limiter.allow_request("b")
+        limiter.allow_request("a")      # a is now the most recently seen
+        limiter.allow_request("c")      # evicts b
+        self.assertEqual(limiter.allow_request("a"), 1)     # a kept its empty bucket
+        self.assertEqual(limiter.allow_request("b"), 0)     # b starts again with a full one
+        self.assertEqual(limiter.stats()["evictions"], 2)
+        self.assertEqual(limiter.stats()["clients"], 2)
+
+    def test_clients_with_open_connections_are_never_evicted(self):
+        limiter = RateLimiter(max_connections=1, max_clients=3)
+        self.assertTrue(limiter.open_connection("a"))
+        # cycling through other addresses must not make the table forget a's connection
+        for i in range(10):
+            ip = f"10.0.0.{i}"
+            self.assertTrue(limiter.open_connection(ip))
+            limiter.close_connection(ip)
+        self.assertFalse(limiter.open_connection("a"))
+        self.assertEqual(limiter.stats()["clients"], 3)
+
+    def test_table_full_of_busy_clients_refuses_new_ones(self):
+        limiter = RateLimiter(rate=1, max_connections=1, max_clients=2)
+        self.assertTrue(limiter.open_connection("a"))
+        self.assertTrue(limiter.open_connection("b"))
+        self.assertFalse(limiter.open_connection("c"))
+        self.assertEqual(limiter.allow_request("c"), ratelimit.CONNECTION_RETRY_AFTER)
+        self.assertEqual(limiter.allow_request("a"), 0)     # the clients already in are unaffected
+        limiter.close_connection("b")
+        self.assertTrue(limiter.open_connection("c"))       # b was idle, so it made room
+        self.assertFalse(limiter.open_connection("a"))
+        self.assertEqual(limiter.stats()["evictions"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
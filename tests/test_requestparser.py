@@ -0,0 +1,143 @@
+import unittest
+
+from requestparser import MAX_LEADING_BLANK_LINES, HttpParseError, RequestParser, body_length
+
+HEAD = b"GET /index.html HTTP/1.1\r\nHost: example.com\r\nAccept: */*\r\n\r\n"
+
+class RequestParserTest(unittest.TestCase):
+    def test_whole_head(self):
+        parser = RequestParser()
+        parser.feed(HEAD)
+        request = parser.next_request()
+        self.assertEqual((request.method, request.path, request.version), ("GET", "/index.html", "HTTP/1.1"))
+        self.assertEqual(request.headers, {"Host": "example.com", "Accept": "*/*"})
+        self.assertIsNone(parser.next_request())
+        self.assertEqual(parser.buffer, b"")
+
+    def test_split_at_every_byte(self):
+        parser = RequestParser()
+        for i in range(len(HEAD) - 1):
+            parser.feed(HEAD[i:i + 1])
+            self.assertIsNone(parser.next_request(), i)
+        parser.feed(HEAD[-1:])
+        request = parser.next_request()
+        self.assertEqual(request.path, "/index.html")
+        self.assertEqual(request.headers["Host"], "example.com")
+
+    def test_split_inside_crlf(self):
+        parser = RequestParser()
+        parser.feed(HEAD[:HEAD.index(b"\r\n") + 1])    # ends between \r and \n
+        self.assertIsNone(parser.next_request())
+        parser.feed(HEAD[HEAD.index(b"\r\n") + 1:])
+        self.assertEqual(parser.next_request().path, "/index.html")
+
+    def test_pipelined_requests_come_out_in_order(self):
+        parser = RequestParser()
+        parser.feed(HEAD + HEAD.replace(b"/index.html", b"/two") + b"GET /thr")
+        self.assertEqual(parser.next_request().path, "/index.html")
+        self.assertEqual(parser.next_request().path, "/two")
+        self.assertIsNone(parser.next_request())
+        parser.feed(b"ee HTTP/1.1\r\n\r\n")
+        self.assertEqual(parser.next_request().path, "/three")
+
+    def test_bare_lf_and_leading_blank_lines(self):
+        parser = RequestParser()
+        parser.feed(b"\r\n\nGET / HTTP/1.0\nHost: x\n\n")
+        request = parser.next_request()
+        self.assertEqual((request.path, request.version, request.headers), ("/", "HTTP/1.0", {"Host": "x"}))
+
+    def test_endless_blank_lines_are_400_and_not_buffered(self):
+        parser = RequestParser()
+        for _ in range(MAX_LEADING_BLANK_LINES):
+            parser.feed(b"\r\n")
+            self.assertIsNone(parser.next_request())
+            self.assertEqual(parser.buffer, b"")
+        parser.feed(b"\r\n" * 100000)
+        with self.assertRaises(HttpParseError) as raised:
+            parser.next_request()
+        self.assertEqual(raised.exception.status, 400)
+
+    def test_blank_lines_between_pipelined_requests(self):
+        parser = RequestParser()
+        parser.feed(HEAD + b"\r\n" * MAX_LEADING_BLANK_LINES + HEAD + b"\r\n" * MAX_LEADING_BLANK_LINES + HEAD)
+        for _ in range(3):
+            self.assertEqual(parser.next_request().path, "/index.html")
+
+    def test_repeated_headers_are_joined(self):
+        parser = RequestParser()
+        parser.feed(b"GET / HTTP/1.1\r\nAccept: a\r\nAccept: b\r\n\r\n")
+        self.assertEqual(parser.next_request().headers["Accept"], "a, b")
+
+    def parse_error(self, data, **limits):
+        parser = RequestParser(**limits)
+        parser.feed(data)
+        with self.assertRaises(HttpParseError) as raised:
+            parser.next_request()
+        # the parser stays broken: nothing after a bad request can be trusted
+        with self.assertRaises(HttpParseError):
+            parser.next_request()
+        return raised.exception.status
+
+    def test_long_request_line_is_414_before_it_ends(self):
+        self.assertEqual(self.parse_error(b"GET /" + b"a" * 200, max_line=100), 414)
+        self.assertEqual(self.parse_error(b"GET /" + b"a" * 200 + b" HTTP/1.1\r\n\r\n", max_line=100), 414)
+
+    def test_oversized_headers_are_431(self):
+        self.assertEqual(self.parse_error(b"GET / HTTP/1.1\r\nX: " + b"a" * 500, max_header_bytes=100), 431)
+        many = b"".join(b"X-%d: y\r\n" % i for i in range(11))
+        self.assertEqual(self.parse_error(b"GET / HTTP/1.1\r\n" + many + b"\r\n", max_headers=10), 431)
+
+    def test_oversized_head_split_over_feeds(self):
+        parser = RequestParser(max_header_bytes=150)   # 9 of these 16-byte lines fit
+        parser.feed(b"GET / HTTP/1.1\r\n")
+        for _ in range(9):
+            parser.feed(b"X-Pad: 0123456\r\n")
+            self.assertIsNone(parser.next_request())
+        parser.feed(b"X-Pad: 0123456\r\n")
+        with self.assertRaises(HttpParseError) as raised:
+            parser.next_request()
+        self.assertEqual(raised.exception.status, 431)
+
+    def test_malformed_heads(self):
+        for head in (b"GET /\r\n\r\n",
+                     b"GET  / HTTP/1.1\r\n\r\n",
+                     b"G(T / HTTP/1.1\r\n\r\n",
+                     b"GET / FTP/1.1\r\n\r\n",
+                     b"GET / HTTP/1.1\r\nNo colon\r\n\r\n",
+                     b"GET / HTTP/1.1\r\nHost : x\r\n\r\n",
+                     b"GET / HTTP/1.1\r\nHost: x\r\n folded\r\n\r\n"):
+            self.assertEqual(self.parse_error(head), 400, head)
+        self.assertEqual(self.parse_error(b"GET / HTTP/2.0\r\n\r\n"), 505)
+
+    def test_discard_drops_a_body(self):
+        parser = RequestParser()
+        parser.feed(b"GET / HTTP/1.1\r\nContent-Length: 5\r\n\r\nhelloGET /next HTTP/1.1\r\n\r\n")
+        parser.next_request()
+        self.assertEqual(parser.discard(5), 5)
+        self.assertEqual(parser.next_request().path, "/next")
+        self.assertEqual(parser.discard(10), 0)
+
+class BodyLengthTest(unittest.TestCase):
+    def status(self, headers):
+        with self.assertRaises(HttpParseError) as raised:
+            body_length(headers)
+        return raised.exception.status
+
+    def test_lengths(self):
+        self.assertEqual(body_length({}), 0)
+        self.assertEqual(body_length({"Content-Length": "0"}), 0)
+        self.assertEqual(body_length({"content-length": " 41 "}), 41)
+        self.assertEqual(body_length({"Content-Length": "7, 7"}), 7)
+        self.assertEqual(body_length({"Content-Length": "7", "CONTENT-LENGTH": "7"}), 7)
+
+    def test_bad_lengths(self):
+        for value in ("", "-1", "+5", "0x10", "1e3", "5, 6", "٥"):
+            self.assertEqual(self.status({"Content-Length": value}), 400, value)
+        self.assertEqual(self.status({"Content-Length": "5", "content-length": "6"}), 400)
+
+    def test_transfer_encoding(self):
+        self.assertEqual(self.status({"Transfer-Encoding": "chunked"}), 411)
+        self.assertEqual(self.status({"Content-Length": "5", "transfer-encoding": "chunked"}), 411)
+
+if __name__ == "__main__":
+    unittest.main()
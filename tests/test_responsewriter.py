@@ -0,0 +1,39 @@
+import os
+import resource
+import socket
+import unittest
+
+from responsewriter import ResponseWriter
+
+HIGH_FD = 1500      # past FD_SETSIZE, where select.select() gives up
+
+@unittest.skipIf(resource.getrlimit(resource.RLIMIT_NOFILE)[0] <= HIGH_FD, "descriptor limit too low")
+class WaitWritableTest(unittest.TestCase):
+    def setUp(self):
+        a, self.peer = socket.socketpair()
+        # move our end to a descriptor select.select() would reject
+        os.dup2(a.fileno(), HIGH_FD)
+        a.close()
+        self.sock = socket.socket(fileno=HIGH_FD)
+        self.sock.settimeout(0.2)
+
+    def tearDown(self):
+        self.sock.close()
+        self.peer.close()
+
+    def test_high_descriptor(self):
+        ResponseWriter(self.sock).wait_writable()
+
+    def test_times_out_when_the_peer_stops_reading(self):
+        self.sock.setblocking(False)
+        try:
+            while True:
+                self.sock.send(b"x" * 65536)
+        except BlockingIOError:
+            pass
+        self.sock.settimeout(0.2)
+        with self.assertRaises(TimeoutError):
+            ResponseWriter(self.sock).wait_writable()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+import json
+import re
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+import server
+from accesslog import AccessLogWriter
+from filecache import CompressedCache, FileCache
+from metrics import MetricsRegistry
+from pathresolver import PathResolver
+
+BODY = bytes(range(256)) * 4    # 1024 bytes, every offset easy to check
+BIG_SIZE = 64 * 1024 * 1024     # more than the socket buffers between a server and a client that doesn't read
+
+def handler():
+    # percent_decode() and parse_range() don't touch the connection, so there's no need for one
+    return server.LabHttpTCPHandler.__new__(server.LabHttpTCPHandler)
+
+class PercentDecodeTest(unittest.TestCase):
+    def test_decodes(self):
+        decode = handler().percent_decode
+        self.assertEqual(decode("/a%20b"), "/a b")
+        self.assertEqual(decode("/%2e%2E/x"), "/../x")
+        self.assertEqual(decode("/caf%C3%A9"), "/café")
+        self.assertEqual(decode("/caf\xc3\xa9"), "/café")  # raw UTF-8, as the parser hands it over
+        self.assertEqual(decode("/100%25"), "/100%")
+
+    def test_bad_escapes(self):
+        decode = handler().percent_decode
+        for path in ("/%", "/a%2", "/%zz", "/%+f", "/% f", "/%-1", "/%0x", "/%C3", "/%ff"):
+            with self.assertRaises(ValueError, msg=path):
+                decode(path)
+
+class ParseRangeTest(unittest.TestCase):
+    def parse(self, value, size=1000):
+        return handler().parse_range(value, size)
+
+    def test_ranges(self):
+        self.assertEqual(self.parse("bytes=0-99"), [(0, 99)])
+        self.assertEqual(self.parse("bytes=900-"), [(900, 999)])
+        self.assertEqual(self.parse("bytes=990-5000"), [(990, 999)])
+        self.assertEqual(self.parse("bytes=0-0, 10-19 ,-5"), [(0, 0), (10, 19), (995, 999)])
+        self.assertEqual(self.parse("BYTES=5-5"), [(5, 5)])
+
+    def test_suffix_ranges(self):
+        self.assertEqual(self.parse("bytes=-1"), [(999, 999)])
+        self.assertEqual(self.parse("bytes=-5000"), [(0, 999)])
+        self.assertEqual(self.parse("bytes=-0"), [])
+        self.assertEqual(self.parse("bytes=-10", size=0), [])
+
+    def test_unsatisfiable_is_empty(self):
+        self.assertEqual(self.parse("bytes=1000-"), [])
+        self.assertEqual(self.parse("bytes=2000-3000,1000-1000"), [])
+
+    def test_ignored(self):
+        for value in ("bytes=5-1", "bytes=", "bytes=-", "bytes=a-b", "bytes=1-2-3", "bytes=+1-2",
+                      "items=0-1", "bytes 0-1", ",".join(["bytes=0-0"] + ["1-1"] * server.MAX_RANGES)):
+            self.assertIsNone(self.parse(value), value)
+
+def read_response(f):
+    # (status, headers, body) off a socket file, framed by Content-Length
+    status_line = f.readline()
+    if not status_line:
+        return None
+    headers = {}
+    while True:
+        line = f.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = f.read(int(headers.get("content-length", 0)))
+    return int(status_line.split()[1]), headers, body
+
+class LiveServerTest(unittest.TestCase):
+    """Requests against a threaded server on a temporary www/."""
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        root = Path(cls.directory.name)
+        www = root / "www"
+        www.mkdir()
+        (www / "data.bin").write_bytes(BODY)
+        (www / "index.html").write_text("<p>hi</p>")
+        with open(www / "big.bin", "wb") as f:
+            f.truncate(BIG_SIZE)
+        cls.log_path = root / "access.jsonl"
+
+        class Handler(server.LabHttpTCPHandler):
+            resolver = PathResolver(www)
+            file_cache = FileCache()
+            compressed_cache = CompressedCache()
+            access_log = AccessLogWriter(cls.log_path, flush_interval=0.05)
+            metrics = MetricsRegistry()
+            keep_alive_timeout = 0.3
+            send_timeout = 0.3
+        cls.handler = Handler
+        cls.server = server.ThreadPoolLabHttpTcpServer(("127.0.0.1", 0), Handler, threads=2)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.handler.access_log.close()
+        cls.directory.cleanup()
+
+    def exchange(self, data):
+        # send data, half-close, and read every response until the server closes
+        with socket.create_connection(self.server.server_address, timeout=5) as sock:
+            sock.sendall(data)
+            sock.shutdown(socket.SHUT_WR)
+            responses = []
+            with sock.makefile("rb") as f:
+                while (response := read_response(f)) is not None:
+                    responses.append(response)
+            return responses
+
+    def wait_for_log(self, match):
+        # the first access log entry match() accepts (the log is written in the background)
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if self.log_path.exists():
+                for line in self.log_path.read_text().splitlines():
+                    entry = json.loads(line)
+                    if match(entry):
+                        return entry
+            time.sleep(0.05)
+        self.fail("no matching access log entry")
+
+    def test_single_range(self):
+        [(status, headers, body)] = self.exchange(
+            b"GET /data.bin HTTP/1.1\r\nHost: x\r\nRange: bytes=-24\r\nConnection: close\r\n\r\n")
+        self.assertEqual(status, 206)
+        self.assertEqual(headers["content-range"], "bytes 1000-1023/1024")
+        self.assertEqual(body, BODY[1000:])
+
+    def test_multiple_ranges_content_length(self):
+        # the next request on the connection only works if Content-Length covered the
+        # multipart body exactly
+        request = b"GET /data.bin HTTP/1.1\r\nHost: x\r\nRange: bytes=0-9,500-509,-3\r\n\r\n"
+        responses = self.exchange(request + b"GET /index.html HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+        self.assertEqual([status for status, _, _ in responses], [206, 200])
+        status, headers, body = responses[0]
+        self.assertEqual(int(headers["content-length"]), len(body))
+        boundary = re.fullmatch(r"multipart/byteranges; boundary=(\S+)", headers["content-type"]).group(1)
+        self.assertTrue(body.endswith(f"\r\n--{boundary}--\r\n".encode()))
+        parts = body.split(f"--{boundary}".encode())[1:-1]
+        expected = [("0-9/1024", BODY[0:10]), ("500-509/1024", BODY[500:510]), ("1021-1023/1024", BODY[1021:])]
+        self.assertEqual(len(parts), len(expected))
+        for part, (content_range, data) in zip(parts, expected):
+            head, _, rest = part.partition(b"\r\n\r\n")
+            self.assertIn(f"Content-Range: bytes {content_range}".encode(), head)
+            self.assertEqual(rest[:-2] if rest.endswith(b"\r\n") else rest, data)
+        self.assertEqual(responses[1][2], b"<p>hi</p>")
+
+    def test_unsatisfiable_range(self):
+        [(status, headers, _)] = self.exchange(
+            b"GET /data.bin HTTP/1.1\r\nHost: x\r\nRange: bytes=5000-\r\nConnection: close\r\n\r\n")
+        self.assertEqual(status, 416)
+        self.assertEqual(headers["content-range"], "bytes */1024")
+
+    def test_get_body_is_not_a_request(self):
+        # A body smuggling a second request must be skipped, not answered.
+        smuggled = b"GET /data.bin HTTP/1.1\r\nHost: x\r\n\r\n"
+        responses = self.exchange(
+            b"GET /nope HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n" % len(smuggled) + smuggled +
+            b"GET /index.html HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+        self.assertEqual([status for status, _, _ in responses], [404, 200])
+        self.assertEqual(responses[1][2], b"<p>hi</p>")
+
+    def test_chunked_body_closes_the_connection(self):
+        responses = self.exchange(
+            b"GET /nope HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"1f\r\nGET /index.html HTTP/1.1\r\n\r\n\r\n0\r\n\r\n")
+        self.assertEqual([(status, headers["connection"]) for status, headers, _ in responses], [(411, "close")])
+
+    def test_bad_content_length_closes_the_connection(self):
+        responses = self.exchange(
+            b"GET / HTTP/1.1\r\nHost: x\r\nContent-Length: 5\r\nContent-Length: 6\r\n\r\nhello!"
+            b"GET /index.html HTTP/1.1\r\n\r\n")
+        self.assertEqual([status for status, _, _ in responses], [400])
+
+    def test_post_body_is_skipped(self):
+        responses = self.exchange(
+            b"POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 3\r\n\r\nabc"
+            b"GET /index.html HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+        self.assertEqual([status for status, _, _ in responses], [405, 200])
+
+    def test_percent_encoded_traversal_is_403(self):
+        for path in (b"/%2e%2e/access.jsonl", b"/..%2Faccess.jsonl"):
+            [(status, _, _)] = self.exchange(b"GET " + path + b" HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+            self.assertEqual(status, 403, path)
+
+    def test_bad_percent_escape_is_400(self):
+        [(status, _, _)] = self.exchange(b"GET /%zz HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+        self.assertEqual(status, 400)
+
+    def test_idle_timeout_is_logged(self):
+        with socket.create_connection(self.server.server_address, timeout=5) as sock:
+            sock.sendall(b"GET /index.html HTTP/1.1\r\nHost: x\r\n\r\n")
+            with sock.makefile("rb") as f:
+                self.assertEqual(read_response(f)[0], 200)
+                self.assertIsNone(read_response(f))     # closed once the keep-alive timeout passes
+        entry = self.wait_for_log(lambda e: e.get("timeout") == "idle")
+        self.assertEqual(entry["status"], 408)
+        self.assertEqual(entry["ip"], "127.0.0.1")
+
+    def test_send_timeout_is_logged(self):
+        with socket.create_connection(self.server.server_address, timeout=5) as sock:
+            # ask for a big file and never read it
+            sock.sendall(b"GET /big.bin HTTP/1.1\r\nHost: x\r\n\r\n")
+            entry = self.wait_for_log(lambda e: e.get("timeout") == "send")
+        self.assertEqual((entry["status"], entry["path"]), (408, "/big.bin"))
+
+if __name__ == "__main__":
+    unittest.main()
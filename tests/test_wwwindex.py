@@ -0,0 +1,126 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from pathresolver import FILE, MISSING, REDIRECT
+from wwwindex import WwwIndex
+
+class WwwIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        top = Path(self.directory.name)
+        self.outside = top / "outside"
+        self.outside.mkdir()
+        (self.outside / "secret.txt").write_text("secret")
+        self.www = top / "www"
+        (self.www / "sub").mkdir(parents=True)
+        (self.www / "index.html").write_text("index")
+        (self.www / "sub" / "page.html").write_text("page")
+        # no poller thread: the tests call poll() themselves
+        self.index = WwwIndex(self.www, lambda path: "text/html", poll_interval=0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def lookup(self, path):
+        found = self.index.lookup(path)
+        if found is None:
+            return None
+        kind, entry = found
+        if kind == FILE:
+            return FILE, Path(entry.path).relative_to(self.index.root).as_posix()
+        return kind
+
+    def test_lookups(self):
+        self.index.build()
+        self.assertEqual(self.lookup("/"), (FILE, "index.html"))
+        self.assertEqual(self.lookup("/sub/page.html"), (FILE, "sub/page.html"))
+        self.assertEqual(self.lookup("//sub//page.html"), (FILE, "sub/page.html"))
+        self.assertEqual(self.lookup("/sub"), REDIRECT)
+        self.assertEqual(self.lookup("/sub/"), MISSING)
+        self.assertEqual(self.lookup("/nope.html"), MISSING)
+
+    def test_dot_dot_goes_to_the_resolver(self):
+        self.index.build()
+        # "." and ".." (already percent-decoded) are never answered from the index
+        for path in ("/..", "/../outside/secret.txt", "/sub/../index.html", "/sub/./page.html",
+                     "/sub/../../outside/secret.txt"):
+            self.assertIsNone(self.lookup(path), path)
+
+    def test_symlinks(self):
+        (self.www / "file-link").symlink_to(self.outside / "secret.txt")
+        (self.www / "dir-link").symlink_to(self.outside)
+        (self.www / "inside-link").symlink_to(self.www / "sub" / "page.html")
+        self.index.build()
+        # a symlink out, or through a directory, is left to the resolver
+        self.assertIsNone(self.lookup("/file-link"))
+        self.assertIsNone(self.lookup("/dir-link/secret.txt"))
+        self.assertIsNone(self.lookup("/dir-link/"))
+        self.assertEqual(self.lookup("/inside-link"), (FILE, "sub/page.html"))
+
+    def test_new_changed_and_deleted_files(self):
+        self.index.build()
+        (self.www / "sub" / "new.html").write_text("new")
+        self.index.poll()
+        self.assertEqual(self.lookup("/sub/new.html"), (FILE, "sub/new.html"))
+        before = self.index.lookup("/sub/page.html")[1]
+        (self.www / "sub" / "page.html").write_text("a longer page")
+        self.index.poll()
+        after = self.index.lookup("/sub/page.html")[1]
+        self.assertEqual(after.size, len("a longer page"))
+        self.assertNotEqual(after.etag, before.etag)
+        (self.www / "sub" / "new.html").unlink()
+        self.index.poll()
+        self.assertEqual(self.lookup("/sub/new.html"), MISSING)
+
+    def test_file_swapped_for_a_symlink_out(self):
+        self.index.build()
+        (self.www / "sub" / "page.html").unlink()
+        (self.www / "sub" / "page.html").symlink_to(self.outside / "secret.txt")
+        self.index.poll()
+        self.assertIsNone(self.lookup("/sub/page.html"))
+
+    def test_directory_swapped_for_a_symlink_out(self):
+        self.index.build()
+        (self.outside / "page.html").write_text("outside")
+        (self.www / "sub").rename(self.www.parent / "old")
+        (self.www / "sub").symlink_to(self.outside)
+        self.index.poll()
+        self.assertIsNone(self.lookup("/sub/page.html"))
+        self.assertIsNone(self.lookup("/sub/secret.txt"))
+
+    def test_directory_swapped_for_another(self):
+        self.index.build()
+        new = self.www.parent / "new"
+        (new / "deeper").mkdir(parents=True)
+        (new / "index.html").write_text("new index")
+        (new / "deeper" / "more.html").write_text("more")
+        os.rename(self.www / "sub", self.www.parent / "old")
+        os.rename(new, self.www / "sub")
+        self.index.poll()
+        self.assertEqual(self.lookup("/sub/page.html"), MISSING)
+        self.assertEqual(self.lookup("/sub/"), (FILE, "sub/index.html"))
+        self.assertEqual(self.lookup("/sub/deeper/more.html"), (FILE, "sub/deeper/more.html"))
+
+    def test_file_swapped_for_a_directory(self):
+        (self.www / "thing").write_text("file")
+        self.index.build()
+        self.assertEqual(self.lookup("/thing"), (FILE, "thing"))
+        (self.www / "thing").unlink()
+        (self.www / "thing").mkdir()
+        (self.www / "thing" / "index.html").write_text("dir")
+        self.index.poll()
+        self.assertEqual(self.lookup("/thing"), REDIRECT)
+        self.assertEqual(self.lookup("/thing/"), (FILE, "thing/index.html"))
+
+    def test_directory_removed(self):
+        self.index.build()
+        (self.www / "sub" / "page.html").unlink()
+        (self.www / "sub").rmdir()
+        self.index.poll()
+        self.assertEqual(self.lookup("/sub"), MISSING)
+        self.assertEqual(self.lookup("/sub/page.html"), MISSING)
+
+if __name__ == "__main__":
+    unittest.main()
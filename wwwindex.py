@@ -0,0 +1,227 @@
+"""
+Index of everything under www/, kept up to date by a background poller.
+"""
+
+import os
+import stat
+import threading
+
+from filecache import describe_file, stat_key
+from pathresolver import FILE, INDEX_FILE, MISSING, REDIRECT
+
+DEFAULT_POLL_INTERVAL = 2.0     # seconds between checks for changed files
+
+class WwwIndex:
+    """Request path -> CachedFile (without contents) for every file under root.
+
+    Built with one walk of the tree at startup, so the handler can answer
+    404s and 301s and build 200 headers from memory. A background thread
+    then re-stat()s the tree every poll_interval seconds: a directory
+    whose stat changed is listed again (picking up new, removed and
+    renamed entries), and a file whose stat changed gets a fresh entry,
+    so deploying new content doesn't need a restart.
+
+    Symlinks are only followed to files that stay inside root. A path that
+    goes through a symlinked directory, a symlink leading outside, or a
+    "." or ".." component isn't answered here: lookup() returns None and
+    the caller falls back to resolving it on disk.
+
+    Lookups only read dicts that the poller replaces entries in one at a
+    time, so they take no lock.
+    """
+    def __init__(self, root, content_type, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.root = os.path.realpath(root)
+        self.content_type = content_type    # function from file name to Content-Type
+        self.poll_interval = poll_interval
+        self.files = {}         # "dir/name.html" -> CachedFile
+        self.dirs = {}          # "dir" ("" for root) -> (stat key, names in it)
+        self.opaque = set()     # symlinks we don't follow; paths through them aren't ours to answer
+        self.scan_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.pid = None
+        self.polls = 0
+        self.changes = 0
+
+    def build(self):
+        with self.scan_lock:
+            self.scan_dir("")
+
+    def ensure_started(self):
+        # Started lazily so that each prefork worker gets its own poller
+        # (threads don't survive fork()).
+        if self.pid == os.getpid() or self.poll_interval <= 0:
+            return
+        with self.scan_lock:
+            if self.pid == os.getpid():
+                return
+            self.stop_event = threading.Event()
+            self.thread = threading.Thread(target=self.run, name="www-index", daemon=True)
+            self.thread.start()
+            self.pid = os.getpid()
+
+    def lookup(self, decoded_path):
+        # Returns (kind, CachedFile or None), or None if the path has to be resolved on disk.
+        self.ensure_started()
+        parts = decoded_path.split("/")
+        if "." in parts or ".." in parts:
+            return None
+        key = "/".join(part for part in parts if part)
+        if self.opaque:
+            prefix = ""
+            for part in key.split("/"):
+                prefix = f"{prefix}/{part}" if prefix else part
+                if prefix in self.opaque:
+                    return None
+        entry = self.files.get(key)
+        if entry is not None:
+            return FILE, entry
+        if key in self.dirs:
+            if not decoded_path.endswith("/"):
+                return REDIRECT, None
+            entry = self.files.get(f"{key}/{INDEX_FILE}" if key else INDEX_FILE)
+            if entry is not None:
+                return FILE, entry
+        return MISSING, None
+
+    def run(self):
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                self.poll()
+            except OSError as e:
+                print(f"www index: {e}")
+
+    def poll(self):
+        with self.scan_lock:
+            self.polls += 1
+            for key, (dir_stat, names) in list(self.dirs.items()):
+                if key not in self.dirs:
+                    continue    # removed along with its parent
+                try:
+                    current = stat_key(os.stat(self.full_path(key)))
+                except OSError:
+                    self.drop(key)
+                    continue
+                if current != dir_stat:
+                    self.refresh_dir(key, current, names)
+            for key, entry in list(self.files.items()):
+                try:
+                    stat_result = os.stat(entry.path)
+                except OSError:
+                    stat_result = None
+                if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+                    self.drop(key)
+                    self.add(key)   # whatever is there now, if anything
+                elif stat_key(stat_result) != entry.key:
+                    self.files[key] = self.make_entry(entry.path, stat_result)
+                    self.changes += 1
+
+    def full_path(self, key):
+        return os.path.join(self.root, key) if key else self.root
+
+    def scan_dir(self, key):
+        # index one directory and everything below it; caller holds scan_lock
+        directory = self.full_path(key)
+        try:
+            dir_stat = stat_key(os.stat(directory))
+            names = os.listdir(directory)
+        except OSError:
+            return
+        self.dirs[key] = (dir_stat, frozenset(names))
+        for name in names:
+            self.add(f"{key}/{name}" if key else name)
+
+    def refresh_dir(self, key, dir_stat, old_names):
+        # A directory's entries changed: index what's new, forget what's gone, and redo
+        # names that now point at something else. The rest stays in place, so lookups
+        # never see a half-built directory.
+        try:
+            names = frozenset(os.listdir(self.full_path(key)))
+        except OSError:     # not a directory any more
+            self.drop(key)
+            self.add(key)
+            return
+        self.dirs[key] = (dir_stat, names)
+        for name in old_names - names:
+            self.drop(f"{key}/{name}" if key else name)
+        for name in names:
+            child = f"{key}/{name}" if key else name
+            if name not in old_names:
+                self.add(child)
+            elif self.classify(child)[:2] != self.indexed_as(child):
+                self.drop(child)
+                self.add(child)
+
+    def classify(self, key):
+        # what's on disk at key: (kind, path to serve, stat_result), kind None if nothing usable
+        path = self.full_path(key)
+        try:
+            link = os.path.islink(path)
+            real = os.path.realpath(path) if link else path
+            stat_result = os.stat(real)
+        except OSError:
+            return None, None, None
+        if link and (stat.S_ISDIR(stat_result.st_mode) or not real.startswith(self.root + os.sep)):
+            return "opaque", None, stat_result
+        if stat.S_ISDIR(stat_result.st_mode):
+            return "dir", None, stat_result
+        if stat.S_ISREG(stat_result.st_mode):
+            return "file", real, stat_result
+        return None, None, None
+
+    def indexed_as(self, key):
+        # (kind, path) as classify() described key when it was indexed
+        if key in self.dirs:
+            return "dir", None
+        if key in self.opaque:
+            return "opaque", None
+        entry = self.files.get(key)
+        if entry is not None:
+            return "file", entry.path
+        return None, None
+
+    def add(self, key):
+        # index one new directory entry (recursively, for a directory)
+        kind, path, stat_result = self.classify(key)
+        if kind == "opaque":
+            self.opaque.add(key)
+        elif kind == "dir":
+            self.scan_dir(key)
+        elif kind == "file":
+            self.files[key] = self.make_entry(path, stat_result)
+        else:
+            return
+        self.changes += 1
+
+    def drop(self, key):
+        # forget an entry and, for a directory, everything below it; caller holds scan_lock
+        if key in self.dirs:
+            prefix = f"{key}/" if key else ""
+            for table in (self.files, self.dirs):
+                for child in [k for k in table if k.startswith(prefix)]:
+                    del table[child]
+            self.dirs.pop(key, None)
+            self.opaque = {k for k in self.opaque if not k.startswith(prefix)}
+            self.changes += 1
+        elif self.files.pop(key, None) is not None:
+            self.changes += 1
+        elif key in self.opaque:
+            self.opaque = self.opaque - {key}
+            self.changes += 1
+
+    def make_entry(self, path, stat_result):
+        return describe_file(path, stat_result, self.content_type(path))
+
+    def close(self):
+        if self.pid == os.getpid():
+            self.stop_event.set()
+            self.thread.join()
+            self.pid = None
+
+    def stats(self):
+        return {
+            "files": len(self.files),
+            "dirs": len(self.dirs),
+            "polls": self.polls,
+            "changes": self.changes,
+        }